@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Fish Audio TTS API.
+
+Answers POST /v1/tts requests with silent audio whose duration is
+proportional to the length of the text, after a delay that simulates the
+network round trip and server-side synthesis. The /v1/tts/live WebSocket
+endpoint answers each text event of a streaming session the same way, with
+an audio event. Used by the benchmark suite to measure the Fish Audio client
+offline, and can be run on its own to point FishAudioTTS(base_url=...) at.
+
+Usage:
+    python benchmarks/fake_fish.py --port 8080 --latency 0.1
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+import ormsgpack
+
+# Characters of text read aloud per second of audio
+CHARS_PER_SECOND = 15.0
+
+# Sample rate of the audio when the request doesn't set one
+DEFAULT_SAMPLE_RATE = 44100
+
+# Key suffix of the WebSocket opening handshake (RFC 6455)
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+
+# WebSocket frame opcodes
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def silence(seconds: float, audio_format: str, sample_rate: int) -> bytes:
+    """Encode silent mono audio in one of the formats of the API."""
+    frames = int(seconds * sample_rate)
+    pcm = b"\x00\x00" * frames
+    if audio_format == "pcm":
+        return pcm
+
+    buffer = io.BytesIO()
+    if audio_format == "wav":
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm)
+    else:
+        import numpy as np
+        import soundfile as sf
+
+        sf.write(buffer, np.zeros(frames, dtype=np.float32), sample_rate, format="MP3")
+    return buffer.getvalue()
+
+
+def read_frame(stream) -> Tuple[int, bytes]:
+    """
+    Read one WebSocket frame sent by a client.
+
+    Returns:
+        The opcode and the unmasked payload, or a close opcode if the
+        connection ended.
+    """
+    header = stream.read(2)
+    if len(header) < 2:
+        return OPCODE_CLOSE, b""
+    opcode = header[0] & 0x0F
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", stream.read(8))[0]
+    # Frames from clients are always masked
+    mask = stream.read(4) if header[1] & 0x80 else b"\x00" * 4
+    payload = stream.read(length)
+    return opcode, bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+
+def write_frame(stream, opcode: int, payload: bytes) -> None:
+    """Write one unfragmented, unmasked WebSocket frame to a client."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    stream.write(header + payload)
+    stream.flush()
+
+
+class FakeFishServer:
+    """A threaded HTTP server imitating the Fish Audio TTS endpoints."""
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        server_rtf: float = 0.02,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Initialize the FakeFishServer class.
+
+        Args:
+            latency: Seconds every response is delayed by.
+            server_rtf: Simulated synthesis time per second of audio.
+            host: Address to listen on.
+            port: Port to listen on, or 0 for any free port.
+        """
+        self.latency = latency
+        self.server_rtf = server_rtf
+        self.requests = 0
+        self.streams = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # WebSocket clients expect the upgrade in an HTTP/1.1 response
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/v1/tts/live":
+                    self.send_error(404)
+                    return
+                key = self.headers.get("Sec-WebSocket-Key", "")
+                accept = hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header(
+                    "Sec-WebSocket-Accept", base64.b64encode(accept).decode()
+                )
+                self.end_headers()
+                self.close_connection = True
+                with server._lock:
+                    server.streams += 1
+
+                request = {}
+                first = True
+                while True:
+                    opcode, payload = read_frame(self.rfile)
+                    if opcode == OPCODE_PING:
+                        write_frame(self.wfile, OPCODE_PONG, payload)
+                        continue
+                    if opcode == OPCODE_CLOSE:
+                        write_frame(self.wfile, OPCODE_CLOSE, payload[:2])
+                        return
+                    if opcode != OPCODE_BINARY:
+                        continue
+
+                    event = ormsgpack.unpackb(payload)
+                    if event["event"] == "start":
+                        request = event["request"]
+                    elif event["event"] == "text":
+                        # Only the first audio waits for the round trip
+                        seconds = len(event["text"]) / CHARS_PER_SECOND
+                        delay = seconds * server.server_rtf
+                        time.sleep(delay + (server.latency if first else 0.0))
+                        first = False
+                        audio = silence(
+                            seconds,
+                            request.get("format") or "mp3",
+                            request.get("sample_rate") or DEFAULT_SAMPLE_RATE,
+                        )
+                        message = {"event": "audio", "audio": audio}
+                        write_frame(self.wfile, OPCODE_BINARY, ormsgpack.packb(message))
+                    elif event["event"] == "stop":
+                        message = {"event": "finish", "reason": "stop"}
+                        write_frame(self.wfile, OPCODE_BINARY, ormsgpack.packb(message))
+
+            def do_POST(self):
+                if self.path != "/v1/tts":
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = ormsgpack.unpackb(self.rfile.read(length))
+                with server._lock:
+                    server.requests += 1
+
+                seconds = len(request["text"]) / CHARS_PER_SECOND
+                time.sleep(server.latency + seconds * server.server_rtf)
+                data = silence(
+                    seconds,
+                    request.get("format") or "mp3",
+                    request.get("sample_rate") or DEFAULT_SAMPLE_RATE,
+                )
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass to FishAudioTTS."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeFishServer":
+        """Serve requests on a background thread."""
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    """Run the fake server in the foreground."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--server-rtf", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = FakeFishServer(args.latency, args.server_rtf, args.host, args.port)
+    print(f"Serving a fake Fish Audio API on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Fixtures of the benchmark suite.
+
+Generates deterministic English-like text and EPUB files of any size, so the
+benchmarks run offline on inputs that are the same from one commit to the
+next.
+"""
+
+import random
+import zipfile
+from pathlib import Path
+from typing import List
+
+# Words the generated sentences are drawn from, with a few recurring names
+WORDS = (
+    "the of and to a in was he she it that his her had with for as on at but "
+    "not by from they you were all said one there would what so up out if "
+    "about into when who them could time no my more like over then only "
+    "night house door road river window light long little old great hand "
+    "eyes voice morning letter garden silence winter stone Frodo Elinor Marsh"
+).split()
+
+# Short texts synthesized by the engine benchmarks
+SHORT_TEXTS = [
+    "The letter arrived on a cold morning in late winter.",
+    "“Where are you going?” she asked, without looking up from the fire.",
+    "He had walked the river road every night for eleven years, and never "
+    "once had the house at the bend shown a light in its upper window.",
+]
+
+_CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+_PACKAGE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">benchmark</dc:identifier>
+    <dc:title>Benchmark Book</dc:title>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{items}
+  </manifest>
+  <spine>
+{itemrefs}
+  </spine>
+</package>
+"""
+
+_NAV = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<body><nav epub:type="toc"><ol>
+{entries}
+</ol></nav></body>
+</html>
+"""
+
+_CHAPTER = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>{title}</title></head>
+<body><h1>{title}</h1>
+{paragraphs}
+</body>
+</html>
+"""
+
+
+def sentence(rng: random.Random) -> str:
+    """Generate one sentence."""
+    words = rng.choices(WORDS, k=rng.randint(4, 28))
+    text = " ".join(words)
+    return text[0].upper() + text[1:] + rng.choice([".", ".", ".", "?", "!"])
+
+
+def paragraphs(count: int, seed: int = 0) -> List[str]:
+    """Generate paragraphs of one to eight sentences."""
+    rng = random.Random(seed)
+    return [
+        " ".join(sentence(rng) for _ in range(rng.randint(1, 8))) for _ in range(count)
+    ]
+
+
+def book_text(paragraph_count: int, seed: int = 0) -> str:
+    """Generate a text of one paragraph per line."""
+    return "\n".join(paragraphs(paragraph_count, seed))
+
+
+def build_epub(path: Path, chapters: int, paragraphs_per_chapter: int) -> Path:
+    """
+    Write an EPUB 3 file with generated chapters.
+
+    Args:
+        path: Path of the EPUB file to write.
+        chapters: Number of chapters.
+        paragraphs_per_chapter: Number of paragraphs in each chapter.
+
+    Returns:
+        The path of the EPUB file.
+    """
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(
+            zipfile.ZipInfo("mimetype"),
+            "application/epub+zip",
+            compress_type=zipfile.ZIP_STORED,
+        )
+        archive.writestr("META-INF/container.xml", _CONTAINER)
+
+        items = []
+        itemrefs = []
+        entries = []
+        for index in range(1, chapters + 1):
+            name = f"chapter{index:03d}.xhtml"
+            title = f"Chapter {index}"
+            body = "\n".join(
+                f"<p>{text}</p>"
+                for text in paragraphs(paragraphs_per_chapter, seed=index)
+            )
+            archive.writestr(
+                f"OEBPS/{name}",
+                _CHAPTER.format(title=title, paragraphs=body),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+            items.append(
+                f'    <item id="c{index}" href="{name}" '
+                'media-type="application/xhtml+xml"/>'
+            )
+            itemrefs.append(f'    <itemref idref="c{index}"/>')
+            entries.append(f'<li><a href="{name}">{title}</a></li>')
+
+        archive.writestr(
+            "OEBPS/content.opf",
+            _PACKAGE.format(items="\n".join(items), itemrefs="\n".join(itemrefs)),
+        )
+        archive.writestr("OEBPS/nav.xhtml", _NAV.format(entries="\n".join(entries)))
+    return path
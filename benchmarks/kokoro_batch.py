@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark of batched Kokoro inference against the per-segment loop.
+
+Synthesizes the same text with several batch sizes and prints the real-time
+factor (synthesis time divided by audio duration, lower is faster) of each.
+
+Usage:
+    python benchmarks/kokoro_batch.py --batch-sizes 1 2 4 8 --segments 64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add the parent directory to the Python path to import the project module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from epub_to_audiobook.kokoro_tts import SAMPLE_RATE, KokoroTTS
+from epub_to_audiobook.segmenter import engine_segments
+
+# Sentences of varied length, cycled to build the benchmark text
+SENTENCES = [
+    "It was a bright cold day in April.",
+    "The clocks were striking thirteen.",
+    "She turned the page and kept reading, long after the candle had burned "
+    "down to a stub and the house had fallen silent around her.",
+    "Nobody answered.",
+    "Far across the valley, the bells of the old church rang out over the "
+    "rooftops, calling the village to the evening service as they had for "
+    "three hundred years.",
+    "Where are you going?",
+]
+
+
+def run(tts: KokoroTTS, text: str, voice: str, batch_size: int) -> dict:
+    """Synthesize the text once and measure the real-time factor."""
+    segments = engine_segments(text, "kokoro")
+    start = time.perf_counter()
+    samples = sum(
+        len(audio)
+        for audio in tts.synthesize_segments(
+            segments, voice=voice, batch_size=batch_size
+        )
+    )
+    elapsed = time.perf_counter() - start
+    duration = samples / SAMPLE_RATE
+    return {
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "audio_seconds": duration,
+        "rtf": elapsed / duration if duration else float("inf"),
+    }
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--segments", type=int, default=64)
+    parser.add_argument("--voice", default="af_heart")
+    parser.add_argument("--lang-code", default="a")
+    args = parser.parse_args()
+
+    text = "\n".join(SENTENCES[i % len(SENTENCES)] for i in range(args.segments))
+    tts = KokoroTTS(lang_code=args.lang_code)
+
+    # Warm up the model and load the voice before timing anything
+    run(tts, SENTENCES[0], args.voice, 1)
+
+    print(f"{'batch':>5}  {'seconds':>8}  {'audio s':>8}  {'RTF':>6}  {'speedup':>7}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        result = run(tts, text, args.voice, batch_size)
+        baseline = baseline or result["rtf"]
+        print(
+            f"{result['batch_size']:>5}  {result['seconds']:>8.2f}  "
+            f"{result['audio_seconds']:>8.1f}  {result['rtf']:>6.3f}  "
+            f"{baseline / result['rtf']:>6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the ONNX Runtime backend of Kokoro against PyTorch.
+
+Synthesizes the same generated text with PyTorch, the ONNX graph and the
+int8-quantized ONNX graph, each in its own process so its peak memory use
+(RSS) is its own, and prints the real-time factor (synthesis time divided by
+audio duration, lower is faster), the peak RSS and how much the audio of each
+ONNX backend differs from the PyTorch audio: the difference in duration, the
+signal-to-noise ratio of segments of equal length, and the mean difference of
+the long-term spectrum, which doesn't depend on the segments lining up.
+
+Usage:
+    python benchmarks/kokoro_onnx.py --paragraphs 20 --threads 4
+    python benchmarks/kokoro_onnx.py --backends torch onnx --onnx-model kokoro.onnx
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# Add the parent directory to the Python path to import the project module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import fixtures  # noqa: E402
+from suite import peak_rss_mb  # noqa: E402
+
+# Backends compared, with the ONNX options of each (None for PyTorch)
+BACKENDS = {
+    "torch": None,
+    "onnx": {"quantized": False},
+    "onnx-int8": {"quantized": True},
+}
+
+# FFT size of the long-term spectrum the audio is compared with
+SPECTRUM_SIZE = 1024
+
+
+def run_backend(args) -> Dict:
+    """Synthesize the text with one backend, saving the audio of each segment."""
+    from epub_to_audiobook.jobs import create_kokoro
+    from epub_to_audiobook.kokoro_tts import SAMPLE_RATE
+    from epub_to_audiobook.segmenter import engine_segments
+
+    onnx_options = BACKENDS[args.run_backend]
+    if onnx_options is not None:
+        onnx_options = dict(onnx_options, threads=args.threads)
+        if args.onnx_model and args.run_backend == "onnx":
+            onnx_options["model_path"] = args.onnx_model
+    elif args.threads:
+        import torch
+
+        torch.set_num_threads(args.threads)
+
+    try:
+        tts = create_kokoro(args.lang_code, None, onnx_options)
+        # Warm up the model and load the voice before timing anything
+        for _ in tts.synthesize_segments(fixtures.SHORT_TEXTS[:1], voice=args.voice):
+            pass
+    except Exception as e:
+        return {"skipped": f"{args.run_backend} unavailable: {e}"}
+
+    text = fixtures.book_text(args.paragraphs)
+    start = time.perf_counter()
+    segments = list(
+        tts.synthesize_segments(
+            engine_segments(text, "kokoro"), voice=args.voice, pipeline_depth=0
+        )
+    )
+    seconds = time.perf_counter() - start
+    np.savez(args.audio, *segments)
+
+    audio_seconds = sum(len(audio) for audio in segments) / SAMPLE_RATE
+    return {
+        "seconds": seconds,
+        "audio_seconds": audio_seconds,
+        "rtf": seconds / audio_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def spectrum_db(audio: np.ndarray) -> np.ndarray:
+    """Return the long-term power spectrum of the audio in dB."""
+    frames = len(audio) // SPECTRUM_SIZE
+    if not frames:
+        return np.zeros(SPECTRUM_SIZE // 2 + 1)
+    blocks = audio[: frames * SPECTRUM_SIZE].reshape(frames, SPECTRUM_SIZE)
+    power = np.mean(np.abs(np.fft.rfft(blocks * np.hanning(SPECTRUM_SIZE))) ** 2, 0)
+    return 10 * np.log10(np.maximum(power, 1e-12))
+
+
+def compare_audio(reference: List[np.ndarray], audio: List[np.ndarray]) -> Dict:
+    """Measure how much the audio of a backend differs from the reference."""
+    reference_samples = sum(len(segment) for segment in reference)
+    samples = sum(len(segment) for segment in audio)
+
+    snrs = []
+    for expected, actual in zip(reference, audio):
+        if len(expected) == len(actual) and len(expected):
+            noise = np.mean((expected - actual) ** 2)
+            signal = np.mean(expected**2)
+            snrs.append(10 * np.log10(signal / max(noise, 1e-20)))
+
+    spectrum_difference = np.mean(
+        np.abs(
+            spectrum_db(np.concatenate(reference)) - spectrum_db(np.concatenate(audio))
+        )
+    )
+    return {
+        "duration_difference": samples / reference_samples - 1,
+        "snr_db": float(np.median(snrs)) if snrs else None,
+        "equal_length_segments": len(snrs),
+        "spectrum_difference_db": float(spectrum_difference),
+    }
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument(
+        "--onnx-model", help="Exported graph used by the 'onnx' backend"
+    )
+    parser.add_argument("--paragraphs", type=int, default=20)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--voice", default="af_heart")
+    parser.add_argument("--lang-code", default="a")
+    parser.add_argument("--output", type=Path, help="File to write the results to")
+    parser.add_argument("--run-backend", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--audio", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        print(json.dumps(run_backend(args)))
+        return
+
+    results = {}
+    audio = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            path = os.path.join(directory, f"{backend}.npz")
+            argv = [
+                sys.executable,
+                __file__,
+                "--run-backend",
+                backend,
+                "--audio",
+                path,
+                "--paragraphs",
+                str(args.paragraphs),
+                "--voice",
+                args.voice,
+                "--lang-code",
+                args.lang_code,
+            ]
+            if args.threads:
+                argv += ["--threads", str(args.threads)]
+            if args.onnx_model:
+                argv += ["--onnx-model", args.onnx_model]
+            print(f"Running {backend}...", file=sys.stderr)
+            completed = subprocess.run(argv, capture_output=True, text=True)
+            if completed.returncode != 0:
+                results[backend] = {"error": completed.stderr.strip().splitlines()[-1:]}
+                continue
+            results[backend] = json.loads(completed.stdout.strip().splitlines()[-1])
+            if os.path.exists(path):
+                with np.load(path) as segments:
+                    audio[backend] = [segments[name] for name in segments.files]
+
+    if "torch" in audio:
+        for backend in audio:
+            if backend != "torch":
+                results[backend].update(compare_audio(audio["torch"], audio[backend]))
+
+    print(
+        f"{'backend':<10}  {'RTF':>6}  {'RSS MB':>7}  {'duration':>8}  "
+        f"{'SNR dB':>6}  {'spectrum dB':>11}"
+    )
+    for backend, result in results.items():
+        if "rtf" not in result:
+            print(f"{backend:<10}  {result.get('skipped') or result.get('error')}")
+            continue
+        duration = result.get("duration_difference")
+        snr = result.get("snr_db")
+        spectrum = result.get("spectrum_difference_db")
+        print(
+            f"{backend:<10}  {result['rtf']:>6.3f}  {result['peak_rss_mb']:>7.0f}  "
+            f"{f'{duration:+.2%}' if duration is not None else '-':>8}  "
+            f"{f'{snr:.1f}' if snr is not None else '-':>6}  "
+            f"{f'{spectrum:.2f}' if spectrum is not None else '-':>11}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark of applying a large pronunciation lexicon to a novel-sized text.
+
+Builds a random lexicon and a text in which some of its words recur, and
+prints the time taken to compile the lexicon and to mark up the text.
+
+Usage:
+    python benchmarks/lexicon.py --entries 10000 --words 180000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+# Add the parent directory to the Python path to import the project module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from epub_to_audiobook.lexicon import Lexicon
+
+# Common words that fill the text between lexicon entries
+FILLER = ["the", "and", "of", "to", "a", "in", "was", "he", "she", "said"]
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=180000)
+    parser.add_argument("--engine", choices=["fish", "kokoro"], default="kokoro")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entries = {}
+    while len(entries) < args.entries:
+        word = "".join(rng.choices(string.ascii_letters, k=rng.randint(4, 12)))
+        entries[word] = "".join(rng.choices("abdefhijklmnoprstuvwzæðŋɑɔəɛɪʃʊʌʒθ", k=8))
+
+    # One word in ten is a lexicon entry, drawn from a few hundred names
+    names = list(entries)[:500]
+    text = " ".join(
+        rng.choice(names) if rng.random() < 0.1 else rng.choice(FILLER)
+        for _ in range(args.words)
+    )
+
+    start = time.perf_counter()
+    lexicon = Lexicon(entries)
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexicon.apply(text, args.engine)
+    applied = time.perf_counter() - start
+
+    print(f"{len(lexicon)} entries, {len(text)} characters of text")
+    print(f"compile: {compiled:.3f}s")
+    print(f"apply:   {applied:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark of Kokoro synthesis speed across segment length targets.
+
+Synthesizes the same text with several target segment lengths, and with the
+old one-segment-per-line split for comparison, and prints the number of
+segments and the real-time factor (synthesis time divided by audio duration,
+lower is faster) of each.
+
+Usage:
+    python benchmarks/segment_length.py --lengths 100 250 400 --paragraphs 32
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+# Add the parent directory to the Python path to import the project module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from epub_to_audiobook.kokoro_tts import SAMPLE_RATE, KokoroTTS
+from epub_to_audiobook.segmenter import engine_segments
+
+# Paragraphs of dialogue and narration, cycled to build the benchmark text
+PARAGRAPHS = [
+    "“Where are you going?” she asked.",
+    "“Out.”",
+    "It was a bright cold day in April, and the clocks were striking "
+    "thirteen. Winston Smith, his chin nuzzled into his breast in an effort "
+    "to escape the vile wind, slipped quickly through the glass doors of "
+    "Victory Mansions, though not quickly enough to prevent a swirl of "
+    "gritty dust from entering along with him.",
+    "“When will you be back?”",
+    "He didn't answer. The door closed behind him, and the house fell silent.",
+]
+
+
+def run(tts: KokoroTTS, segments: List[str], voice: str, batch_size: int = 1) -> dict:
+    """Synthesize the segments once and measure the real-time factor."""
+    start = time.perf_counter()
+    samples = sum(
+        len(audio)
+        for audio in tts.synthesize_segments(
+            segments, voice=voice, batch_size=batch_size
+        )
+    )
+    elapsed = time.perf_counter() - start
+    duration = samples / SAMPLE_RATE
+    return {
+        "seconds": elapsed,
+        "audio_seconds": duration,
+        "rtf": elapsed / duration if duration else float("inf"),
+    }
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 250, 400])
+    parser.add_argument("--paragraphs", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--voice", default="af_heart")
+    parser.add_argument("--lang-code", default="a")
+    args = parser.parse_args()
+
+    text = "\n".join(PARAGRAPHS[i % len(PARAGRAPHS)] for i in range(args.paragraphs))
+    tts = KokoroTTS(lang_code=args.lang_code)
+
+    # Warm up the model and load the voice before timing anything
+    run(tts, engine_segments(PARAGRAPHS[0], "kokoro"), args.voice)
+
+    configurations = [("lines", {"split_pattern": r"\n+"})] + [
+        (str(length), {"segment_length": length}) for length in args.lengths
+    ]
+
+    print(f"{'target':>6}  {'segments':>8}  {'seconds':>8}  {'audio s':>8}  {'RTF':>6}")
+    for name, options in configurations:
+        segments = engine_segments(text, "kokoro", **options)
+        result = run(tts, segments, args.voice, args.batch_size)
+        print(
+            f"{name:>6}  {len(segments):>8}  {result['seconds']:>8.2f}  "
+            f"{result['audio_seconds']:>8.1f}  {result['rtf']:>6.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
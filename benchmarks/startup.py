@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Startup time check of the command line interface.
+
+Runs the help and argument validation paths of each command in a fresh
+interpreter, and fails if any of them imports a heavy dependency or takes
+longer than the time budget. Engines and their dependencies should only be
+loaded by the code paths that use them.
+
+Usage:
+    python benchmarks/startup.py --budget 250 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules that must not be imported by the help and validation paths
+HEAVY_MODULES = [
+    "asyncio",
+    "dotenv",
+    "fish_audio_sdk",
+    "httpx",
+    "kokoro",
+    "numpy",
+    "soundfile",
+    "torch",
+]
+
+# Command lines that only print help or fail argument validation
+SCENARIOS = {
+    "help": ["--help"],
+    "book help": ["book", "--help"],
+    "assemble help": ["assemble", "--help"],
+    "daemon help": ["daemon", "--help"],
+    "batch help": ["batch", "--help"],
+    "serve help": ["serve", "--help"],
+    "plan help": ["plan", "--help"],
+    "missing text": [],
+    "bad batch size": ["Hello", "--batch-size", "0"],
+    "bad fish format": ["Hello", "--engine", "fish", "--format", "m4b"],
+    "bad workers": ["book", "book.epub", "--workers", "0"],
+    "bad segment seconds": ["serve", "book.epub", "--segment-seconds", "0"],
+}
+
+# Runs the CLI and prints the heavy modules it imported as JSON
+CHILD = """
+import json, os, sys
+real_stdout = sys.stdout
+sys.stdout = sys.stderr = open(os.devnull, "w")
+from epub_to_audiobook.cli import main
+try:
+    main(json.loads(sys.argv[1]))
+except SystemExit:
+    pass
+heavy = json.loads(sys.argv[2])
+loaded = sorted(name for name in heavy if name in sys.modules)
+real_stdout.write(json.dumps(loaded))
+"""
+
+
+def run_scenario(argv, repeat: int):
+    """Run a command line several times, returning its imports and run times."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                CHILD,
+                json.dumps(argv),
+                json.dumps(HEAVY_MODULES),
+            ],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+        loaded = json.loads(result.stdout)
+    return loaded, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--budget",
+        help="Largest median run time allowed per command line, in milliseconds",
+        type=float,
+        default=250.0,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of runs per command line",
+        type=int,
+        default=5,
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    print(f"{'scenario':<20} {'median ms':>10}  heavy imports")
+    for name, argv in SCENARIOS.items():
+        loaded, times = run_scenario(argv, args.repeat)
+        median = statistics.median(times) * 1000
+        failed = bool(loaded) or median > args.budget
+        failures += failed
+        print(
+            f"{name:<20} {median:>10.1f}  {', '.join(loaded) or '-'}"
+            f"{'  FAIL' if failed else ''}"
+        )
+
+    if failures:
+        print(f"{failures} command lines over budget or importing heavy modules")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of the conversion pipeline.
+
+Measures each stage of the pipeline on generated fixtures: EPUB parsing,
+segmentation, G2P, Kokoro and Fish Audio synthesis (against a local fake
+Fish Audio server, with concurrent requests and with a WebSocket stream),
+and encoding. Each stage runs in its own process so its peak memory use
+(RSS) is measured on its own. Stages whose dependencies or model weights
+are unavailable are reported as skipped.
+
+Results are written as JSON, and can be compared with the results of an
+earlier commit to catch regressions.
+
+Usage:
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --stages epub_parse encoding --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Add the parent directory to the Python path to import the project module
+sys.path.insert(0, str(ROOT))
+
+import fixtures  # noqa: E402
+
+# Metrics where a lower value is better, compared between runs
+COMPARED_METRICS = ["seconds", "rtf", "peak_rss_mb"]
+
+
+class Skipped(Exception):
+    """Raised by a stage that can't run in this environment."""
+
+
+def epub_parse(args) -> Dict:
+    """Parse a generated EPUB file into chapters."""
+    from epub_to_audiobook.epub_handler import extract_chapters
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = fixtures.build_epub(
+            Path(directory) / "book.epub", args.chapters, args.paragraphs
+        )
+        start = time.perf_counter()
+        chapters = extract_chapters(str(path))
+        seconds = time.perf_counter() - start
+
+    characters = sum(len(chapter["text"]) for chapter in chapters)
+    return {
+        "seconds": seconds,
+        "chapters": len(chapters),
+        "characters": characters,
+        "mb_per_second": characters / seconds / 1e6,
+    }
+
+
+def segmentation(args) -> Dict:
+    """Segment a generated book for each engine."""
+    from epub_to_audiobook.segmenter import engine_segments
+
+    text = fixtures.book_text(args.chapters * args.paragraphs)
+    result = {"characters": len(text)}
+    total = 0.0
+    for engine in ["kokoro", "fish"]:
+        start = time.perf_counter()
+        segments = engine_segments(text, engine)
+        seconds = time.perf_counter() - start
+        total += seconds
+        result[f"{engine}_segments"] = len(segments)
+        result[f"{engine}_seconds"] = seconds
+    result["seconds"] = total
+    return result
+
+
+def g2p(args) -> Dict:
+    """Phonemize generated segments with Kokoro's G2P, cold and cached."""
+    try:
+        from kokoro import KPipeline
+
+        from epub_to_audiobook.phonemes import PhonemeCache
+        from epub_to_audiobook.segmenter import engine_segments
+
+        pipeline = KPipeline(lang_code=args.lang_code, model=False)
+    except Exception as e:
+        raise Skipped(f"Kokoro G2P unavailable: {e}")
+
+    cache = PhonemeCache(args.lang_code)
+    cache.install(pipeline)
+    segments = engine_segments(fixtures.book_text(args.paragraphs), "kokoro")
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        for segment in segments:
+            pipeline.g2p(segment)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "seconds": timings[0],
+        "cached_seconds": timings[1],
+        "segments": len(segments),
+        "phoneme_cache": cache.stats(),
+    }
+
+
+def kokoro(args) -> Dict:
+    """Synthesize short fixture texts with Kokoro."""
+    try:
+        from epub_to_audiobook.kokoro_tts import SAMPLE_RATE, KokoroTTS
+        from epub_to_audiobook.segmenter import engine_segments
+
+        tts = KokoroTTS(lang_code=args.lang_code)
+        # Warm up the model and load the voice before timing anything
+        for _ in tts.synthesize_segments(fixtures.SHORT_TEXTS[:1], voice=args.voice):
+            pass
+    except Exception as e:
+        raise Skipped(f"Kokoro model unavailable: {e}")
+
+    segments = engine_segments("\n".join(fixtures.SHORT_TEXTS * args.repeat), "kokoro")
+    start = time.perf_counter()
+    samples = sum(
+        len(audio) for audio in tts.synthesize_segments(segments, voice=args.voice)
+    )
+    seconds = time.perf_counter() - start
+    audio_seconds = samples / SAMPLE_RATE
+    return {
+        "seconds": seconds,
+        "audio_seconds": audio_seconds,
+        "rtf": seconds / audio_seconds,
+    }
+
+
+def fish(args) -> Dict:
+    """Synthesize a generated chapter with Fish Audio against a fake server."""
+    from fake_fish import CHARS_PER_SECOND, FakeFishServer
+
+    from epub_to_audiobook.fish_audio import FishAudioTTS
+
+    text = fixtures.book_text(args.paragraphs)
+    with FakeFishServer(latency=args.fish_latency) as server:
+        tts = FishAudioTTS(
+            api_key="benchmark", concurrency=args.concurrency, base_url=server.url
+        )
+        output = io.BytesIO()
+        start = time.perf_counter()
+        asyncio.run(tts.text_to_speech_async(text, output, audio_format="pcm"))
+        seconds = time.perf_counter() - start
+
+    audio_seconds = len(text) / CHARS_PER_SECOND
+    return {
+        "seconds": seconds,
+        "audio_seconds": audio_seconds,
+        "rtf": seconds / audio_seconds,
+        "requests": server.requests,
+    }
+
+
+class _TimedOutput(io.BytesIO):
+    """An in-memory output that records when audio is first written to it."""
+
+    first_write = None
+
+    def write(self, data) -> int:
+        if self.first_write is None and data:
+            self.first_write = time.perf_counter()
+        return super().write(data)
+
+
+def fish_stream(args) -> Dict:
+    """Stream a generated chapter with Fish Audio over a fake WebSocket server."""
+    from fake_fish import CHARS_PER_SECOND, FakeFishServer
+
+    from epub_to_audiobook.fish_audio import FishAudioTTS
+
+    text = fixtures.book_text(args.paragraphs)
+    with FakeFishServer(latency=args.fish_latency) as server:
+        tts = FishAudioTTS(api_key="benchmark", base_url=server.url)
+        output = _TimedOutput()
+        start = time.perf_counter()
+        tts.text_to_speech_stream(text, output, audio_format="pcm")
+        seconds = time.perf_counter() - start
+
+    audio_seconds = len(text) / CHARS_PER_SECOND
+    return {
+        "seconds": seconds,
+        "first_audio_seconds": output.first_write - start,
+        "audio_seconds": audio_seconds,
+        "rtf": seconds / audio_seconds,
+        "streams": server.streams,
+    }
+
+
+def encoding(args) -> Dict:
+    """Encode generated audio in each output format, a second at a time."""
+    import numpy as np
+
+    from epub_to_audiobook.encoders import ENCODER_FORMATS, open_encoder
+
+    samplerate = 24000
+    rng = np.random.default_rng(0)
+    block = (0.1 * rng.standard_normal(samplerate)).astype(np.float32)
+
+    result = {"audio_seconds": args.audio_seconds}
+    total = 0.0
+    for audio_format in ENCODER_FORMATS:
+        output = io.BytesIO()
+        start = time.perf_counter()
+        try:
+            with open_encoder(output, audio_format, samplerate) as encoder:
+                for _ in range(args.audio_seconds):
+                    encoder.write(block)
+        except RuntimeError as e:
+            result[f"{audio_format}_skipped"] = str(e)
+            continue
+        seconds = time.perf_counter() - start
+        total += seconds
+        result[f"{audio_format}_rtf"] = seconds / args.audio_seconds
+        result[f"{audio_format}_bytes"] = len(output.getvalue())
+    result["seconds"] = total
+    return result
+
+
+# Stages of the suite, in the order they run
+STAGES: Dict[str, Callable[[argparse.Namespace], Dict]] = {
+    "epub_parse": epub_parse,
+    "segmentation": segmentation,
+    "g2p": g2p,
+    "kokoro": kokoro,
+    "fish": fish,
+    "fish_stream": fish_stream,
+    "encoding": encoding,
+}
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of this process in megabytes."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_stage(name: str, args) -> Dict:
+    """Run one stage in this process and return its results."""
+    try:
+        result = STAGES[name](args)
+    except Skipped as e:
+        return {"skipped": str(e)}
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_in_subprocess(name: str, argv) -> Dict:
+    """Run one stage in a fresh process, so its peak RSS is its own."""
+    completed = subprocess.run(
+        [sys.executable, __file__, "--run-stage", name, *argv],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    """Return the commit the suite runs on, if it can be found."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> int:
+    """
+    Print the change of each compared metric since a baseline.
+
+    Returns:
+        The number of metrics that got worse by more than the tolerance.
+    """
+    regressions = 0
+    print(f"\n{'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for stage, result in current["results"].items():
+        old = baseline.get("results", {}).get(stage, {})
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in old or not old[metric]:
+                continue
+            change = result[metric] / old[metric] - 1
+            regressed = change > tolerance
+            regressions += regressed
+            print(
+                f"{stage + '.' + metric:<28} {old[metric]:>10.3f} "
+                f"{result[metric]:>10.3f} {change:>+8.0%}"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES))
+    parser.add_argument("--output", type=Path, help="File to write results to")
+    parser.add_argument(
+        "--compare", type=Path, help="Results of an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown reported as a regression",
+    )
+    parser.add_argument("--run-stage", choices=list(STAGES), help=argparse.SUPPRESS)
+
+    fixture_group = parser.add_argument_group("Fixture options")
+    fixture_group.add_argument("--chapters", type=int, default=40)
+    fixture_group.add_argument("--paragraphs", type=int, default=60)
+    fixture_group.add_argument("--repeat", type=int, default=3)
+    fixture_group.add_argument("--audio-seconds", type=int, default=60)
+    fixture_group.add_argument("--lang-code", default="a")
+    fixture_group.add_argument("--voice", default="af_heart")
+    fixture_group.add_argument("--concurrency", type=int, default=4)
+    fixture_group.add_argument("--fish-latency", type=float, default=0.05)
+    args, _ = parser.parse_known_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage, args)))
+        return
+
+    # Fixture options are passed on to the stage processes
+    argv = [
+        arg
+        for option, value in vars(args).items()
+        if option
+        in (
+            "chapters",
+            "paragraphs",
+            "repeat",
+            "audio_seconds",
+            "lang_code",
+            "voice",
+            "concurrency",
+            "fish_latency",
+        )
+        for arg in (f"--{option.replace('_', '-')}", str(value))
+    ]
+
+    results = {}
+    for name in args.stages or STAGES:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = run_in_subprocess(name, argv)
+        summary = results[name]
+        if "skipped" in summary or "error" in summary:
+            print(f"  {summary.get('skipped') or summary['error']}", file=sys.stderr)
+        else:
+            print(
+                f"  {summary['seconds']:.3f}s, "
+                f"{summary['peak_rss_mb']:.0f} MB peak RSS"
+                + (f", RTF {summary['rtf']:.3f}" if "rtf" in summary else ""),
+                file=sys.stderr,
+            )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"{regressions} metrics regressed", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
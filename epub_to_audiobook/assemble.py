@@ -0,0 +1,763 @@
+"""
+Audiobook assembly module.
+
+This module packages the chapter audio files written by the book command
+into a single audiobook with chapter markers: an M4B file with QuickTime
+chapters, or an MP3 file with ID3 CHAP and CTOC frames. Chapter files that
+are already in a compatible codec are stream-copied rather than re-encoded,
+so assembling a long book takes seconds.
+"""
+
+import json
+import mmap
+import shutil
+import struct
+import subprocess
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from epub_to_audiobook.book import MANIFEST_NAME
+
+# Output extensions assembled into an MP4 container
+MP4_EXTENSIONS = [".m4b", ".m4a", ".mp4"]
+
+# Chapter formats that can be stream-copied into an MP4 container
+MP4_COPY_FORMATS = ["aac", "m4b"]
+
+# Bitrates of MPEG Layer III frames in kbit/s, by MPEG-1 and MPEG-2/2.5
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Sample rates of MPEG-1 frames in Hz, halved for MPEG-2 and quartered for 2.5
+_MP3_SAMPLE_RATES = [44100, 48000, 32000]
+
+# Maximum number of entries of one ID3 CTOC frame
+_CTOC_MAX_ENTRIES = 255
+
+# Sample rates of AAC streams in Hz, by the index in ADTS headers
+_AAC_SAMPLE_RATES = [
+    96000,
+    88200,
+    64000,
+    48000,
+    44100,
+    32000,
+    24000,
+    22050,
+    16000,
+    12000,
+    11025,
+    8000,
+    7350,
+]
+
+# Number of samples of an AAC-LC frame
+_AAC_FRAME_SAMPLES = 1024
+
+# Number of bytes read at a time from ffmpeg when decoding chapters
+_DECODE_CHUNK_BYTES = 256 * 1024
+
+
+def audio_duration(path: Path) -> float:
+    """
+    Measure the duration of an audio file without decoding it fully.
+
+    Args:
+        path: Path to the audio file.
+
+    Returns:
+        The duration in seconds.
+
+    Raises:
+        RuntimeError: If the duration can't be determined.
+    """
+    import soundfile as sf
+
+    if Path(path).suffix.lower() == ".mp3":
+        # Count the frames that are copied on assembly, encoder padding included,
+        # so chapter markers don't drift over a long book
+        return _mp3_duration(path)
+    if Path(path).suffix.lower() == ".aac":
+        # Likewise, count the ADTS frames rather than trust the estimate of
+        # ffprobe, which it derives from the bitrate
+        frames, samplerate = _adts_frames(path)
+        if not samplerate:
+            raise RuntimeError(f"Could not read the duration of {path}")
+        return frames * _AAC_FRAME_SAMPLES / samplerate
+
+    try:
+        return sf.info(str(path)).duration
+    except RuntimeError:
+        pass
+
+    # libsndfile doesn't read MP4, so fall back to ffprobe
+    try:
+        return float(_ffprobe(path, "format=duration"))
+    except ValueError:
+        raise RuntimeError(f"Could not read the duration of {path}")
+
+
+def _ffprobe(path: Path, entries: str) -> str:
+    """
+    Read one entry of the metadata of a media file with ffprobe.
+
+    Args:
+        path: Path to the media file.
+        entries: The entry to show, such as 'format=duration'.
+
+    Returns:
+        The value of the entry, or an empty string if it couldn't be read.
+
+    Raises:
+        RuntimeError: If ffprobe is not installed.
+    """
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        raise RuntimeError(
+            f"ffprobe is required to read {path}. "
+            "Install it with: brew install ffmpeg (or apt-get install ffmpeg)"
+        )
+    result = subprocess.run(
+        [
+            ffprobe,
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            entries,
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            str(path),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def _adts_frames(path: Path) -> Tuple[int, int]:
+    """
+    Count the AAC frames of an ADTS stream.
+
+    Returns:
+        The number of frames and the sample rate of the stream in Hz, or a
+        zero sample rate if the file has no ADTS frame.
+    """
+    frames = 0
+    samplerate = 0
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        position = 0
+        end = len(data)
+        while position + 7 <= end:
+            header = data[position : position + 7]
+            length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+            rate_index = (header[2] >> 2) & 0x0F
+            # Sync word, MPEG layer 0 and a frame at least as long as its header
+            if (
+                header[0] != 0xFF
+                or header[1] & 0xF6 != 0xF0
+                or rate_index >= len(_AAC_SAMPLE_RATES)
+                or length < 7
+            ):
+                # Skip junk between frames up to the next sync byte
+                position = data.find(b"\xff", position + 1, end)
+                if position < 0:
+                    break
+                continue
+            samplerate = samplerate or _AAC_SAMPLE_RATES[rate_index]
+            # A frame may hold several raw data blocks
+            frames += (header[6] & 0x03) + 1
+            position += length
+    return frames, samplerate
+
+
+def _aac_samplerate(path: Path) -> int:
+    """Read the sample rate of an AAC or MP4 audio file."""
+    if Path(path).suffix.lower() == ".aac":
+        samplerate = _adts_frames(path)[1]
+    else:
+        value = _ffprobe(path, "stream=sample_rate")
+        samplerate = int(value) if value.isdigit() else 0
+    if not samplerate:
+        raise RuntimeError(f"Could not read the sample rate of {path}")
+    return samplerate
+
+
+def _decode_blocks(ffmpeg: str, path: Path, samplerate: int) -> Iterator:
+    """
+    Decode an audio file with ffmpeg, for the formats libsndfile can't read.
+
+    Args:
+        ffmpeg: Path to the ffmpeg executable.
+        path: Path to the audio file.
+        samplerate: Sample rate to decode the audio at, in Hz.
+
+    Yields:
+        Blocks of mono float32 samples as numpy arrays.
+
+    Raises:
+        RuntimeError: If ffmpeg fails.
+    """
+    import numpy as np
+
+    with subprocess.Popen(
+        [
+            ffmpeg,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            str(path),
+            "-f",
+            "f32le",
+            "-ar",
+            str(samplerate),
+            "-ac",
+            "1",
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        pending = b""
+        while True:
+            chunk = process.stdout.read(_DECODE_CHUNK_BYTES)
+            if not chunk:
+                break
+            # Keep the bytes of a sample split across reads for the next block
+            pending += chunk
+            usable = len(pending) - len(pending) % 4
+            yield np.frombuffer(pending[:usable], dtype="<f4")
+            pending = pending[usable:]
+        errors = process.stderr.read()
+    if process.returncode != 0:
+        message = errors.decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {message}")
+
+
+def chapter_markers(chapters: List[Dict], durations: List[float]) -> List[Dict]:
+    """
+    Lay out chapter markers end to end.
+
+    Args:
+        chapters: The chapters of the manifest, with 'title' and 'level'.
+        durations: The duration of each chapter file in seconds.
+
+    Returns:
+        One marker per chapter with its 'title', 'level', and 'start' and 'end'
+        times in milliseconds.
+    """
+    markers = []
+    start = 0.0
+    for chapter, duration in zip(chapters, durations):
+        end = start + duration
+        markers.append(
+            {
+                "title": chapter["title"],
+                "level": chapter.get("level", 0),
+                "start": round(start * 1000),
+                "end": round(end * 1000),
+            }
+        )
+        start = end
+    return markers
+
+
+def _escape_ffmetadata(value: str) -> str:
+    """Escape the special characters of an ffmetadata value."""
+    for char in "\\=;#\n":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def write_ffmetadata(markers: List[Dict], title: str, path: Path) -> None:
+    """
+    Write the chapters and title of a book as an ffmetadata file.
+
+    MP4 chapters are flat, so nested TOC entries become chapters of their
+    own in reading order.
+
+    Args:
+        markers: The chapter markers, as returned by chapter_markers.
+        title: The title of the book.
+        path: Path of the metadata file to write.
+    """
+    lines = [";FFMETADATA1", f"title={_escape_ffmetadata(title)}"]
+    for marker in markers:
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={marker['start']}",
+            f"END={marker['end']}",
+            f"title={_escape_ffmetadata(marker['title'])}",
+        ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def assemble_m4b(
+    paths: List[Path],
+    chapter_format: str,
+    markers: List[Dict],
+    title: str,
+    output: Path,
+) -> None:
+    """
+    Concatenate chapter files into an M4B file with chapter markers.
+
+    AAC chapters are stream-copied with ffmpeg's concat demuxer; chapters
+    in other formats have to be encoded to AAC once.
+
+    Args:
+        paths: The chapter audio files in order.
+        chapter_format: The audio format of the chapter files.
+        markers: The chapter markers, as returned by chapter_markers.
+        title: The title of the book.
+        output: Path of the M4B file to write.
+
+    Raises:
+        RuntimeError: If ffmpeg is not installed or fails.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError(
+            "ffmpeg is required for M4B output. "
+            "Install it with: brew install ffmpeg (or apt-get install ffmpeg)"
+        )
+
+    if chapter_format in MP4_COPY_FORMATS:
+        codec = ["-c", "copy"]
+        if chapter_format == "aac":
+            # ADTS headers are replaced by the MP4 codec configuration
+            codec += ["-bsf:a", "aac_adtstoasc"]
+    else:
+        codec = ["-c:a", "aac", "-b:a", "64k"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        concat_list = Path(temp_dir) / "chapters.txt"
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for path in paths:
+                escaped = str(Path(path).resolve()).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        metadata = Path(temp_dir) / "metadata.txt"
+        write_ffmetadata(markers, title, metadata)
+
+        result = subprocess.run(
+            [
+                ffmpeg,
+                "-y",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                str(concat_list),
+                "-i",
+                str(metadata),
+                "-map",
+                "0:a",
+                "-map_metadata",
+                "1",
+                "-map_chapters",
+                "1",
+                *codec,
+                "-f",
+                "ipod",
+                str(output),
+            ],
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to assemble {output}: {result.stderr}")
+
+
+def _id3_frame(frame_id: str, data: bytes) -> bytes:
+    """Build an ID3v2.3 frame."""
+    return frame_id.encode("latin-1") + struct.pack(">IH", len(data), 0) + data
+
+
+def _id3_text_frame(frame_id: str, text: str) -> bytes:
+    """Build an ID3v2.3 text frame, encoded as UTF-16 with a byte order mark."""
+    return _id3_frame(frame_id, b"\x01" + text.encode("utf-16") + b"\x00\x00")
+
+
+def _ctoc_frame(
+    element_id: str, children: List[str], title: Optional[str], top_level: bool
+) -> bytes:
+    """Build an ID3 CTOC (table of contents) frame."""
+    flags = 0x01 | (0x02 if top_level else 0)  # ordered, optionally top-level
+    data = element_id.encode("latin-1") + b"\x00" + bytes([flags, len(children)])
+    data += b"".join(child.encode("latin-1") + b"\x00" for child in children)
+    if title is not None:
+        data += _id3_text_frame("TIT2", title)
+    return _id3_frame("CTOC", data)
+
+
+def build_id3_chapters(markers: List[Dict], title: str) -> bytes:
+    """
+    Build an ID3v2.3 tag with chapter frames for an MP3 audiobook.
+
+    Every chapter gets a CHAP frame. The TOC hierarchy is kept with CTOC
+    frames: a chapter with nested entries becomes a table of contents that
+    lists the chapter itself followed by its children.
+
+    Args:
+        markers: The chapter markers, as returned by chapter_markers.
+        title: The title of the book.
+
+    Returns:
+        The complete ID3 tag.
+    """
+    frames = [_id3_text_frame("TIT2", title)]
+
+    for index, marker in enumerate(markers):
+        data = f"chp{index}".encode("latin-1") + b"\x00"
+        # Byte offsets are unused, which the specification marks as 0xFFFFFFFF
+        data += struct.pack(
+            ">IIII", marker["start"], marker["end"], 0xFFFFFFFF, 0xFFFFFFFF
+        )
+        data += _id3_text_frame("TIT2", marker["title"])
+        frames.append(_id3_frame("CHAP", data))
+
+    # Build the TOC tree from the nesting levels, parents first
+    root = {"children": []}
+    stack = [(-1, root)]
+    for index, marker in enumerate(markers):
+        node = {"index": index, "children": []}
+        while stack[-1][0] >= marker["level"]:
+            stack.pop()
+        stack[-1][1]["children"].append(node)
+        stack.append((marker["level"], node))
+
+    def element_id(node: Dict) -> str:
+        if node["children"]:
+            return f"toc{node['index']}"
+        return f"chp{node['index']}"
+
+    def add_tocs(node: Dict) -> None:
+        for child in node["children"]:
+            if child["children"]:
+                entries = [f"chp{child['index']}"]
+                entries += [element_id(grandchild) for grandchild in child["children"]]
+                add_toc(element_id(child), entries, markers[child["index"]]["title"])
+                add_tocs(child)
+
+    def add_toc(
+        toc_id: str, entries: List[str], toc_title: str, top: bool = False
+    ) -> None:
+        # A CTOC frame holds at most 255 entries, so long lists are split
+        while len(entries) > _CTOC_MAX_ENTRIES:
+            parts = [
+                entries[i : i + _CTOC_MAX_ENTRIES]
+                for i in range(0, len(entries), _CTOC_MAX_ENTRIES)
+            ]
+            entries = []
+            for part in parts:
+                part_id = f"{toc_id}p{len(frames)}"
+                frames.append(_ctoc_frame(part_id, part, None, False))
+                entries.append(part_id)
+        frames.append(_ctoc_frame(toc_id, entries, toc_title, top))
+
+    add_toc("toc", [element_id(child) for child in root["children"]], title, True)
+    add_tocs(root)
+
+    body = b"".join(frames)
+    # The tag size is stored as a 28-bit synchsafe integer
+    size = bytes((len(body) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x03\x00\x00" + size + body
+
+
+def _mp3_frame_info(header: bytes) -> Tuple[int, int, int]:
+    """
+    Parse the header of an MPEG Layer III frame.
+
+    Returns:
+        The frame length in bytes, the size of its side information and the
+        MPEG version bits, or a zero length if the bytes aren't a valid header.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return 0, 0, 0
+
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0, 0, 0
+
+    mpeg1 = version == 3
+    mono = header[3] >> 6 == 3
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    samplerate = _MP3_SAMPLE_RATES[rate_index] // {3: 1, 2: 2, 0: 4}[version]
+    padding = (header[2] >> 1) & 0x01
+    length = (144 if mpeg1 else 72) * bitrate // samplerate + padding
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    return length, side_info, version
+
+
+def _mp3_audio_range(data: bytes) -> Tuple[int, int]:
+    """
+    Find the MPEG frames of an MP3 file, excluding tags and the info frame.
+
+    Encoders put an ID3 tag and a Xing/Info frame (which describes the
+    whole file) at the start, and possibly an ID3v1 tag at the end. None of
+    them belong in the middle of a concatenated file.
+
+    Args:
+        data: The content of the MP3 file.
+
+    Returns:
+        The byte offsets of the start and end of the audio frames.
+    """
+    start = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        tag_size = 0
+        for byte in data[6:10]:
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        start = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+
+    length, side_info, _ = _mp3_frame_info(data[start : start + 4])
+    tag = data[start + 4 + side_info : start + 8 + side_info]
+    if length and tag in (b"Xing", b"Info"):
+        start += length
+
+    end = len(data)
+    if end - start >= 128 and data[end - 128 : end - 125] == b"TAG":
+        end -= 128
+
+    return start, end
+
+
+def _mp3_duration(path: Path) -> float:
+    """Measure the duration of the audio frames of an MP3 file."""
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        start, end = _mp3_audio_range(data)
+        offsets = array("Q")
+        _scan_mp3_frames(data, start, end, offsets)
+        if not offsets:
+            return 0.0
+        header = data[start + offsets[0] : start + offsets[0] + 4]
+
+    version = (header[1] >> 3) & 0x03
+    samplerate = (
+        _MP3_SAMPLE_RATES[(header[2] >> 2) & 0x03] // {3: 1, 2: 2, 0: 4}[version]
+    )
+    samples_per_frame = 1152 if version == 3 else 576
+    return len(offsets) * samples_per_frame / samplerate
+
+
+def _scan_mp3_frames(data: bytes, start: int, end: int, offsets: array) -> None:
+    """Append the offset of every audio frame in a byte range to offsets."""
+    position = start
+    while position + 4 <= end:
+        length, _, _ = _mp3_frame_info(data[position : position + 4])
+        if not length:
+            # Skip junk between frames up to the next sync byte
+            position = data.find(b"\xff", position + 1, end)
+            if position < 0:
+                break
+            continue
+        offsets.append(position - start)
+        position += length
+
+
+def _xing_frame(header: bytes, frames: int, size: int, toc: bytes) -> bytes:
+    """
+    Build a Xing frame describing a variable bitrate MP3 stream.
+
+    Players rely on it for the duration and for seeking, since the bitrate
+    of the first frames says nothing about the rest of a VBR stream.
+    """
+    version = (header[1] >> 3) & 0x03
+    bitrates = _MP3_BITRATES[1 if version == 3 else 2]
+    # Pick the lowest bitrate whose frame is large enough for the Xing data
+    for bitrate_index in range(1, len(bitrates)):
+        candidate = bytes(
+            [
+                header[0],
+                header[1] | 0x01,  # no CRC
+                (bitrate_index << 4) | (header[2] & 0x0C),  # no padding
+                header[3],
+            ]
+        )
+        length, side_info, _ = _mp3_frame_info(candidate)
+        if length >= 4 + side_info + 120:
+            break
+
+    body = b"Xing" + struct.pack(">III", 0x07, frames, size) + toc
+    frame = candidate + bytes(side_info) + body
+    return frame + bytes(length - len(frame))
+
+
+def assemble_mp3(
+    paths: List[Path],
+    chapter_format: str,
+    markers: List[Dict],
+    title: str,
+    output: Path,
+) -> None:
+    """
+    Concatenate chapter files into an MP3 file with ID3 chapter frames.
+
+    MP3 chapters are stream-copied frame by frame, under a new Xing frame
+    that describes the whole book; chapters in other formats are decoded
+    (by ffmpeg for AAC, which libsndfile can't read) and encoded to MP3
+    block by block.
+
+    Args:
+        paths: The chapter audio files in order.
+        chapter_format: The audio format of the chapter files.
+        markers: The chapter markers, as returned by chapter_markers.
+        title: The title of the book.
+        output: Path of the MP3 file to write.
+
+    Raises:
+        RuntimeError: If AAC chapters can't be decoded with ffmpeg.
+    """
+    ffmpeg = None
+    if chapter_format in MP4_COPY_FORMATS:
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError(
+                f"ffmpeg is required to decode {chapter_format} chapters. "
+                "Install it with: brew install ffmpeg (or apt-get install ffmpeg)"
+            )
+
+    with open(output, "wb") as output_file:
+        output_file.write(build_id3_chapters(markers, title))
+
+        if chapter_format != "mp3":
+            import soundfile as sf
+
+            from epub_to_audiobook.encoders import open_encoder
+
+            if ffmpeg is not None:
+                samplerate = _aac_samplerate(paths[0])
+                blocks = (
+                    block
+                    for path in paths
+                    for block in _decode_blocks(ffmpeg, path, samplerate)
+                )
+            else:
+                samplerate = sf.info(str(paths[0])).samplerate
+                blocks = (
+                    block
+                    for path in paths
+                    for block in sf.blocks(str(path), blocksize=65536, dtype="float32")
+                )
+            with open_encoder(output_file, "mp3", samplerate) as encoder:
+                for block in blocks:
+                    encoder.write(block)
+            return
+
+        # Reserve room for the Xing frame, which is written once all frames
+        # are counted
+        xing_position = output_file.tell()
+        xing_length = 0
+        first_header = None
+        offsets = array("Q")
+        copied = 0
+        for path in paths:
+            with open(path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as data:
+                start, end = _mp3_audio_range(data)
+                if first_header is None:
+                    first_header = bytes(data[start : start + 4])
+                    xing_length = len(_xing_frame(first_header, 0, 0, bytes(100)))
+                    output_file.write(bytes(xing_length))
+
+                chapter_offsets = array("Q")
+                _scan_mp3_frames(data, start, end, chapter_offsets)
+                offsets.extend(offset + copied for offset in chapter_offsets)
+                output_file.write(data[start:end])
+                copied += end - start
+
+        if first_header is None:
+            return
+
+        # The TOC maps each percent of the duration to a fraction of the size
+        size = xing_length + copied
+        toc = bytes(
+            min(
+                255,
+                (xing_length + offsets[len(offsets) * percent // 100]) * 256 // size,
+            )
+            for percent in range(100)
+        )
+        output_file.seek(xing_position)
+        output_file.write(_xing_frame(first_header, len(offsets), size, toc))
+
+
+def assemble_book(
+    book_dir: Path, output: Optional[Path] = None, title: Optional[str] = None
+) -> Path:
+    """
+    Assemble the chapter files of a converted book into one audiobook.
+
+    The chapter files and their titles and TOC levels are read from the
+    manifest written by the book command. The output format follows the
+    extension of the output file: .m4b (or .m4a/.mp4) or .mp3.
+
+    Args:
+        book_dir: The output directory of the book command.
+        output: Path of the audiobook to write. Defaults to an M4B file named
+                after the EPUB file, inside the book directory.
+        title: The title of the audiobook. Defaults to the EPUB file name.
+
+    Returns:
+        The path of the assembled audiobook.
+
+    Raises:
+        FileNotFoundError: If the directory has no manifest or a chapter file
+                           is missing.
+        ValueError: If the output or chapter format is not supported.
+    """
+    book_dir = Path(book_dir)
+    manifest_path = book_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {book_dir}")
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    source_name = Path(manifest["source"]).stem
+    title = title or source_name
+    output = Path(output) if output else book_dir / f"{source_name}.m4b"
+
+    chapter_format = manifest["format"]
+    if chapter_format == "pcm":
+        raise ValueError("Raw PCM chapters can't be assembled; use another format")
+
+    chapters = manifest["chapters"]
+    paths = [book_dir / chapter["file"] for chapter in chapters]
+    for path in paths:
+        if not path.exists():
+            raise FileNotFoundError(f"Chapter file not found: {path}")
+
+    markers = chapter_markers(chapters, [audio_duration(path) for path in paths])
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    extension = output.suffix.lower()
+    if extension in MP4_EXTENSIONS:
+        assemble_m4b(paths, chapter_format, markers, title, output)
+    elif extension == ".mp3":
+        assemble_mp3(paths, chapter_format, markers, title, output)
+    else:
+        raise ValueError(f"Output must be an {', '.join(MP4_EXTENSIONS)} or .mp3 file")
+
+    return output
@@ -0,0 +1,289 @@
+"""
+Batch conversion module.
+
+This module converts a catalog of EPUB files in one run. The chapters of all
+books are scheduled onto one shared pool of warm workers (see
+book.ChapterQueue): higher-priority books go first and books of the same
+priority share the pool fairly, so the workers stay busy across book
+boundaries instead of reloading models and idling between books.
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from epub_to_audiobook.book import (
+    ChapterQueue,
+    prepare_book,
+    synthesize_chapters,
+    write_manifest,
+)
+from epub_to_audiobook.cache import DEFAULT_MAX_BYTES
+from epub_to_audiobook.lexicon import load_lexicon
+from epub_to_audiobook.progress import Progress
+
+# Name of the summary written to the output directory of a batch
+BATCH_MANIFEST = "batch.json"
+
+
+def load_catalog(source: Path, output_dir: Path) -> List[Dict]:
+    """
+    Find the books of a batch.
+
+    The source is either a directory, whose EPUB files are all converted with
+    the same priority, or a JSON manifest listing the books. Each entry of a
+    manifest is the path of an EPUB file, or an object with an 'epub' path
+    and optional 'output_dir', 'name' and 'priority' (higher goes first).
+    Relative paths in a manifest are relative to the manifest.
+
+    Args:
+        source: A directory of EPUB files or a JSON manifest.
+        output_dir: Directory the output directory of each book is created
+                    in, named after the book, unless the manifest sets one.
+
+    Returns:
+        The books, each with 'epub', 'output_dir', 'name' and 'priority'.
+
+    Raises:
+        FileNotFoundError: If the source does not exist.
+        ValueError: If the manifest is invalid, no books are found, or two
+                    books would be written to the same directory.
+    """
+    source = Path(source)
+    output_dir = Path(output_dir)
+    if not source.exists():
+        raise FileNotFoundError(f"Batch source not found: {source}")
+
+    if source.is_dir():
+        # Names only, since the paths are joined onto the directory below
+        entries = [{"epub": path.name} for path in sorted(source.glob("*.epub"))]
+        base = source
+    else:
+        try:
+            with open(source, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid batch manifest {source}: {e}")
+        if not isinstance(entries, list):
+            raise ValueError(
+                f"Invalid batch manifest {source}: expected a list of books"
+            )
+        base = source.parent
+
+    books = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"epub": entry}
+        if not isinstance(entry, dict) or "epub" not in entry:
+            raise ValueError(
+                f"Invalid batch entry {entry!r}: expected an EPUB path or an "
+                "object with an 'epub' path"
+            )
+
+        epub = base / entry["epub"]
+        name = entry.get("name") or epub.stem
+        books.append(
+            {
+                "epub": epub,
+                "output_dir": (
+                    base / entry["output_dir"]
+                    if entry.get("output_dir")
+                    else output_dir / name
+                ),
+                "name": name,
+                "priority": int(entry.get("priority", 0)),
+            }
+        )
+
+    if not books:
+        raise ValueError(f"No EPUB files found in {source}")
+
+    output_dirs = [os.path.abspath(book["output_dir"]) for book in books]
+    if len(set(output_dirs)) < len(output_dirs):
+        raise ValueError(
+            "Two books of the batch have the same output directory; give them "
+            "different names or output directories in a manifest"
+        )
+    return books
+
+
+def synthesize_books(
+    catalog: List[Dict],
+    output_dir: Path,
+    engine: str = "kokoro",
+    audio_format: str = "wav",
+    workers: Optional[int] = None,
+    concurrency: int = 4,
+    per_book_limit: Optional[int] = None,
+    rate_limit: Optional[float] = None,
+    stream: bool = False,
+    lang_code: str = "a",
+    engine_options: Optional[Dict] = None,
+    onnx_options: Optional[Dict] = None,
+    cache_dir: Optional[Path] = None,
+    cache_size: int = DEFAULT_MAX_BYTES,
+    lexicon: Optional[Path] = None,
+    progress: Optional[Progress] = None,
+) -> Dict:
+    """
+    Convert every chapter of a catalog of EPUB files on one worker pool.
+
+    Each book is written to its own output directory, exactly as
+    synthesize_book would write it: chapter files, a manifest written as soon
+    as the book's last chapter is done, and a checkpoint journal, so that a
+    batch run again skips finished chapters and any book can also be resumed
+    on its own. Books that can't be read are skipped, and a book one of whose
+    chapters fails is dropped while the other books go on; both are reported
+    as failed. The batch summary is written even if the run is interrupted.
+
+    Args:
+        catalog: The books, as returned by load_catalog.
+        output_dir: Directory the batch summary is written to.
+        engine: TTS engine to use ("kokoro" or "fish").
+        audio_format: Output audio format, also used as the file extension.
+        workers: Number of Kokoro worker processes (defaults to the CPU count).
+        concurrency: Maximum number of Fish Audio chapters, and requests, in
+                     flight at once.
+        per_book_limit: Optional maximum number of chapters of one book in
+                        flight at once, to spread the pool over more books.
+        rate_limit: Optional maximum number of Fish Audio requests started
+                    per second.
+        stream: Whether to stream each Fish Audio chapter over a WebSocket
+                connection instead of sending it as concurrent requests.
+        lang_code: Language code for Kokoro TTS.
+        engine_options: Extra keyword arguments passed to the engine's
+                        text_to_speech method.
+        onnx_options: Optional settings of the ONNX Runtime backend of Kokoro
+                      (see jobs.create_kokoro).
+        cache_dir: Optional directory of a synthesis cache shared by all
+                   workers.
+        cache_size: Size limit of the synthesis cache in bytes.
+        lexicon: Optional pronunciation lexicon file applied to every book.
+        progress: Optional Progress the run is reported to, with the name of
+                  the book in the events of its chapters.
+
+    Returns:
+        The batch summary: the status and output directory of every book,
+        and the cache statistics of the run.
+
+    Raises:
+        FileNotFoundError: If the lexicon file does not exist.
+        ValueError: If the engine or the lexicon file is invalid.
+    """
+    if engine not in ["kokoro", "fish"]:
+        raise ValueError("Engine must be one of 'kokoro' or 'fish'")
+
+    if progress is None:
+        progress = Progress()
+
+    pronunciations = load_lexicon(lexicon) if lexicon is not None else None
+
+    books = []
+    statuses = [{"status": "pending"} for _ in catalog]
+    for position, entry in enumerate(catalog):
+        arguments = {
+            "epub_path": os.path.abspath(entry["epub"]),
+            "output_dir": str(entry["output_dir"]),
+            "engine": engine,
+            "audio_format": audio_format,
+            "workers": workers,
+            "concurrency": concurrency,
+            "rate_limit": rate_limit,
+            "stream": stream,
+            "lang_code": lang_code,
+            "engine_options": engine_options,
+            "onnx_options": onnx_options,
+            "cache_dir": str(cache_dir) if cache_dir is not None else None,
+            "cache_size": cache_size,
+            "lexicon": str(lexicon) if lexicon is not None else None,
+        }
+        try:
+            book = prepare_book(
+                str(entry["epub"]),
+                entry["output_dir"],
+                engine,
+                arguments,
+                pronunciations,
+                progress,
+                name=entry["name"],
+            )
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Skipping {entry['name']}: {e}", file=sys.stderr)
+            statuses[position] = {"status": "failed", "error": str(e)}
+            continue
+
+        book.update(name=entry["name"], priority=entry["priority"], position=position)
+        books.append(book)
+
+    def finish_book(book: Dict) -> None:
+        write_manifest(book, engine, audio_format)
+        statuses[book["position"]]["status"] = "done"
+        print(f"Finished book: {book['name']}", file=sys.stderr)
+
+    def fail_book(book: Dict, error: Exception) -> None:
+        statuses[book["position"]] = {"status": "failed", "error": str(error)}
+        print(f"Failed book: {book['name']}: {error}", file=sys.stderr)
+
+    scheduled = []
+    for book in books:
+        if book["pending"]:
+            scheduled.append(book)
+        else:
+            finish_book(book)
+
+    chapters = sum(len(book["pending"]) for book in scheduled)
+    progress.start(
+        sum(job["characters"] for book in scheduled for job in book["pending"]),
+        books=len(scheduled),
+        chapters=chapters,
+    )
+
+    stats = {}
+    try:
+        if scheduled:
+            workers = max(1, min(workers or os.cpu_count() or 1, chapters))
+            stats = synthesize_chapters(
+                ChapterQueue(scheduled, per_book_limit, finish_book, fail_book),
+                engine,
+                dict(engine_options or {}, audio_format=audio_format),
+                workers,
+                concurrency,
+                rate_limit,
+                stream,
+                lang_code,
+                cache_dir,
+                cache_size,
+                progress,
+                onnx_options,
+            )
+    finally:
+        summary = {
+            "engine": engine,
+            "format": audio_format,
+            "books": [
+                dict(
+                    {
+                        "name": entry["name"],
+                        "source": os.path.abspath(entry["epub"]),
+                        "output_dir": str(entry["output_dir"]),
+                        "priority": entry["priority"],
+                    },
+                    **status,
+                )
+                for entry, status in zip(catalog, statuses)
+            ],
+        }
+        if "phonemes" in stats:
+            summary["phonemes"] = stats.pop("phonemes")
+        if cache_dir is not None and stats:
+            summary["cache"] = stats
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with open(output_dir / BATCH_MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    progress.finish()
+    return summary
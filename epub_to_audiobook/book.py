@@ -0,0 +1,838 @@
+"""
+Book conversion module.
+
+This module converts a whole EPUB file into one audio file per chapter,
+synthesizing chapters concurrently and writing a manifest that describes
+the generated files.
+"""
+
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from epub_to_audiobook.cache import DEFAULT_MAX_BYTES, SynthesisCache
+from epub_to_audiobook.epub_handler import read_chapter
+from epub_to_audiobook.jobs import JOURNAL_FILE, Journal, create_kokoro, save_job
+from epub_to_audiobook.lexicon import Lexicon, load_lexicon
+from epub_to_audiobook.plan import load_index, longest_first
+from epub_to_audiobook.progress import Progress
+
+# Name of the manifest written next to the chapter audio files
+MANIFEST_NAME = "manifest.json"
+
+# KokoroTTS instance owned by the current worker process
+_worker_tts = None
+
+# Queue the current worker process sends its progress events to
+_worker_events = None
+
+
+def chapter_filename(index: int, title: str, audio_format: str) -> str:
+    """
+    Build the file name of a chapter audio file.
+
+    Args:
+        index: The position of the chapter in the book, starting at 1.
+        title: The title of the chapter.
+        audio_format: The audio format, used as the file extension.
+
+    Returns:
+        A file name such as '001_chapter-one.wav'.
+    """
+    slug = re.sub(r"[^\w]+", "-", title.lower()).strip("-")[:60] or "chapter"
+    return f"{index:03d}_{slug}.{audio_format}"
+
+
+def _open_cache(cache_dir: Optional[Path], cache_size: int):
+    """Open the synthesis cache, if one is configured."""
+    if cache_dir is None:
+        return None
+    return SynthesisCache(cache_dir, max_bytes=cache_size)
+
+
+def _merge_cache_stats(stats: List[Dict]) -> Dict:
+    """Combine the cache hit and miss counts reported by several workers."""
+    hits = sum(s["hits"] for s in stats)
+    misses = sum(s["misses"] for s in stats)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+def _merge_phoneme_stats(stats: List[Dict]) -> Dict:
+    """Combine the phoneme cache counts reported by several workers."""
+    merged = _merge_cache_stats(stats)
+    merged["seconds_saved"] = sum(s["seconds_saved"] for s in stats)
+    return merged
+
+
+def _init_kokoro_worker(
+    lang_code: str,
+    threads: int,
+    cache_dir: Optional[Path],
+    cache_size: int,
+    events: multiprocessing.Queue,
+    onnx_options: Optional[Dict],
+) -> None:
+    """Load the Kokoro model once per worker process."""
+    global _worker_tts, _worker_events
+
+    _worker_events = events
+
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    if onnx_options is not None and not onnx_options.get("threads"):
+        onnx_options = dict(onnx_options, threads=threads)
+
+    _worker_tts = create_kokoro(
+        lang_code, _open_cache(cache_dir, cache_size), onnx_options
+    )
+
+
+def _init_shared_kokoro_worker(
+    threads: int,
+    cache_dir: Optional[Path],
+    cache_size: int,
+    events: multiprocessing.Queue,
+) -> None:
+    """Set up a worker forked from a process that already loaded the model."""
+    global _worker_events
+
+    _worker_events = events
+
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    # The caches hold file handles and SQLite connections, which can't be
+    # shared across a fork, so each worker opens its own
+    _worker_tts.use_cache(_open_cache(cache_dir, cache_size))
+
+
+def _load_shared_kokoro(lang_code: str, voice: Optional[str]):
+    """
+    Load the Kokoro model and voice in this process, for workers to share.
+
+    Workers only share the model where forking a process that has loaded it
+    is safe: on Linux, or where the program already chose the fork start
+    method. macOS starts processes with spawn by default, because forking
+    after Accelerate, Objective-C or MPS have initialized can crash or
+    deadlock the child, so there each worker loads its own model.
+
+    Returns:
+        The fork context the workers must be started with, or None if workers
+        shouldn't be forked, in which case each worker loads its own model.
+    """
+    global _worker_tts
+
+    if not (
+        sys.platform.startswith("linux")
+        or multiprocessing.get_start_method(allow_none=True) == "fork"
+    ):
+        return None
+
+    # Only load here: running inference would start thread pools, which a
+    # forked worker would inherit in a broken state
+    _worker_tts = create_kokoro(lang_code)
+    if voice:
+        _worker_tts.pipeline.load_voice(voice)
+
+    # Keep the garbage collector of the workers away from the objects loaded
+    # so far, so that it doesn't write to, and thereby copy, their pages
+    gc.freeze()
+    return multiprocessing.get_context("fork")
+
+
+def _synthesize_kokoro_chapter(
+    text: str, output_path: str, options: Dict, title: str, fields: Dict
+) -> Dict:
+    """
+    Synthesize one chapter with the worker's Kokoro model.
+
+    Progress events of the chapter, tagged with the given fields, are sent to
+    the parent process as they happen. Returns the cache hits and misses of
+    the chapter, and those of the phoneme cache under 'phonemes', so that the
+    parent process can report totals across workers.
+    """
+    cache = _worker_tts.cache
+    hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+    phonemes = _worker_tts.phonemes.stats()
+
+    progress = Progress([_worker_events.put], **fields)
+    with open(output_path, "wb") as output_file:
+        _worker_tts.text_to_speech(
+            text=text, output_file=output_file, progress=progress, **options
+        )
+    progress.emit("chapter", title=title, **progress.summary())
+
+    phonemes_after = _worker_tts.phonemes.stats()
+    stats = {
+        "phonemes": {
+            key: phonemes_after[key] - phonemes[key]
+            for key in ("hits", "misses", "seconds_saved")
+        }
+    }
+    if cache is None:
+        return dict(stats, hits=0, misses=0)
+    return dict(stats, hits=cache.hits - hits, misses=cache.misses - misses)
+
+
+class ChapterQueue:
+    """
+    Orders the pending chapters of one or more books for a shared pool.
+
+    The next chapter is taken from the book with the highest priority. Among
+    books of the same priority it is taken from the book that has been given
+    the fewest characters of work so far, so that books share the pool fairly
+    and progress together instead of one after the other. The chapters of a
+    book are taken longest first, by their estimated synthesis time, so that
+    the last chapters to finish are short ones and no worker is left on a
+    long chapter at the end while the others are idle.
+    """
+
+    def __init__(
+        self,
+        books: List[Dict],
+        per_book_limit: Optional[int] = None,
+        on_finished: Optional[Callable[[Dict], None]] = None,
+        on_failed: Optional[Callable[[Dict, Exception], None]] = None,
+    ):
+        """
+        Initialize the ChapterQueue class.
+
+        Args:
+            books: Books as returned by prepare_book, each with a 'priority'.
+            per_book_limit: Optional maximum number of chapters of one book
+                            in flight at once.
+            on_finished: Optional callable called with each book once the
+                         last of its pending chapters is done.
+            on_failed: Optional callable called with a book and the error
+                       the first time one of its chapters fails. The rest of
+                       the book is then dropped and the other books go on.
+                       Without it, a failed chapter stops the whole run.
+        """
+        self.books = books
+        self.per_book_limit = per_book_limit
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+        self._failed = set()
+        self._next = [0] * len(books)
+        self._in_flight = [0] * len(books)
+        self._done = [0] * len(books)
+        self._dispatched = [0] * len(books)
+        self._order = [longest_first(book["pending"]) for book in books]
+        for number, book in enumerate(books):
+            for job in book["pending"]:
+                job["book"] = number
+
+    def next(self) -> Optional[Dict]:
+        """
+        Take the next chapter to synthesize, reading its text.
+
+        Returns:
+            The job of the chapter, with its 'text', or None if no chapter can
+            be started until others are done.
+
+        Raises:
+            FileNotFoundError: If the EPUB file of the chapter is gone, and
+                               the queue has no on_failed callable.
+            ValueError: If the text of the chapter can't be read, and the
+                        queue has no on_failed callable.
+        """
+        while True:
+            candidates = [
+                number
+                for number, book in enumerate(self.books)
+                if self._next[number] < len(book["pending"])
+                and (
+                    self.per_book_limit is None
+                    or self._in_flight[number] < self.per_book_limit
+                )
+            ]
+            if not candidates:
+                return None
+
+            number = min(
+                candidates,
+                key=lambda n: (
+                    -self.books[n].get("priority", 0),
+                    self._dispatched[n],
+                    n,
+                ),
+            )
+            job = self._order[number][self._next[number]]
+            self._next[number] += 1
+            self._in_flight[number] += 1
+            self._dispatched[number] += job["characters"]
+            try:
+                job["text"] = chapter_text(self.books[number], job)
+            except (FileNotFoundError, ValueError) as e:
+                self.failed(job, e)
+                continue
+            return job
+
+    def done(self, job: Dict) -> None:
+        """Record a finished chapter in the journal of its book."""
+        number = job["book"]
+        book = self.books[number]
+        book["journal"].record(job["file"], Path(job["path"]), job.pop("text"))
+        self._in_flight[number] -= 1
+        self._done[number] += 1
+        if (
+            self._done[number] == len(book["pending"])
+            and number not in self._failed
+            and self.on_finished
+        ):
+            self.on_finished(book)
+
+    def failed(self, job: Dict, error: Exception) -> None:
+        """
+        Record a failed chapter, dropping the chapters of its book not started.
+
+        Chapters of the book already in flight still finish and are recorded
+        in its journal, so a later run only redoes what is missing.
+
+        Raises:
+            Exception: The error of the chapter, if the queue has no on_failed
+                       callable.
+        """
+        job.pop("text", None)
+        if self.on_failed is None:
+            raise error
+
+        number = job["book"]
+        self._in_flight[number] -= 1
+        self._next[number] = len(self.books[number]["pending"])
+        if number not in self._failed:
+            self._failed.add(number)
+            self.on_failed(self.books[number], error)
+
+
+def _synthesize_with_kokoro(
+    queue: ChapterQueue,
+    lang_code: str,
+    options: Dict,
+    workers: int,
+    cache_dir: Optional[Path],
+    cache_size: int,
+    progress: Progress,
+    onnx_options: Optional[Dict] = None,
+) -> Dict:
+    """
+    Synthesize chapters on a pool of Kokoro worker processes.
+
+    Where processes can be forked, the PyTorch model and voice are loaded
+    once, before the workers are forked. The workers then share the weights
+    copy-on-write, so each worker adds little memory and starts at once.
+    Otherwise, and with the ONNX backend, each worker loads its own model.
+    """
+    global _worker_tts
+
+    # Split the cores between the workers so they don't oversubscribe the CPU
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # Forward the progress events of the workers until the pool is shut down
+    events = multiprocessing.Queue()
+    forwarder = threading.Thread(
+        target=lambda: [progress.record(event) for event in iter(events.get, None)],
+        daemon=True,
+    )
+
+    context = None
+    if onnx_options is None:
+        with progress.stage("load"):
+            context = _load_shared_kokoro(lang_code, options.get("voice"))
+    if context is not None:
+        initializer = _init_shared_kokoro_worker
+        initargs = (threads, cache_dir, cache_size, events)
+    else:
+        initializer = _init_kokoro_worker
+        initargs = (lang_code, threads, cache_dir, cache_size, events, onnx_options)
+
+    forwarder.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=initializer,
+            initargs=initargs,
+        ) as executor:
+            # Chapters are submitted one per free worker, so the queue picks
+            # each chapter only when there is a worker to run it
+            futures = {}
+            stats = []
+            while True:
+                while len(futures) < workers:
+                    job = queue.next()
+                    if job is None:
+                        break
+                    future = executor.submit(
+                        _synthesize_kokoro_chapter,
+                        job["text"],
+                        job["path"],
+                        options,
+                        job["title"],
+                        job["fields"],
+                    )
+                    futures[future] = job
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = futures.pop(future)
+                    try:
+                        stats.append(future.result())
+                    except Exception as e:
+                        queue.failed(job, e)
+                    else:
+                        queue.done(job)
+    finally:
+        events.put(None)
+        forwarder.join()
+        if context is not None:
+            _worker_tts = None
+            gc.unfreeze()
+
+    merged = _merge_cache_stats(stats)
+    merged["phonemes"] = _merge_phoneme_stats([s["phonemes"] for s in stats])
+    return merged
+
+
+async def _synthesize_with_fish_async(
+    queue: ChapterQueue,
+    options: Dict,
+    concurrency: int,
+    rate_limit: Optional[float],
+    stream: bool,
+    cache_dir: Optional[Path],
+    cache_size: int,
+    progress: Progress,
+) -> Dict:
+    """Synthesize chapters with Fish Audio, keeping a bounded number in flight."""
+    from epub_to_audiobook.fish_audio import FishAudioTTS, stream_sentences
+
+    cache = _open_cache(cache_dir, cache_size)
+    # The client's limits apply to the requests of all chapters together
+    tts = FishAudioTTS(
+        cache=cache, concurrency=concurrency, requests_per_second=rate_limit
+    )
+
+    def synthesize_streaming(job: Dict, chapter_progress: Progress) -> None:
+        # Streamed text is sent sentence by sentence rather than in segments
+        stream_options = {
+            key: value for key, value in options.items() if key != "segment_length"
+        }
+        start = time.perf_counter()
+        with open(job["path"], "wb") as output_file:
+            tts.text_to_speech_stream(
+                stream_sentences(job["text"]), output_file, **stream_options
+            )
+        # The duration of streamed audio isn't known, only its text
+        chapter_progress.segment(
+            characters=len(job["text"]),
+            audio_seconds=0.0,
+            stages={"stream": time.perf_counter() - start},
+        )
+
+    async def run(job: Dict) -> None:
+        chapter_progress = Progress([progress.record], **job["fields"])
+        if stream:
+            # One WebSocket connection per chapter, fed sentence by sentence
+            await asyncio.to_thread(synthesize_streaming, job, chapter_progress)
+        else:
+            with open(job["path"], "wb") as output_file:
+                await tts.text_to_speech_async(
+                    text=job["text"],
+                    output_file=output_file,
+                    progress=chapter_progress,
+                    **options,
+                )
+        chapter_progress.emit(
+            "chapter", title=job["title"], **chapter_progress.summary()
+        )
+
+    running = {}
+    while True:
+        while len(running) < concurrency:
+            job = queue.next()
+            if job is None:
+                break
+            running[asyncio.ensure_future(run(job))] = job
+        if not running:
+            break
+
+        finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            job = running.pop(task)
+            try:
+                task.result()
+            except Exception as e:
+                queue.failed(job, e)
+            else:
+                queue.done(job)
+
+    return _merge_cache_stats([cache.stats()] if cache else [])
+
+
+def synthesize_chapters(
+    queue: ChapterQueue,
+    engine: str,
+    options: Dict,
+    workers: int,
+    concurrency: int,
+    rate_limit: Optional[float],
+    stream: bool,
+    lang_code: str,
+    cache_dir: Optional[Path],
+    cache_size: int,
+    progress: Progress,
+    onnx_options: Optional[Dict] = None,
+) -> Dict:
+    """
+    Synthesize the chapters of a queue on one pool of warm workers.
+
+    Kokoro chapters run on a pool of worker processes that each load the
+    model once, and Fish Audio chapters run as concurrent API requests on one
+    client. At most `workers` (Kokoro) or `concurrency` (Fish Audio) chapters
+    are in flight at once, and the queue decides which chapter goes next.
+    With onnx_options, Kokoro workers run inference on ONNX Runtime.
+
+    Returns:
+        The cache hit and miss counts of the run, and for Kokoro those of the
+        phoneme cache under 'phonemes'.
+    """
+    if engine == "kokoro":
+        return _synthesize_with_kokoro(
+            queue,
+            lang_code,
+            options,
+            workers,
+            cache_dir,
+            cache_size,
+            progress,
+            onnx_options,
+        )
+    return asyncio.run(
+        _synthesize_with_fish_async(
+            queue,
+            options,
+            concurrency,
+            rate_limit,
+            stream,
+            cache_dir,
+            cache_size,
+            progress,
+        )
+    )
+
+
+def prepare_book(
+    epub_path: str,
+    output_dir: Path,
+    engine: str,
+    arguments: Dict,
+    pronunciations: Optional[Lexicon] = None,
+    progress: Optional[Progress] = None,
+    name: Optional[str] = None,
+) -> Dict:
+    """
+    List the chapters of a book and find the ones left to synthesize.
+
+    The chapters are listed from the planning index of the book, so their
+    text isn't held in memory: a book indexed before isn't read at all, and
+    one that isn't is read one chapter at a time to index it. The text of a
+    chapter is read when it is handed to a worker (see chapter_text), and
+    only chapters finished by an earlier run are read here, to check that
+    their text is unchanged. The settings of the conversion are saved in the
+    output directory, so that the book can be resumed on its own.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        output_dir: Directory the chapter audio files and manifest go to.
+        engine: TTS engine the chapter text is for ("kokoro" or "fish").
+        arguments: Settings of the conversion, as keyword arguments of
+                   synthesize_book.
+        pronunciations: Optional lexicon applied to the text of every chapter.
+        progress: Optional Progress the extraction is reported to.
+        name: Optional name of the book, added to its progress events.
+
+    Returns:
+        The book: its paths, the jobs of all its chapters, the jobs of the
+        chapters left to synthesize under 'pending', and its journal.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file or has no text.
+    """
+    if progress is None:
+        progress = Progress()
+
+    with progress.stage("extract"):
+        chapters = load_index(epub_path)["chapters"]
+    if not chapters:
+        raise ValueError(f"No chapter text found in EPUB file: {epub_path}")
+
+    output_dir = Path(output_dir)
+    save_job(output_dir, "book", arguments)
+
+    book = {
+        "epub_path": os.path.abspath(epub_path),
+        "output_dir": output_dir,
+        "engine": engine,
+        "pronunciations": pronunciations,
+    }
+    jobs = []
+    for chapter in chapters:
+        index = chapter["index"]
+        filename = chapter_filename(index, chapter["title"], arguments["audio_format"])
+        fields = (
+            {"chapter": index} if name is None else {"book": name, "chapter": index}
+        )
+        jobs.append(
+            {
+                "index": index,
+                "title": chapter["title"],
+                "href": chapter["href"],
+                "level": chapter["level"],
+                "characters": chapter["characters"],
+                # The estimated synthesis time, to schedule the chapters by
+                "estimate": chapter["synthesis_seconds"][engine],
+                "file": filename,
+                "path": str(output_dir / filename),
+                "fields": fields,
+            }
+        )
+
+    # Skip the chapters finished by an earlier run of the same job
+    journal = Journal(output_dir / JOURNAL_FILE)
+    pending = [
+        job
+        for job in jobs
+        if job["file"] not in journal.entries
+        or not journal.is_complete(
+            job["file"], Path(job["path"]), chapter_text(book, job)
+        )
+    ]
+    if len(pending) < len(jobs):
+        print(
+            f"Resuming{' ' + name if name else ''}: {len(jobs) - len(pending)} of "
+            f"{len(jobs)} chapters already finished",
+            file=sys.stderr,
+        )
+
+    book.update(jobs=jobs, pending=pending, journal=journal)
+    return book
+
+
+def chapter_text(book: Dict, job: Dict) -> str:
+    """
+    Read the text of a chapter of a book, with the book's lexicon applied.
+
+    Args:
+        book: The book, as returned by prepare_book.
+        job: The job of the chapter.
+
+    Returns:
+        The text to synthesize.
+
+    Raises:
+        FileNotFoundError: If the EPUB file no longer exists.
+        ValueError: If the file is no longer a valid EPUB file or lost the
+                    chapter.
+    """
+    text = read_chapter(book["epub_path"], job["href"])
+    if book["pronunciations"] is not None:
+        text = book["pronunciations"].apply(text, book["engine"])
+    return text
+
+
+def write_manifest(
+    book: Dict, engine: str, audio_format: str, extra: Optional[Dict] = None
+) -> Dict:
+    """
+    Write the manifest describing the chapter files of a book.
+
+    Args:
+        book: The book, as returned by prepare_book.
+        engine: TTS engine the chapters were synthesized with.
+        audio_format: Audio format of the chapter files.
+        extra: Optional extra keys of the manifest, such as cache statistics.
+
+    Returns:
+        The manifest.
+    """
+    manifest = {
+        "source": book["epub_path"],
+        "engine": engine,
+        "format": audio_format,
+        "chapters": [
+            {
+                "index": job["index"],
+                "title": job["title"],
+                "href": job["href"],
+                "level": job["level"],
+                "file": job["file"],
+                "characters": job["characters"],
+            }
+            for job in book["jobs"]
+        ],
+    }
+    manifest.update(extra or {})
+
+    with open(book["output_dir"] / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def synthesize_book(
+    epub_path: str,
+    output_dir: Path,
+    engine: str = "kokoro",
+    audio_format: str = "wav",
+    workers: Optional[int] = None,
+    concurrency: int = 4,
+    rate_limit: Optional[float] = None,
+    stream: bool = False,
+    lang_code: str = "a",
+    engine_options: Optional[Dict] = None,
+    onnx_options: Optional[Dict] = None,
+    cache_dir: Optional[Path] = None,
+    cache_size: int = DEFAULT_MAX_BYTES,
+    lexicon: Optional[Path] = None,
+    progress: Optional[Progress] = None,
+) -> Dict:
+    """
+    Convert every chapter of an EPUB file to its own audio file.
+
+    Chapters are synthesized concurrently: Kokoro chapters run on a pool of
+    worker processes that each load the model once, and Fish Audio chapters
+    run as concurrent API requests.
+
+    The output directory doubles as a job directory: finished chapters are
+    recorded in a checkpoint journal, and calling this function again (or
+    resuming the directory from the CLI) skips the chapters whose audio is
+    already complete.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        output_dir: Directory to write the chapter audio files and manifest to.
+        engine: TTS engine to use ("kokoro" or "fish").
+        audio_format: Output audio format, also used as the file extension.
+        workers: Number of Kokoro worker processes (defaults to the CPU count).
+        concurrency: Maximum number of Fish Audio requests in flight.
+        rate_limit: Optional maximum number of Fish Audio requests started
+                    per second.
+        stream: Whether to stream each Fish Audio chapter over a WebSocket
+                connection instead of sending it as concurrent requests.
+        lang_code: Language code for Kokoro TTS.
+        engine_options: Extra keyword arguments passed to the engine's
+                        text_to_speech method.
+        onnx_options: Optional settings of the ONNX Runtime backend of Kokoro
+                      (see jobs.create_kokoro).
+        cache_dir: Optional directory of a synthesis cache shared by all
+                   workers, so that unchanged text isn't synthesized again.
+        cache_size: Size limit of the synthesis cache in bytes.
+        lexicon: Optional pronunciation lexicon file (see lexicon.load_lexicon)
+                 applied to the text of every chapter.
+        progress: Optional Progress that the extraction, every synthesized
+                  segment and every finished chapter are reported to, and
+                  that is finished with the totals of the run at the end.
+
+    Returns:
+        The manifest describing the book and its chapter files. When a cache
+        is used, its hit and miss counts for this run are under 'cache'.
+        When Kokoro chapters were synthesized, the hit and miss counts of the
+        phoneme cache and the G2P time it saved are under 'phonemes'.
+
+    Raises:
+        FileNotFoundError: If the EPUB or lexicon file does not exist.
+        ValueError: If the file is not a valid EPUB file or has no text, or
+                    the lexicon file is invalid.
+    """
+    if engine not in ["kokoro", "fish"]:
+        raise ValueError("Engine must be one of 'kokoro' or 'fish'")
+
+    if progress is None:
+        progress = Progress()
+
+    pronunciations = load_lexicon(lexicon) if lexicon is not None else None
+
+    output_dir = Path(output_dir)
+    book = prepare_book(
+        epub_path,
+        output_dir,
+        engine,
+        {
+            "epub_path": os.path.abspath(epub_path),
+            "output_dir": str(output_dir),
+            "engine": engine,
+            "audio_format": audio_format,
+            "workers": workers,
+            "concurrency": concurrency,
+            "rate_limit": rate_limit,
+            "stream": stream,
+            "lang_code": lang_code,
+            "engine_options": engine_options,
+            "onnx_options": onnx_options,
+            "cache_dir": str(cache_dir) if cache_dir is not None else None,
+            "cache_size": cache_size,
+            "lexicon": str(lexicon) if lexicon is not None else None,
+        },
+        pronunciations,
+        progress,
+    )
+
+    pending = book["pending"]
+    progress.start(sum(job["characters"] for job in pending), chapters=len(pending))
+
+    options = dict(engine_options or {}, audio_format=audio_format)
+    if not pending:
+        cache_stats = _merge_cache_stats([])
+    else:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+        cache_stats = synthesize_chapters(
+            ChapterQueue([book]),
+            engine,
+            options,
+            workers,
+            concurrency,
+            rate_limit,
+            stream,
+            lang_code,
+            cache_dir,
+            cache_size,
+            progress,
+            onnx_options,
+        )
+
+    phoneme_stats = cache_stats.pop("phonemes", None)
+
+    extra = {}
+    if cache_dir is not None:
+        extra["cache"] = cache_stats
+    if phoneme_stats is not None:
+        extra["phonemes"] = phoneme_stats
+    manifest = write_manifest(book, engine, audio_format, extra)
+
+    progress.finish()
+    return manifest
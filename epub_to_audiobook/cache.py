@@ -0,0 +1,177 @@
+"""
+Synthesis cache module.
+
+This module provides a content-addressed on-disk cache for synthesized audio,
+so that re-running a conversion only synthesizes the text that changed.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+# Default size limit of the cache in bytes (2 GiB)
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# Extension of the files holding cached audio
+_ENTRY_SUFFIX = ".audio"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so that insignificant differences share a cache entry.
+
+    Args:
+        text: The text to normalize.
+
+    Returns:
+        The text in NFC form with runs of whitespace collapsed to one space.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SynthesisCache:
+    """A size-bounded LRU cache of synthesized audio stored on disk."""
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the SynthesisCache class.
+
+        Args:
+            directory: Directory to store the cached audio in. It is created if
+                       it doesn't exist and can be shared between processes.
+            max_bytes: Size limit of the cache. The least recently used entries
+                       are evicted when it is exceeded.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(path.stat().st_size for path in self._entries())
+
+    @staticmethod
+    def make_key(text: str, engine: str, **params) -> str:
+        """
+        Build the cache key for a segment of text.
+
+        Args:
+            text: The text that is synthesized.
+            engine: Name of the TTS engine.
+            **params: Every engine parameter that affects the audio, such as
+                      the voice, speed and output format.
+
+        Returns:
+            A hex digest identifying the audio.
+        """
+        payload = json.dumps(
+            {"text": normalize_text(text), "engine": engine, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        """Return the file that holds the entry for a key."""
+        return self.directory / key[:2] / f"{key}{_ENTRY_SUFFIX}"
+
+    def _entries(self):
+        """Iterate over the files of all cache entries."""
+        return self.directory.glob(f"*/*{_ENTRY_SUFFIX}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up cached audio.
+
+        Args:
+            key: The cache key, as returned by make_key.
+
+        Returns:
+            The cached audio, or None if the key is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # Touch the entry so that eviction sees it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Store audio in the cache, evicting old entries if it grows too large.
+
+        Args:
+            key: The cache key, as returned by make_key.
+            data: The audio to store.
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        # Overwriting an entry replaces its size rather than adding to it
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Evict down to 90% of the limit so that eviction doesn't run on every put
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, path in sorted(entries, key=lambda entry: entry[0]):
+            if size <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+        self._size = size
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return the hit and miss counts of this cache instance.
+
+        Returns:
+            A dictionary with the number of hits and misses, the hit rate and
+            the current size of the cache in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes": self._size,
+        }
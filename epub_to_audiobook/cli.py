@@ -3,16 +3,1110 @@ Command line interface for the EPUB to Audiobook converter using various TTS eng
 """
 
 import argparse
+import contextlib
+import io
+import json
+import os
 import sys
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-from epub_to_audiobook.fish_audio import FishAudioTTS
+# Engines and their dependencies (numpy, soundfile, dotenv, the Fish Audio SDK)
+# are imported by the code paths that use them, so that --help and argument
+# errors don't pay for loading them
 
 
-def main():
+# Output formats offered on the command line
+AUDIO_FORMATS = ["mp3", "wav", "pcm", "opus", "aac", "m4b"]
+
+# Output formats the Fish Audio API can return
+FISH_FORMATS = ["mp3", "wav", "pcm"]
+
+# Path that stands for stdin as --file and for stdout as --output
+STDIO = Path("-")
+
+
+def add_fish_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the Fish Audio specific arguments to a parser."""
+    fish_group = parser.add_argument_group("Fish Audio TTS options")
+    fish_group.add_argument(
+        "--reference-id",
+        "-r",
+        help="ID of a voice model to use (Fish Audio only)",
+    )
+
+    fish_group.add_argument(
+        "--bitrate",
+        help="MP3 bitrate for Fish Audio (only applicable if format is mp3)",
+        type=int,
+        choices=[64, 128, 192],
+        default=128,
+    )
+
+    fish_group.add_argument(
+        "--chunk-length",
+        help="Length of each chunk in milliseconds (Fish Audio only)",
+        type=int,
+        default=200,
+        choices=range(100, 301),
+        metavar="[100-300]",
+    )
+
+    fish_group.add_argument(
+        "--no-normalize",
+        help="Disable text normalization (Fish Audio only)",
+        action="store_true",
+    )
+
+    fish_group.add_argument(
+        "--latency",
+        help="Latency mode (Fish Audio only)",
+        choices=["normal", "balanced"],
+        default="normal",
+    )
+
+    fish_group.add_argument(
+        "--concurrency",
+        help="Maximum number of Fish Audio requests in flight",
+        type=int,
+        default=4,
+    )
+
+    fish_group.add_argument(
+        "--rate-limit",
+        help="Maximum number of Fish Audio requests started per second",
+        type=float,
+    )
+
+    fish_group.add_argument(
+        "--stream",
+        help="Stream the text to Fish Audio over a WebSocket connection and "
+        "write audio as it arrives",
+        action="store_true",
+    )
+
+
+def add_kokoro_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the Kokoro TTS specific arguments to a parser."""
+    kokoro_group = parser.add_argument_group("Kokoro TTS options")
+    kokoro_group.add_argument(
+        "--lang-code",
+        help="Language code for Kokoro TTS",
+        choices=["a", "b", "j", "z", "e", "f", "h", "i", "p"],
+        default="a",
+    )
+    
+    kokoro_group.add_argument(
+        "--voice",
+        help="Voice ID for Kokoro TTS",
+        default="af_heart",
+    )
+    
+    kokoro_group.add_argument(
+        "--speed",
+        help="Speech speed multiplier for Kokoro TTS",
+        type=float,
+        default=1.0,
+    )
+    
+    kokoro_group.add_argument(
+        "--batch-size",
+        help="Number of segments run through the Kokoro model together. "
+        "Values above 1 group segments of similar length into padded batches",
+        type=int,
+        default=1,
+    )
+    
+    kokoro_group.add_argument(
+        "--pipeline-depth",
+        help="Number of segments (or batch windows) G2P and inference may work "
+        "ahead of encoding, on separate threads. 0 runs every stage in turn",
+        type=int,
+        default=2,
+    )
+    
+    kokoro_group.add_argument(
+        "--backend",
+        help="Kokoro inference backend. 'onnx' runs an exported graph on ONNX "
+        "Runtime, which is faster on CPU-only machines",
+        choices=["torch", "onnx"],
+        default="torch",
+    )
+    
+    kokoro_group.add_argument(
+        "--onnx-model",
+        help="Path of an exported Kokoro ONNX graph (downloaded by default)",
+        type=Path,
+    )
+    
+    kokoro_group.add_argument(
+        "--quantized",
+        help="Use the int8-quantized ONNX graph",
+        action="store_true",
+    )
+    
+    kokoro_group.add_argument(
+        "--onnx-threads",
+        help="Threads each ONNX operator runs on (defaults to the physical "
+        "cores, shared out between book workers)",
+        type=int,
+    )
+    
+    kokoro_group.add_argument(
+        "--onnx-inter-op-threads",
+        help="Number of ONNX operators run in parallel",
+        type=int,
+        default=1,
+    )
+
+
+def onnx_options_from_args(args: argparse.Namespace) -> Optional[Dict]:
+    """Collect the ONNX Runtime backend options, or None for PyTorch."""
+    if args.backend != "onnx":
+        return None
+    return {
+        "model_path": str(args.onnx_model) if args.onnx_model else None,
+        "quantized": args.quantized,
+        "threads": args.onnx_threads,
+        "inter_op_threads": args.onnx_inter_op_threads,
+    }
+
+
+def check_backend(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Exit with an error if the Kokoro backend options are invalid."""
+    if args.backend == "torch":
+        if args.onnx_model is not None or args.quantized or args.onnx_threads:
+            parser.error("ONNX options require --backend onnx")
+        return
+
+    if args.engine == "fish":
+        parser.error("--backend onnx is only supported by Kokoro")
+    if args.batch_size > 1:
+        parser.error("--batch-size is not supported by the ONNX backend")
+    if args.onnx_threads is not None and args.onnx_threads < 1:
+        parser.error("--onnx-threads must be at least 1")
+    if args.onnx_inter_op_threads < 1:
+        parser.error("--onnx-inter-op-threads must be at least 1")
+
+
+def check_common_arguments(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """
+    Exit with an error if the options shared by the commands are invalid.
+
+    Only the options the command's parser defines are checked.
+    """
+    if "workers" in args and args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if "concurrency" in args and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if "rate_limit" in args and args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error("--rate-limit must be positive")
+    if "batch_size" in args and args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if "pipeline_depth" in args and args.pipeline_depth < 0:
+        parser.error("--pipeline-depth must not be negative")
+    if (
+        "segment_length" in args
+        and args.segment_length is not None
+        and args.segment_length < 1
+    ):
+        parser.error("--segment-length must be at least 1")
+
+
+def add_postprocess_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the Kokoro audio post-processing arguments to a parser."""
+    postprocess_group = parser.add_argument_group(
+        "Post-processing options (Kokoro only)"
+    )
+    postprocess_group.add_argument(
+        "--trim-silence",
+        help="Trim the silence at the start and end of every segment",
+        action="store_true",
+    )
+
+    postprocess_group.add_argument(
+        "--silence-threshold",
+        help="Level in dBFS below which audio counts as silence",
+        type=float,
+        default=-50.0,
+    )
+
+    postprocess_group.add_argument(
+        "--gap",
+        help="Seconds of silence between segments (defaults to 0.3 with "
+        "--trim-silence)",
+        type=float,
+    )
+
+    postprocess_group.add_argument(
+        "--chapter-gap",
+        help="Seconds of silence at the end of the output, or of each chapter",
+        type=float,
+    )
+
+    postprocess_group.add_argument(
+        "--loudness",
+        help="Normalize speech towards this level in dBFS, e.g. -20",
+        type=float,
+    )
+
+
+def postprocess_options(args: argparse.Namespace) -> Optional[Dict]:
+    """Collect the post-processing options, or None if none are set."""
+    options = {}
+    if args.trim_silence:
+        options["trim_silence"] = True
+    if args.gap is not None:
+        options["gap"] = args.gap
+    if args.chapter_gap is not None:
+        options["chapter_gap"] = args.chapter_gap
+    if args.loudness is not None:
+        options["loudness"] = args.loudness
+    if options:
+        options["threshold_db"] = args.silence_threshold
+    return options or None
+
+
+def check_postprocess(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """Exit with an error if the post-processing options are invalid."""
+    if args.gap is not None and args.gap < 0:
+        parser.error("--gap must not be negative")
+    if args.chapter_gap is not None and args.chapter_gap < 0:
+        parser.error("--chapter-gap must not be negative")
+    if args.engine == "fish" and postprocess_options(args):
+        parser.error("Post-processing options are only supported by Kokoro")
+
+
+def add_segment_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the text segmentation arguments to a parser."""
+    segment_group = parser.add_argument_group("Segmentation options")
+    segment_group.add_argument(
+        "--segment-length",
+        help="Target length in characters of the segments sentences are packed "
+        "into (defaults to 250 for Kokoro and 1200 for Fish Audio)",
+        type=int,
+    )
+
+    segment_group.add_argument(
+        "--split-pattern",
+        help="Regex pattern to split text into segments on, instead of packing "
+        "sentences (Kokoro only)",
+    )
+
+
+def add_lexicon_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the pronunciation lexicon arguments to a parser."""
+    lexicon_group = parser.add_argument_group("Pronunciation options")
+    lexicon_group.add_argument(
+        "--lexicon",
+        help="Pronunciation lexicon file: a JSON object, or one word and its "
+        "phonemes per line separated by a tab. Listed words are marked up with "
+        "their phonemes for the engine",
+        type=Path,
+    )
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the synthesis cache arguments to a parser."""
+    cache_group = parser.add_argument_group("Synthesis cache options")
+    cache_group.add_argument(
+        "--cache-dir",
+        help="Directory of the synthesis cache. Segments synthesized before with "
+        "the same engine, voice and speed are reused instead of re-synthesized",
+        type=Path,
+    )
+
+    cache_group.add_argument(
+        "--cache-size",
+        help="Size limit of the synthesis cache in megabytes",
+        type=int,
+        default=2048,
+    )
+
+
+def create_cache(args: argparse.Namespace):
+    """Create the synthesis cache selected by the arguments, or None."""
+    if not args.cache_dir:
+        return None
+
+    from epub_to_audiobook.cache import SynthesisCache
+
+    return SynthesisCache(args.cache_dir, max_bytes=args.cache_size * 1024**2)
+
+
+def add_progress_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the progress reporting arguments to a parser."""
+    progress_group = parser.add_argument_group("Progress options")
+    progress_group.add_argument(
+        "--no-progress",
+        help="Don't print the live progress line with the ETA",
+        action="store_true",
+    )
+
+    progress_group.add_argument(
+        "--events-log",
+        help="Append a JSON line to this file for every timing event (segments, "
+        "chapters, stages and the end-of-run summary)",
+        type=Path,
+    )
+
+
+def create_progress(args: argparse.Namespace):
+    """Create the Progress a run reports to, from the progress arguments."""
+    from epub_to_audiobook.progress import EventLog, Progress, ProgressPrinter
+
+    listeners = [ProgressPrinter(live=not args.no_progress)]
+    if args.events_log:
+        listeners.append(EventLog(args.events_log))
+    return Progress(listeners)
+
+
+def print_cache_stats(stats: Dict) -> None:
+    """Print the hit and miss counts of the synthesis cache."""
+    print(
+        f"Synthesis cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate)",
+        file=sys.stderr,
+    )
+
+
+def print_phoneme_stats(stats: Dict) -> None:
+    """Print the hit and miss counts of the phoneme cache and the time saved."""
+    if not stats["hits"] + stats["misses"]:
+        return
+    print(
+        f"Phoneme cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate), {stats['seconds_saved']:.1f}s of "
+        "G2P saved",
+        file=sys.stderr,
+    )
+
+
+def check_format(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Reject output formats the selected engine can't produce."""
+    if args.engine == "fish" and args.format not in FISH_FORMATS:
+        parser.error(
+            f"Fish Audio output format must be one of {', '.join(FISH_FORMATS)}"
+        )
+
+
+def open_output(path: Path):
+    """Open the output audio file, or stdout for STDIO, for writing."""
+    if path == STDIO:
+        from epub_to_audiobook.encoders import StreamOutput
+
+        return contextlib.nullcontext(StreamOutput(sys.stdout.buffer))
+    return open(path, "wb")
+
+
+def engine_options_from_args(args: argparse.Namespace) -> Tuple[str, Dict]:
+    """
+    Collect the text_to_speech options of the selected engine.
+
+    Returns:
+        The audio format the engine writes and the keyword arguments for the
+        engine's text_to_speech method.
+    """
+    if args.engine == "fish":
+        return args.format, {
+            "reference_id": args.reference_id,
+            "bitrate": args.bitrate,
+            "chunk_length": args.chunk_length,
+            "normalize": not args.no_normalize,
+            "latency": args.latency,
+            "segment_length": args.segment_length,
+        }
+
+    return args.format, {
+        "voice": args.voice,
+        "speed": args.speed,
+        "split_pattern": args.split_pattern,
+        "batch_size": args.batch_size,
+        "segment_length": args.segment_length,
+        "postprocess": postprocess_options(args),
+        "pipeline_depth": args.pipeline_depth,
+    }
+
+
+def book_main(argv: List[str]) -> None:
+    """Entry point for the 'book' command, which converts a whole EPUB file."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio book",
+        description="Convert every chapter of an EPUB file to its own audio file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "epub",
+        help="Path to the EPUB file to convert",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        help="Directory to save the chapter audio files and manifest",
+        type=Path,
+        default=Path("audiobook"),
+    )
+
+    parser.add_argument(
+        "--engine",
+        help="TTS engine to use",
+        choices=["fish", "kokoro"],
+        default="kokoro",
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-j",
+        help="Number of Kokoro worker processes (defaults to the CPU count)",
+        type=int,
+    )
+
+    add_fish_arguments(parser)
+    add_kokoro_arguments(parser)
+    add_postprocess_arguments(parser)
+    add_segment_arguments(parser)
+    add_lexicon_arguments(parser)
+
+    parser.add_argument(
+        "--format",
+        help="Output audio format",
+        choices=AUDIO_FORMATS,
+        default="wav",
+    )
+
+    add_cache_arguments(parser)
+    add_progress_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    check_common_arguments(parser, args)
+    check_format(parser, args)
+    check_postprocess(parser, args)
+    check_backend(parser, args)
+
+    audio_format, engine_options = engine_options_from_args(args)
+
+    from epub_to_audiobook.book import synthesize_book
+
+    try:
+        print(f"Converting {args.epub} chapter by chapter...", file=sys.stderr)
+        manifest = synthesize_book(
+            str(args.epub),
+            args.output_dir,
+            engine=args.engine,
+            audio_format=audio_format,
+            workers=args.workers,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            stream=args.stream,
+            lang_code=args.lang_code,
+            engine_options=engine_options,
+            onnx_options=onnx_options_from_args(args),
+            lexicon=args.lexicon,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024**2,
+            progress=create_progress(args),
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error converting book to speech: {e}", file=sys.stderr)
+        print(f"Resume with: epub2audio --resume {args.output_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    print(
+        f"Saved {len(manifest['chapters'])} chapters to {args.output_dir}",
+        file=sys.stderr,
+    )
+    if "cache" in manifest:
+        print_cache_stats(manifest["cache"])
+    if "phonemes" in manifest:
+        print_phoneme_stats(manifest["phonemes"])
+
+
+def batch_main(argv: List[str]) -> None:
+    """Entry point for the 'batch' command, which converts many EPUB files."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio batch",
+        description="Convert a catalog of EPUB files on one shared pool of "
+        "workers, writing each book to its own directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "source",
+        help="Directory of EPUB files, or a JSON manifest listing EPUB paths or "
+        "objects with 'epub' and optional 'name', 'output_dir' and 'priority' "
+        "(higher goes first)",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        help="Directory to create the directory of each book in, and to save "
+        "the batch summary to",
+        type=Path,
+        default=Path("audiobooks"),
+    )
+
+    parser.add_argument(
+        "--engine",
+        help="TTS engine to use",
+        choices=["fish", "kokoro"],
+        default="kokoro",
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-j",
+        help="Number of Kokoro worker processes shared by all books (defaults "
+        "to the CPU count)",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--max-chapters-per-book",
+        help="Maximum number of chapters of one book in flight at once, to "
+        "spread the workers over more books",
+        type=int,
+    )
+
+    add_fish_arguments(parser)
+    add_kokoro_arguments(parser)
+    add_postprocess_arguments(parser)
+    add_segment_arguments(parser)
+    add_lexicon_arguments(parser)
+
+    parser.add_argument(
+        "--format",
+        help="Output audio format",
+        choices=AUDIO_FORMATS,
+        default="wav",
+    )
+
+    add_cache_arguments(parser)
+    add_progress_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    check_common_arguments(parser, args)
+
+    if args.max_chapters_per_book is not None and args.max_chapters_per_book < 1:
+        parser.error("--max-chapters-per-book must be at least 1")
+
+    check_format(parser, args)
+    check_postprocess(parser, args)
+    check_backend(parser, args)
+
+    audio_format, engine_options = engine_options_from_args(args)
+
+    from epub_to_audiobook.batch import load_catalog, synthesize_books
+
+    try:
+        catalog = load_catalog(args.source, args.output_dir)
+        print(f"Converting {len(catalog)} books...", file=sys.stderr)
+        summary = synthesize_books(
+            catalog,
+            args.output_dir,
+            engine=args.engine,
+            audio_format=audio_format,
+            workers=args.workers,
+            concurrency=args.concurrency,
+            per_book_limit=args.max_chapters_per_book,
+            rate_limit=args.rate_limit,
+            stream=args.stream,
+            lang_code=args.lang_code,
+            engine_options=engine_options,
+            onnx_options=onnx_options_from_args(args),
+            lexicon=args.lexicon,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024**2,
+            progress=create_progress(args),
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error converting books to speech: {e}", file=sys.stderr)
+        print(
+            "Run the same command again to resume: finished chapters are skipped",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    failed = [book for book in summary["books"] if book["status"] == "failed"]
+    print(
+        f"Saved {len(summary['books']) - len(failed)} books to {args.output_dir}",
+        file=sys.stderr,
+    )
+    if "cache" in summary:
+        print_cache_stats(summary["cache"])
+    if "phonemes" in summary:
+        print_phoneme_stats(summary["phonemes"])
+    if failed:
+        print(f"{len(failed)} books failed:", file=sys.stderr)
+        for book in failed:
+            print(f"  {book['name']}: {book['error']}", file=sys.stderr)
+        sys.exit(1)
+
+
+def plan_main(argv: List[str]) -> None:
+    """Entry point for the 'plan' command, which estimates a book's conversion."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio plan",
+        description="Print the chapters of an EPUB file with their size and the "
+        "estimated audio duration and synthesis time of each",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "epub",
+        help="Path to the EPUB file to plan",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--engine",
+        help="TTS engine to estimate the synthesis time for",
+        choices=["fish", "kokoro"],
+        default="kokoro",
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-j",
+        help="Number of workers the chapters are shared between (defaults to "
+        "the CPU count)",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--rtf",
+        help="Seconds of synthesis per second of audio on this machine, as "
+        "reported at the end of a conversion, instead of the engine's rough "
+        "default",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--json",
+        help="Print the plan as JSON",
+        action="store_true",
+    )
+
+    args = parser.parse_args(argv)
+
+    check_common_arguments(parser, args)
+
+    if args.rtf is not None and args.rtf <= 0:
+        parser.error("--rtf must be positive")
+
+    from epub_to_audiobook.plan import plan_book
+    from epub_to_audiobook.progress import format_duration
+
+    try:
+        plan = plan_book(
+            str(args.epub),
+            engine=args.engine,
+            workers=args.workers or os.cpu_count() or 1,
+            rtf=args.rtf,
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(plan, indent=2))
+        return
+
+    print(
+        f"{'#':>3}  {'title':<32}  {'chars':>8}  {'words':>7}  {'sents':>6}  "
+        f"{'audio':>8}  {'synth':>8}"
+    )
+    for chapter in plan["chapters"]:
+        print(
+            f"{chapter['index']:>3}  {chapter['title'][:32]:<32}  "
+            f"{chapter['characters']:>8}  {chapter['words']:>7}  "
+            f"{chapter['sentences']:>6}  "
+            f"{format_duration(chapter['audio_seconds']):>8}  "
+            f"{format_duration(chapter['estimate']):>8}"
+        )
+    print(
+        f"\n{len(plan['chapters'])} chapters, {plan['characters']} characters, "
+        f"{plan['words']} words: about {format_duration(plan['audio_seconds'])} "
+        f"of audio and {format_duration(plan['synthesis_seconds'])} of "
+        f"{plan['engine']} synthesis"
+    )
+    print(
+        f"With {plan['workers']} workers: about "
+        f"{format_duration(plan['longest_first_seconds'])} longest chapters "
+        f"first ({format_duration(plan['reading_order_seconds'])} in reading order)"
+    )
+
+
+def serve_main(argv: List[str]) -> None:
+    """Entry point for the 'serve' command, which streams a book being converted."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio serve",
+        description="Convert an EPUB or text file while serving it as HLS "
+        "playlists, so it can be listened to while it is synthesized",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "source",
+        help="Path to the EPUB file, or a text file, to convert",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--host",
+        help="Address to listen on",
+        default="127.0.0.1",
+    )
+
+    parser.add_argument(
+        "--port",
+        help="Port to listen on",
+        type=int,
+        default=8000,
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        help="Directory to keep the encoded segments in. Defaults to a temporary "
+        "directory removed when the server stops",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--engine",
+        help="TTS engine to use",
+        choices=["fish", "kokoro"],
+        default="kokoro",
+    )
+
+    add_fish_arguments(parser)
+    add_kokoro_arguments(parser)
+    add_segment_arguments(parser)
+    add_lexicon_arguments(parser)
+
+    parser.add_argument(
+        "--format",
+        help="Audio format of the segments (aac requires ffmpeg)",
+        choices=["mp3", "aac"],
+        default="mp3",
+    )
+
+    parser.add_argument(
+        "--segment-seconds",
+        help="Longest duration of a segment of the playlists in seconds",
+        type=float,
+        default=30.0,
+    )
+
+    parser.add_argument(
+        "--no-daemon",
+        help="Load Kokoro in this process even if a daemon is running",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--verbose",
+        help="Log each request",
+        action="store_true",
+    )
+
+    add_cache_arguments(parser)
+    add_progress_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    check_common_arguments(parser, args)
+
+    if args.segment_seconds <= 0:
+        parser.error("--segment-seconds must be positive")
+
+    if args.format == "aac":
+        import shutil
+
+        if shutil.which("ffmpeg") is None:
+            parser.error("--format aac requires ffmpeg")
+
+    check_backend(parser, args)
+
+    import tempfile
+
+    from epub_to_audiobook.segmenter import engine_segments
+    from epub_to_audiobook.serve import StreamedBook, serve_book
+
+    try:
+        # EPUB chapters are read one at a time, while the first ones are
+        # already being synthesized
+        if args.source.suffix.lower() == ".epub":
+            from epub_to_audiobook.epub_handler import iter_chapters
+
+            chapters = iter_chapters(str(args.source))
+        else:
+            with open(args.source, "r", encoding="utf-8") as f:
+                chapters = [{"title": args.source.stem, "text": f.read()}]
+        lexicon = None
+        if args.lexicon:
+            from epub_to_audiobook.lexicon import load_lexicon
+
+            lexicon = load_lexicon(args.lexicon)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    def segmented_chapters():
+        for chapter in chapters:
+            text = chapter["text"]
+            if lexicon is not None:
+                text = lexicon.apply(text, args.engine)
+            yield {
+                "title": chapter["title"],
+                "segments": engine_segments(
+                    text, args.engine, args.segment_length, args.split_pattern
+                ),
+            }
+
+    cache = create_cache(args)
+    progress = create_progress(args)
+    try:
+        if args.engine == "fish":
+            from epub_to_audiobook.fish_audio import PCM_SAMPLE_RATE, FishAudioTTS
+
+            tts = FishAudioTTS(cache=cache)
+            sample_rate = PCM_SAMPLE_RATE
+
+            def synthesize(segments):
+                return tts.synthesize_segments(
+                    segments,
+                    reference_id=args.reference_id,
+                    chunk_length=args.chunk_length,
+                    normalize=not args.no_normalize,
+                    latency=args.latency,
+                )
+
+        else:
+            from epub_to_audiobook.jobs import create_kokoro
+            from epub_to_audiobook.kokoro_tts import SAMPLE_RATE
+
+            onnx_options = onnx_options_from_args(args)
+            tts = None
+            if not args.no_daemon and onnx_options is None:
+                from epub_to_audiobook.daemon import connect_daemon
+
+                tts = connect_daemon(lang_code=args.lang_code, cache=cache)
+            if tts is None:
+                tts = create_kokoro(args.lang_code, cache, onnx_options)
+            sample_rate = SAMPLE_RATE
+
+            def synthesize(segments):
+                return tts.synthesize_segments(
+                    segments,
+                    voice=args.voice,
+                    speed=args.speed,
+                    pipeline_depth=args.pipeline_depth,
+                )
+
+    except (ImportError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix="epub2audio-serve-") as temp_dir:
+        book = StreamedBook(
+            segmented_chapters(),
+            synthesize,
+            sample_rate,
+            args.output_dir or Path(temp_dir),
+            audio_format=args.format,
+            segment_seconds=args.segment_seconds,
+            progress=progress,
+        )
+        # The total grows as the chapters are read
+        progress.start(0)
+        url = f"http://{args.host}:{args.port}"
+        print(f"Serving {args.source} at {url}/", file=sys.stderr)
+        print(
+            f"Play {url}/book.m3u8, or {url}/chapters/N.m3u8 to start at chapter N, "
+            "in Safari, VLC, mpv or ffplay",
+            file=sys.stderr,
+        )
+        try:
+            serve_book(
+                book,
+                host=args.host,
+                port=args.port,
+                title=args.source.stem,
+                verbose=args.verbose,
+            )
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+
+def assemble_main(argv: List[str]) -> None:
+    """Entry point for the 'assemble' command, which packages a converted book."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio assemble",
+        description="Assemble the chapter files of a converted book into one "
+        "audiobook with chapter markers",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "book_dir",
+        help="Output directory of the book command",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="Path of the audiobook (.m4b or .mp3). Defaults to an M4B file "
+        "named after the EPUB file inside the book directory",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--title",
+        help="Title of the audiobook. Defaults to the EPUB file name",
+    )
+
+    args = parser.parse_args(argv)
+
+    from epub_to_audiobook.assemble import assemble_book
+
+    try:
+        output = assemble_book(args.book_dir, output=args.output, title=args.title)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Audiobook saved to {output}", file=sys.stderr)
+
+
+def daemon_main(argv: List[str]) -> None:
+    """Entry point for the 'daemon' command, which serves warm Kokoro pipelines."""
+    parser = argparse.ArgumentParser(
+        prog="epub2audio daemon",
+        description="Keep Kokoro pipelines loaded in a background server that "
+        "other epub2audio commands use automatically while it is running",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        "--socket",
+        help="Path of the Unix socket to listen on (defaults to "
+        "$EPUB2AUDIO_SOCKET or a per-user socket in the temp directory)",
+        type=Path,
+    )
+
+    parser.add_argument(
+        "--lang-code",
+        help="Language code of a pipeline to load at startup. Can be repeated; "
+        "other pipelines are loaded on first use",
+        choices=["a", "b", "j", "z", "e", "f", "h", "i", "p"],
+        action="append",
+    )
+
+    parser.add_argument(
+        "--voice",
+        help="Voice to load at startup. Can be repeated",
+        action="append",
+    )
+
+    parser.add_argument(
+        "--verbose",
+        help="Log each request",
+        action="store_true",
+    )
+
+    actions = parser.add_mutually_exclusive_group()
+    actions.add_argument(
+        "--status",
+        help="Print the status of the running daemon and exit",
+        action="store_true",
+    )
+
+    actions.add_argument(
+        "--stop",
+        help="Stop the running daemon and exit",
+        action="store_true",
+    )
+
+    args = parser.parse_args(argv)
+
+    from epub_to_audiobook.daemon import KokoroDaemon, ping_daemon, stop_daemon
+
+    if args.status:
+        status = ping_daemon(args.socket)
+        if status is None:
+            print("No daemon is running", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(status, indent=2))
+        return
+
+    if args.stop:
+        if not stop_daemon(args.socket):
+            print("No daemon is running", file=sys.stderr)
+            sys.exit(1)
+        print("Daemon stopped", file=sys.stderr)
+        return
+
+    daemon = KokoroDaemon(args.socket, verbose=args.verbose)
+    try:
+        daemon.preload(args.lang_code or ["a"], args.voice or [])
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except (ImportError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+# Subcommands, dispatched on the first command line argument
+COMMANDS = {
+    "book": book_main,
+    "batch": batch_main,
+    "plan": plan_main,
+    "serve": serve_main,
+    "assemble": assemble_main,
+    "daemon": daemon_main,
+}
+
+
+def main(argv: Optional[List[str]] = None):
     """Main entry point for the CLI."""
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+        return
+
     parser = argparse.ArgumentParser(
         description="Convert text to speech using various TTS engines",
+        epilog="To convert a whole EPUB file, run 'epub2audio book --help'. To "
+        "package its chapters into one audiobook, run 'epub2audio assemble --help'. "
+        "To convert many EPUB files at once, run 'epub2audio batch --help'. "
+        "To estimate a conversion, run 'epub2audio plan --help'. "
+        "To listen while converting, run 'epub2audio serve --help'. "
+        "To keep Kokoro loaded between runs, run 'epub2audio daemon --help'.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
@@ -26,14 +1120,17 @@ def main():
     parser.add_argument(
         "--file",
         "-f",
-        help="Path to a text file containing the text to convert",
+        help="Path to a text file containing the text to convert, or '-' to "
+        "read it from stdin as it arrives",
         type=Path,
     )
 
     parser.add_argument(
         "--output",
         "-o",
-        help="Path to save the output audio file",
+        help="Path to save the output audio file, or '-' to write it to stdout, "
+        "as raw signed 16-bit little-endian mono PCM (s16le) at 24000 Hz for "
+        "Kokoro and 44100 Hz for Fish Audio unless --format is given",
         type=Path,
         default=Path("output.wav"),
     )
@@ -45,80 +1142,83 @@ def main():
         default="kokoro",
     )
     
-    # Fish Audio specific arguments
-    fish_group = parser.add_argument_group("Fish Audio TTS options")
-    fish_group.add_argument(
-        "--reference-id",
-        "-r",
-        help="ID of a voice model to use (Fish Audio only)",
-    )
+    add_fish_arguments(parser)
+    add_kokoro_arguments(parser)
+    add_postprocess_arguments(parser)
+    add_segment_arguments(parser)
+    add_lexicon_arguments(parser)
 
-    fish_group.add_argument(
-        "--bitrate",
-        help="MP3 bitrate for Fish Audio (only applicable if format is mp3)",
-        type=int,
-        choices=[64, 128, 192],
-        default=128,
+    parser.add_argument(
+        "--no-daemon",
+        help="Load Kokoro in this process even if a daemon is running",
+        action="store_true",
     )
 
-    fish_group.add_argument(
-        "--chunk-length",
-        help="Length of each chunk in milliseconds (Fish Audio only)",
-        type=int,
-        default=200,
-        choices=range(100, 301),
-        metavar="[100-300]",
+    parser.add_argument(
+        "--format",
+        help="Output audio format (default: wav, or pcm with --output -)",
+        choices=AUDIO_FORMATS,
+        default=argparse.SUPPRESS,
     )
 
-    fish_group.add_argument(
-        "--no-normalize",
-        help="Disable text normalization (Fish Audio only)",
-        action="store_true",
-    )
+    add_cache_arguments(parser)
+    add_progress_arguments(parser)
 
-    fish_group.add_argument(
-        "--latency",
-        help="Latency mode (Fish Audio only)",
-        choices=["normal", "balanced"],
-        default="normal",
-    )
-    
-    # Kokoro TTS specific arguments
-    kokoro_group = parser.add_argument_group("Kokoro TTS options")
-    kokoro_group.add_argument(
-        "--lang-code",
-        help="Language code for Kokoro TTS",
-        choices=["a", "b", "j", "z", "e", "f", "h", "i", "p"],
-        default="a",
-    )
-    
-    kokoro_group.add_argument(
-        "--voice",
-        help="Voice ID for Kokoro TTS",
-        default="af_heart",
-    )
-    
-    kokoro_group.add_argument(
-        "--speed",
-        help="Speech speed multiplier for Kokoro TTS",
-        type=float,
-        default=1.0,
-    )
-    
-    kokoro_group.add_argument(
-        "--split-pattern",
-        help="Regex pattern to split text for Kokoro TTS",
-        default=r"\n+",
+    job_group = parser.add_argument_group("Resumable job options")
+    job_group.add_argument(
+        "--job-dir",
+        help="Run the conversion as a resumable job, checkpointing each finished "
+        "segment in this directory",
+        type=Path,
     )
 
-    parser.add_argument(
-        "--format",
-        help="Output audio format",
-        choices=["mp3", "wav", "pcm"],
-        default="wav",
+    job_group.add_argument(
+        "--resume",
+        help="Resume the interrupted job (or book conversion) in this directory, "
+        "synthesizing only the missing segments",
+        type=Path,
+        metavar="JOBDIR",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if "format" not in args:
+        args.format = "pcm" if args.output == STDIO else "wav"
+
+    if args.resume:
+        if args.text or args.file or args.job_dir:
+            parser.error("Cannot provide text, --file or --job-dir with --resume")
+
+        from epub_to_audiobook.jobs import load_job, resume_job
+
+        try:
+            command = load_job(args.resume)["command"]
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        # Book jobs keep the cache settings they were started with
+        cache = create_cache(args) if command != "book" else None
+
+        try:
+            print(f"Resuming job in {args.resume}...", file=sys.stderr)
+            job = resume_job(
+                args.resume,
+                cache=cache,
+                use_daemon=not args.no_daemon,
+                progress=create_progress(args),
+            )
+        except FileNotFoundError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error resuming job: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        output = job["arguments"].get("output") or job["arguments"]["output_dir"]
+        print(f"Audio saved to {output}", file=sys.stderr)
+        if cache is not None:
+            print_cache_stats(cache.stats())
+        return
 
     # Validate input arguments
     if not args.text and not args.file:
@@ -127,10 +1227,34 @@ def main():
     if args.text and args.file:
         parser.error("Cannot provide both text and --file")
 
-    # Get the text to convert
-    if args.file:
+    if STDIO in (args.file, args.output):
+        from epub_to_audiobook.encoders import STREAM_FORMATS
+
+        if args.job_dir:
+            parser.error("Cannot use --job-dir with stdin or stdout")
+        if args.output == STDIO and args.format not in STREAM_FORMATS:
+            parser.error(
+                f"Output format for stdout must be one of {', '.join(STREAM_FORMATS)}"
+            )
+
+    check_common_arguments(parser, args)
+    check_format(parser, args)
+    check_postprocess(parser, args)
+    check_backend(parser, args)
+
+    # The cache directory is only created once the arguments are valid
+    cache = create_cache(args)
+    progress = create_progress(args)
+
+    # Get the text to convert. Text piped to stdin is read line by line while
+    # it is synthesized, instead of all at once.
+    lines = None
+    if args.file == STDIO:
+        text = None
+        lines = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    elif args.file:
         try:
-            with open(args.file, "r", encoding="utf-8") as f:
+            with progress.stage("read"), open(args.file, "r", encoding="utf-8") as f:
                 text = f.read()
         except FileNotFoundError:
             print(f"Error: File not found: {args.file}", file=sys.stderr)
@@ -141,17 +1265,77 @@ def main():
     else:
         text = args.text
 
+    if args.lexicon:
+        from epub_to_audiobook.lexicon import load_lexicon
+
+        try:
+            lexicon = load_lexicon(args.lexicon)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        if lines is None:
+            text = lexicon.apply(text, args.engine)
+        else:
+            lines = (lexicon.apply(line, args.engine) for line in lines)
+
     # Create the output directory if it doesn't exist
     output_dir = args.output.parent
-    if not output_dir.exists():
+    if args.output != STDIO and not output_dir.exists():
         output_dir.mkdir(parents=True)
-    
+    destination = "stdout" if args.output == STDIO else args.output
+
+    if args.job_dir:
+        from epub_to_audiobook.jobs import INPUT_FILE, run_text_job, save_job
+
+        audio_format, engine_options = engine_options_from_args(args)
+        arguments = {
+            "output": str(args.output.resolve()),
+            "engine": args.engine,
+            "audio_format": audio_format,
+            "lang_code": args.lang_code,
+            "engine_options": engine_options,
+            "onnx_options": onnx_options_from_args(args),
+        }
+
+        try:
+            save_job(args.job_dir, "text", arguments)
+            with open(args.job_dir / INPUT_FILE, "w", encoding="utf-8") as f:
+                f.write(text)
+
+            print(
+                f"Converting text to speech as job {args.job_dir}...", file=sys.stderr
+            )
+            run_text_job(
+                args.job_dir,
+                cache=cache,
+                use_daemon=not args.no_daemon,
+                progress=progress,
+                **arguments,
+            )
+        except Exception as e:
+            print(f"Error converting text to speech: {e}", file=sys.stderr)
+            print(f"Resume with: epub2audio --resume {args.job_dir}", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"Audio saved to {args.output}", file=sys.stderr)
+        if cache is not None:
+            print_cache_stats(cache.stats())
+        return
+
     # Use the selected TTS engine
+    progress.start(len(text) if lines is None else 0)
     try:
         if args.engine == "fish":
             # Fish Audio TTS
+            from epub_to_audiobook.fish_audio import FishAudioTTS, stream_sentences
+            from epub_to_audiobook.segmenter import stream_segments
+
             try:
-                tts = FishAudioTTS()
+                tts = FishAudioTTS(
+                    cache=cache,
+                    concurrency=args.concurrency,
+                    requests_per_second=args.rate_limit,
+                )
             except ValueError as e:
                 print(f"Error: {e}", file=sys.stderr)
                 sys.exit(1)
@@ -160,39 +1344,93 @@ def main():
                 sys.exit(1)
                 
             print("Converting text to speech using Fish Audio...", file=sys.stderr)
-            with open(args.output, "wb") as output_file:
-                tts.text_to_speech(
-                    text=text,
-                    output_file=output_file,
-                    reference_id=args.reference_id,
-                    audio_format=args.format,
-                    bitrate=args.bitrate,
-                    chunk_length=args.chunk_length,
-                    normalize=not args.no_normalize,
-                    latency=args.latency,
-                )
+            options = {
+                "reference_id": args.reference_id,
+                "audio_format": args.format,
+                "bitrate": args.bitrate,
+                "chunk_length": args.chunk_length,
+                "normalize": not args.no_normalize,
+                "latency": args.latency,
+            }
+            with open_output(args.output) as output_file:
+                # A pipe is fed through one streaming session, since concurrent
+                # requests need the whole text and a seekable output
+                if args.stream or STDIO in (args.file, args.output):
+                    if lines is not None:
+                        text_stream = (
+                            segment + " "
+                            for segment in stream_segments(
+                                lines, "fish", args.segment_length
+                            )
+                        )
+                    else:
+                        text_stream = stream_sentences(text)
+                    with progress.stage("stream"):
+                        tts.text_to_speech_stream(
+                            text_stream, output_file, **options
+                        )
+                else:
+                    import asyncio
+
+                    # Long text is split into segments that are requested concurrently
+                    asyncio.run(
+                        tts.text_to_speech_async(
+                            text=text,
+                            output_file=output_file,
+                            segment_length=args.segment_length,
+                            progress=progress,
+                            **options,
+                        )
+                    )
         else:
-            # Kokoro TTS
-            from epub_to_audiobook.kokoro_tts import KokoroTTS
-            
-            try:
-                tts = KokoroTTS(lang_code=args.lang_code)
-            except ImportError as e:
-                print(f"Error: {e}", file=sys.stderr)
-                sys.exit(1)
-                
-            print("Converting text to speech using Kokoro TTS...", file=sys.stderr)
-            with open(args.output, "wb") as output_file:
+            # Kokoro TTS, run by the daemon when one is running
+            from epub_to_audiobook.jobs import create_kokoro
+
+            onnx_options = onnx_options_from_args(args)
+            tts = None
+            if not args.no_daemon and onnx_options is None:
+                from epub_to_audiobook.daemon import connect_daemon
+
+                tts = connect_daemon(lang_code=args.lang_code, cache=cache)
+
+            if tts is None:
+                try:
+                    tts = create_kokoro(args.lang_code, cache, onnx_options)
+                except ImportError as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                    sys.exit(1)
+                print("Converting text to speech using Kokoro TTS...", file=sys.stderr)
+            else:
+                print(
+                    "Converting text to speech using the Kokoro daemon...",
+                    file=sys.stderr,
+                )
+            if lines is not None:
+                from epub_to_audiobook.segmenter import stream_segments
+
+                text = stream_segments(
+                    lines, "kokoro", args.segment_length, args.split_pattern
+                )
+            with open_output(args.output) as output_file:
                 tts.text_to_speech(
                     text=text,
                     output_file=output_file,
                     voice=args.voice,
                     speed=args.speed,
                     split_pattern=args.split_pattern,
-                    audio_format=args.format if args.format != "pcm" else "wav",
+                    audio_format=args.format,
+                    batch_size=args.batch_size,
+                    segment_length=args.segment_length,
+                    progress=progress,
+                    postprocess=postprocess_options(args),
+                    pipeline_depth=args.pipeline_depth,
                 )
+            print_phoneme_stats(tts.phonemes.stats())
                 
-        print(f"Audio saved to {args.output}", file=sys.stderr)
+        progress.finish()
+        print(f"Audio saved to {destination}", file=sys.stderr)
+        if cache is not None:
+            print_cache_stats(cache.stats())
     except Exception as e:
         print(f"Error converting text to speech: {e}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,419 @@
+"""
+Kokoro synthesis daemon module.
+
+Loading the Kokoro model and its G2P pipeline takes far longer than
+synthesizing a short text, so running many small conversions pays mostly for
+startup. This module provides a long-lived local server that keeps one warm
+KokoroTTS instance (with its loaded voices) per language code, listening on a
+Unix socket, and a client with the same interface as KokoroTTS that sends the
+model runs to the server. Segmenting, caching and encoding stay in the client
+process.
+"""
+
+import http.client
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from epub_to_audiobook.cache import SynthesisCache
+from epub_to_audiobook.kokoro_tts import KokoroTTS, _concatenate
+from epub_to_audiobook.phonemes import PhonemeCache
+
+# Environment variable overriding the socket path of the daemon
+SOCKET_ENV = "EPUB2AUDIO_SOCKET"
+
+# Seconds to wait for the daemon to answer a status request
+CONNECT_TIMEOUT = 1.0
+
+# Frame kinds of a synthesis response: a block of float32 audio or an error
+_AUDIO_FRAME = b"A"
+_ERROR_FRAME = b"E"
+
+# Frame header: the frame kind and the payload length
+_FRAME_HEADER = struct.Struct(">cI")
+
+
+def default_socket_path() -> Path:
+    """Return the socket path of the daemon, honoring EPUB2AUDIO_SOCKET."""
+    if os.environ.get(SOCKET_ENV):
+        return Path(os.environ[SOCKET_ENV])
+    user = os.getuid() if hasattr(os, "getuid") else os.getlogin()
+    return Path(tempfile.gettempdir()) / f"epub2audio-{user}.sock"
+
+
+def _frame(kind: bytes, payload: bytes) -> bytes:
+    """Encode one frame of a synthesis response."""
+    return _FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTP connection over a Unix socket."""
+
+    def __init__(self, socket_path: Path, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = str(socket_path)
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A threaded HTTP server listening on a Unix socket."""
+
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Serve the status and synthesis endpoints of the daemon."""
+
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return "local"
+
+    def log_message(self, format, *args):
+        if self.server.daemon.verbose:
+            print(f"epub2audio daemon: {format % args}", file=sys.stderr)
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send_json(200, self.server.daemon.status())
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        daemon = self.server.daemon
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if self.path == "/synthesize":
+                audios = daemon.synthesize(**request)
+            elif self.path == "/synthesize_batch":
+                audios = daemon.synthesize_batch(**request)
+            elif self.path == "/shutdown":
+                self._send_json(200, {"status": "stopping"})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+        except (TypeError, ValueError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        # Audio is sent as frames in a chunked body as soon as it is generated,
+        # so errors part way through are reported as a frame of their own
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for audio in audios:
+                self._write_chunk(_frame(_AUDIO_FRAME, audio.tobytes()))
+        except Exception as e:
+            self._write_chunk(_frame(_ERROR_FRAME, str(e).encode("utf-8")))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+class KokoroDaemon:
+    """A synthesis server that keeps Kokoro pipelines loaded between requests."""
+
+    def __init__(self, socket_path: Optional[Path] = None, verbose: bool = False):
+        """
+        Initialize the KokoroDaemon class.
+
+        Args:
+            socket_path: Path of the Unix socket to listen on. Defaults to
+                         default_socket_path().
+            verbose: Whether to log each request to stderr.
+        """
+        self.socket_path = Path(socket_path or default_socket_path())
+        self.verbose = verbose
+        self.engines: Dict[str, KokoroTTS] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._engines_lock = threading.Lock()
+
+    def engine(self, lang_code: str):
+        """
+        Return the warm engine of a language code, loading it on first use.
+
+        Returns:
+            The KokoroTTS instance and the lock that serializes its model runs.
+        """
+        with self._engines_lock:
+            if lang_code not in self.engines:
+                print(f"Loading Kokoro pipeline '{lang_code}'...", file=sys.stderr)
+                self.engines[lang_code] = KokoroTTS(lang_code=lang_code)
+                self._locks[lang_code] = threading.Lock()
+            return self.engines[lang_code], self._locks[lang_code]
+
+    def preload(self, lang_codes: Iterable[str], voices: Iterable[str] = ()) -> None:
+        """Load the pipelines of some language codes and voices up front."""
+        voices = list(voices)
+        for lang_code in lang_codes:
+            tts, _ = self.engine(lang_code)
+            for voice in voices:
+                tts.pipeline.load_voice(voice)
+
+    def status(self) -> Dict:
+        """Return the process ID and the loaded pipelines and voices."""
+        return {
+            "pid": os.getpid(),
+            "pipelines": {
+                lang_code: sorted(tts.pipeline.voices)
+                for lang_code, tts in self.engines.items()
+            },
+        }
+
+    def synthesize(
+        self,
+        text: str,
+        lang_code: str = "a",
+        voice: str = "af_heart",
+        speed: float = 1.0,
+        split_pattern: Optional[str] = None,
+    ) -> Iterator[np.ndarray]:
+        """Run the pipeline on a text, yielding the audio of each chunk."""
+        tts, lock = self.engine(lang_code)
+        with lock:
+            yield from tts.synthesize_chunks(text, voice, speed, split_pattern)
+
+    def synthesize_batch(
+        self,
+        segments: List[str],
+        lang_code: str = "a",
+        voice: str = "af_heart",
+        speed: float = 1.0,
+        batch_size: int = 1,
+    ) -> Iterator[np.ndarray]:
+        """Synthesize segments with batched inference, yielding one per segment."""
+        tts, lock = self.engine(lang_code)
+        with lock:
+            audios = tts.synthesize_batch(segments, voice, speed, batch_size)
+        yield from audios
+
+    def serve_forever(self) -> None:
+        """
+        Listen on the socket until interrupted or asked to shut down.
+
+        Raises:
+            RuntimeError: If another daemon is already listening on the socket.
+        """
+        if self.socket_path.exists():
+            if ping_daemon(self.socket_path) is not None:
+                raise RuntimeError(f"A daemon is already running on {self.socket_path}")
+            # Left behind by a daemon that didn't shut down cleanly
+            self.socket_path.unlink()
+
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        server = _DaemonServer(str(self.socket_path), _RequestHandler)
+        server.daemon = self
+        try:
+            os.chmod(self.socket_path, 0o600)
+            print(f"Listening on {self.socket_path}", file=sys.stderr)
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+
+def ping_daemon(socket_path: Optional[Path] = None) -> Optional[Dict]:
+    """
+    Ask a daemon for its status.
+
+    Args:
+        socket_path: Path of the daemon's socket. Defaults to
+                     default_socket_path().
+
+    Returns:
+        The status of the daemon, or None if no daemon is listening.
+    """
+    socket_path = Path(socket_path or default_socket_path())
+    if not socket_path.exists():
+        return None
+
+    connection = _UnixHTTPConnection(socket_path, timeout=CONNECT_TIMEOUT)
+    try:
+        connection.request("GET", "/status")
+        response = connection.getresponse()
+        if response.status != 200:
+            return None
+        return json.loads(response.read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+
+
+def stop_daemon(socket_path: Optional[Path] = None) -> bool:
+    """
+    Ask a running daemon to shut down.
+
+    Returns:
+        Whether a daemon was running.
+    """
+    socket_path = Path(socket_path or default_socket_path())
+    if ping_daemon(socket_path) is None:
+        return False
+
+    connection = _UnixHTTPConnection(socket_path, timeout=CONNECT_TIMEOUT)
+    try:
+        connection.request(
+            "POST", "/shutdown", b"{}", {"Content-Type": "application/json"}
+        )
+        connection.getresponse().read()
+    finally:
+        connection.close()
+    return True
+
+
+class DaemonKokoroTTS(KokoroTTS):
+    """A KokoroTTS client that runs the model in a warm daemon process."""
+
+    def __init__(
+        self,
+        lang_code: str = "a",
+        cache: Optional[SynthesisCache] = None,
+        socket_path: Optional[Path] = None,
+    ):
+        """
+        Initialize the DaemonKokoroTTS class.
+
+        Unlike KokoroTTS, no model is loaded in this process.
+
+        Args:
+            lang_code: Language code for the TTS model.
+            cache: Optional cache of synthesized segments, consulted before
+                   sending segments to the daemon.
+            socket_path: Path of the daemon's socket. Defaults to
+                         default_socket_path().
+        """
+        self.lang_code = lang_code
+        self.cache = cache
+        # G2P runs in the daemon, which keeps its own phoneme cache warm
+        self.phonemes = PhonemeCache(lang_code)
+        self.socket_path = Path(socket_path or default_socket_path())
+
+    def _request(self, path: str, body: Dict) -> Iterator[np.ndarray]:
+        """Send a synthesis request and yield the audio blocks of the response."""
+        connection = _UnixHTTPConnection(self.socket_path)
+        try:
+            connection.request(
+                "POST",
+                path,
+                json.dumps(body).encode("utf-8"),
+                {"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            if response.status != 200:
+                message = json.loads(response.read()).get("error")
+                raise RuntimeError(f"Kokoro daemon rejected the request: {message}")
+
+            while True:
+                header = response.read(_FRAME_HEADER.size)
+                if not header:
+                    break
+                kind, length = _FRAME_HEADER.unpack(header)
+                payload = response.read(length)
+                if kind == _ERROR_FRAME:
+                    raise RuntimeError(payload.decode("utf-8"))
+                yield np.frombuffer(payload, dtype=np.float32)
+        finally:
+            connection.close()
+
+    def _g2p(self, segments: List[str]) -> List[Tuple[int, str]]:
+        # The daemon phonemizes the segments it is sent
+        return []
+
+    def _infer(
+        self,
+        segments: List[str],
+        chunks: List[Tuple[int, str]],
+        voice: str,
+        speed: float,
+        batch_size: int,
+    ) -> List[np.ndarray]:
+        if batch_size > 1:
+            return self.synthesize_batch(segments, voice, speed, batch_size)
+        return [
+            _concatenate(list(self.synthesize_chunks(segment, voice, speed, None)))
+            for segment in segments
+        ]
+
+    def synthesize_chunks(
+        self, text: str, voice: str, speed: float, split_pattern: Optional[str]
+    ) -> Iterator[np.ndarray]:
+        yield from self._request(
+            "/synthesize",
+            {
+                "text": text,
+                "lang_code": self.lang_code,
+                "voice": voice,
+                "speed": speed,
+                "split_pattern": split_pattern,
+            },
+        )
+
+    def synthesize_batch(
+        self, segments: List[str], voice: str, speed: float, batch_size: int
+    ) -> List[np.ndarray]:
+        if not segments:
+            return []
+        return list(
+            self._request(
+                "/synthesize_batch",
+                {
+                    "segments": segments,
+                    "lang_code": self.lang_code,
+                    "voice": voice,
+                    "speed": speed,
+                    "batch_size": batch_size,
+                },
+            )
+        )
+
+
+def connect_daemon(
+    lang_code: str = "a",
+    cache: Optional[SynthesisCache] = None,
+    socket_path: Optional[Union[str, Path]] = None,
+) -> Optional[DaemonKokoroTTS]:
+    """
+    Connect to the Kokoro daemon if one is running.
+
+    Args:
+        lang_code: Language code for the TTS model.
+        cache: Optional cache of synthesized segments.
+        socket_path: Path of the daemon's socket. Defaults to
+                     default_socket_path().
+
+    Returns:
+        A client with the KokoroTTS interface, or None if no daemon is running.
+    """
+    if ping_daemon(socket_path) is None:
+        return None
+    return DaemonKokoroTTS(lang_code=lang_code, cache=cache, socket_path=socket_path)
@@ -0,0 +1,299 @@
+"""
+Audio encoder module.
+
+This module encodes float32 PCM audio incrementally, segment by segment, so
+that long conversions never hold the whole recording in memory or go through
+a temporary WAV file. WAV, MP3 and Opus are encoded natively by libsndfile;
+AAC and M4B are encoded by an ffmpeg subprocess fed through its stdin; raw
+PCM is written as is. StreamOutput lets encoders write to a pipe, such as
+stdout, which can't seek back to update headers.
+"""
+
+import shutil
+import subprocess
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
+
+# Output formats encoded by libsndfile, as (format, subtype) pairs
+SOUNDFILE_FORMATS: Dict[str, Tuple[str, Optional[str]]] = {
+    "wav": ("WAV", None),
+    "mp3": ("MP3", None),
+    "opus": ("OGG", "OPUS"),
+}
+
+# Output formats encoded by ffmpeg, as the muxer and its extra arguments
+FFMPEG_FORMATS: Dict[str, Tuple[str, ...]] = {
+    "aac": ("-f", "adts"),
+    # The output is a pipe, so the MP4 index can't be written at the end
+    "m4b": ("-f", "ipod", "-movflags", "+frag_keyframe+empty_moov"),
+}
+
+# Sample format of raw PCM output: signed 16-bit little-endian mono, at the
+# sample rate of the engine (as named by ffmpeg's -f option)
+PCM_SAMPLE_FORMAT = "s16le"
+
+# All output formats an encoder can be opened for
+ENCODER_FORMATS = list(SOUNDFILE_FORMATS) + list(FFMPEG_FORMATS) + ["pcm"]
+
+# Output formats that can be written to a pipe. WAV needs its header updated
+# with the length of the audio once it is written.
+STREAM_FORMATS = ["pcm", "mp3", "opus", "aac", "m4b"]
+
+# Default AAC bitrate used for the ffmpeg formats
+DEFAULT_AAC_BITRATE = "64k"
+
+# Number of bytes copied at a time from the ffmpeg output to the file
+_PIPE_CHUNK_BYTES = 64 * 1024
+
+
+class SoundFileEncoder:
+    """An encoder that writes audio through libsndfile."""
+
+    def __init__(self, output_file: BinaryIO, audio_format: str, samplerate: int):
+        """
+        Initialize the SoundFileEncoder class.
+
+        Args:
+            output_file: A file-like object (opened in binary write mode) to
+                         write the audio to.
+            audio_format: Output audio format ("wav", "mp3" or "opus").
+            samplerate: Sample rate of the audio in Hz.
+        """
+        import soundfile as sf
+
+        if isinstance(output_file, StreamOutput):
+            output_file.flush()
+            output_file = output_file.fileno()
+
+        file_format, subtype = SOUNDFILE_FORMATS[audio_format]
+        self.sound_file = sf.SoundFile(
+            output_file,
+            mode="w",
+            samplerate=samplerate,
+            channels=1,
+            format=file_format,
+            subtype=subtype,
+            closefd=False,
+        )
+
+    def write(self, audio) -> None:
+        """Encode a block of mono float32 audio."""
+        self.sound_file.write(audio)
+
+    def flush(self) -> None:
+        """Write out the encoded audio, keeping the file header up to date."""
+        self.sound_file.flush()
+
+    def close(self) -> None:
+        """Finish the encoded file."""
+        self.sound_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FFmpegEncoder:
+    """An encoder that pipes raw audio through an ffmpeg subprocess."""
+
+    def __init__(
+        self,
+        output_file: BinaryIO,
+        audio_format: str,
+        samplerate: int,
+        bitrate: str = DEFAULT_AAC_BITRATE,
+    ):
+        """
+        Initialize the FFmpegEncoder class.
+
+        Args:
+            output_file: A file-like object (opened in binary write mode) to
+                         write the audio to.
+            audio_format: Output audio format ("aac" or "m4b").
+            samplerate: Sample rate of the audio in Hz.
+            bitrate: AAC bitrate, such as '64k'.
+
+        Raises:
+            RuntimeError: If ffmpeg is not installed.
+        """
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError(
+                f"ffmpeg is required for {audio_format} output. "
+                "Install it with: brew install ffmpeg (or apt-get install ffmpeg)"
+            )
+
+        self.output_file = output_file
+        self.process = subprocess.Popen(
+            [
+                ffmpeg,
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-f",
+                "f32le",
+                "-ar",
+                str(samplerate),
+                "-ac",
+                "1",
+                "-i",
+                "pipe:0",
+                "-c:a",
+                "aac",
+                "-b:a",
+                bitrate,
+                *FFMPEG_FORMATS[audio_format],
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        # Drain both output pipes while audio is fed in, so ffmpeg never blocks
+        self._errors = b""
+        self._stdout_thread = threading.Thread(target=self._copy_output, daemon=True)
+        self._stderr_thread = threading.Thread(target=self._read_errors, daemon=True)
+        self._stdout_thread.start()
+        self._stderr_thread.start()
+
+    def _copy_output(self) -> None:
+        """Copy the encoded audio from ffmpeg to the output file."""
+        for chunk in iter(lambda: self.process.stdout.read(_PIPE_CHUNK_BYTES), b""):
+            self.output_file.write(chunk)
+
+    def _read_errors(self) -> None:
+        """Collect the error messages of ffmpeg."""
+        self._errors = self.process.stderr.read()
+
+    def write(self, audio) -> None:
+        """Encode a block of mono float32 audio."""
+        import numpy as np
+
+        self.process.stdin.write(np.asarray(audio, dtype="<f4").tobytes())
+
+    def flush(self) -> None:
+        """Hand the buffered audio to ffmpeg."""
+        self.process.stdin.flush()
+
+    def close(self) -> None:
+        """
+        Finish the encoded file.
+
+        Raises:
+            RuntimeError: If ffmpeg failed to encode the audio.
+        """
+        if self.process.stdin.closed:
+            return
+
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self._stdout_thread.join()
+        self._stderr_thread.join()
+
+        if self.process.returncode != 0:
+            message = self._errors.decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"ffmpeg failed to encode audio: {message}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PCMEncoder:
+    """An encoder that writes raw PCM in PCM_SAMPLE_FORMAT."""
+
+    def __init__(self, output_file: BinaryIO):
+        """
+        Initialize the PCMEncoder class.
+
+        Args:
+            output_file: A file-like object (opened in binary write mode) to
+                         write the audio to.
+        """
+        self.output_file = output_file
+
+    def write(self, audio) -> None:
+        """Encode a block of mono float32 audio."""
+        import numpy as np
+
+        samples = np.clip(np.asarray(audio, dtype=np.float32), -1.0, 1.0) * 32767
+        self.output_file.write(np.round(samples).astype("<i2").tobytes())
+
+    def flush(self) -> None:
+        """Write out the buffered audio."""
+        self.output_file.flush()
+
+    def close(self) -> None:
+        """Finish the audio, which raw PCM has nothing to add to."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StreamOutput:
+    """
+    A pipe, such as stdout, that encoders send each block of audio to at once.
+
+    libsndfile writes to the pipe itself, through its file descriptor, so
+    that it knows not to seek back to update headers; the other encoders
+    write to it like to a file, and every write is flushed.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        """
+        Initialize the StreamOutput class.
+
+        Args:
+            stream: The pipe to write to, such as sys.stdout.buffer.
+        """
+        self.stream = stream
+
+    def write(self, data: bytes) -> int:
+        """Send data down the pipe."""
+        written = self.stream.write(data)
+        self.stream.flush()
+        return written
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def fileno(self) -> int:
+        return self.stream.fileno()
+
+
+def open_encoder(output_file: BinaryIO, audio_format: str, samplerate: int):
+    """
+    Open an incremental encoder for an output format.
+
+    Args:
+        output_file: A file-like object (opened in binary write mode) to write
+                     the audio to.
+        audio_format: Output audio format, one of ENCODER_FORMATS.
+        samplerate: Sample rate of the audio in Hz.
+
+    Returns:
+        An encoder with write, flush and close methods, usable as a context
+        manager.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if audio_format in SOUNDFILE_FORMATS:
+        return SoundFileEncoder(output_file, audio_format, samplerate)
+    if audio_format in FFMPEG_FORMATS:
+        return FFmpegEncoder(output_file, audio_format, samplerate)
+    if audio_format == "pcm":
+        return PCMEncoder(output_file)
+    raise ValueError(f"Audio format must be one of {', '.join(ENCODER_FORMATS)}")
@@ -6,9 +6,9 @@ such as the table of contents, text content, and metadata.
 """
 
 import os
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Union
 
-from ebooklib import epub
+from epub_to_audiobook.epub_reader import EpubReader, html_to_text  # noqa: F401
 
 
 def extract_toc(epub_path: str) -> List[Dict[str, Union[str, List]]]:
@@ -33,67 +33,95 @@ def extract_toc(epub_path: str) -> List[Dict[str, Union[str, List]]]:
     if not os.path.exists(epub_path):
         raise FileNotFoundError(f"EPUB file not found: {epub_path}")
 
-    try:
-        # Read the EPUB file
-        book = epub.read_epub(epub_path)
-
-        # Process the table of contents
-        toc = book.toc
-
-        # Function to recursively process TOC items
-        def process_toc_item(item, level=0):
-            result = []
-
-            if isinstance(item, epub.Link):
-                # It's a direct link
-                result.append(
-                    {
-                        "title": item.title,
-                        "href": item.href,
-                        "level": level,
-                        "children": [],
-                    }
-                )
-            elif isinstance(item, tuple) and len(item) == 2:
-                # It's a section with children
-                section, children = item
-
-                if isinstance(section, epub.Section):
-                    # Add the section
-                    section_item = {
-                        "title": section.title,
-                        "href": "",  # Sections might not have direct content
-                        "level": level,
-                        "children": [],
-                    }
-
-                    # Process children and add them to the section
-                    for child in children:
-                        child_items = process_toc_item(child, level + 1)
-                        section_item["children"].extend(child_items)
-
-                    result.append(section_item)
-                else:
-                    # Process children
-                    for child in children:
-                        child_items = process_toc_item(child, level)
-                        result.extend(child_items)
-            elif isinstance(item, list):
-                # It's a list of items
-                for child in item:
-                    child_items = process_toc_item(child, level)
-                    result.extend(child_items)
-
-            return result
-
-        # Process the entire TOC
-        processed_toc = []
-        for item in toc:
-            processed_toc.extend(process_toc_item(item))
-
-        return processed_toc
-
-    except Exception as e:
-        if "not a zip file" in str(e).lower():
-            raise ValueError(f"The file is not a valid EPUB file: {epub_path}")
-        raise
+    # Only the package and navigation documents are parsed, not the content
+    with EpubReader(epub_path) as reader:
+        return reader.toc()
+
+
+def iter_chapters(epub_path: str) -> Iterator[Dict[str, str]]:
+    """
+    Extract the text of each chapter from an EPUB file, one at a time.
+
+    Chapters are read and converted only as the iterator is advanced, so the
+    first chapter is available without reading the rest of the book and
+    memory stays proportional to one chapter. The file is kept open until
+    the iterator is exhausted or closed.
+
+    Args:
+        epub_path: Path to the EPUB file.
+
+    Returns:
+        An iterator over the chapters, as listed by extract_chapters.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file.
+    """
+    if not os.path.exists(epub_path):
+        raise FileNotFoundError(f"EPUB file not found: {epub_path}")
+
+    # Opened here rather than in the generator, so that errors are raised
+    # by this call instead of by the first chapter
+    reader = EpubReader(epub_path)
+
+    def chapters() -> Iterator[Dict[str, str]]:
+        with reader:
+            yield from reader.iter_chapters()
+
+    return chapters()
+
+
+def extract_chapters(epub_path: str) -> List[Dict[str, str]]:
+    """
+    Extract the text of each chapter from an EPUB file in reading order.
+
+    Chapters follow the spine of the book. Titles and nesting levels are
+    taken from the first TOC entry that links to the chapter document,
+    falling back to the document name at the top level. Callers that don't
+    need every chapter at once should use iter_chapters instead.
+
+    Args:
+        epub_path: Path to the EPUB file.
+
+    Returns:
+        A list of dictionaries, one per spine document with readable text.
+        Each dictionary contains:
+        - 'title': The title of the chapter
+        - 'href': The chapter document inside the EPUB
+        - 'text': The plain text of the chapter
+        - 'level': The nesting level of the chapter's TOC entry (0 for the top)
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file.
+    """
+    return list(iter_chapters(epub_path))
+
+
+def read_chapter(epub_path: str, href: str) -> str:
+    """
+    Extract the text of one chapter from an EPUB file.
+
+    Only the package and navigation documents and the chapter's own document
+    are read.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        href: The chapter's 'href', as listed by extract_chapters.
+
+    Returns:
+        The plain text of the chapter.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file or has no such
+                    chapter.
+    """
+    if not os.path.exists(epub_path):
+        raise FileNotFoundError(f"EPUB file not found: {epub_path}")
+
+    with EpubReader(epub_path) as reader:
+        try:
+            return reader.chapter_text(href)
+        except KeyError:
+            raise ValueError(f"No chapter {href} in EPUB file: {epub_path}")
@@ -0,0 +1,383 @@
+"""
+Lazy EPUB reader module.
+
+This module reads EPUB files straight from the zip archive. Only the
+container, the package document (OPF) and the navigation document or NCX
+are parsed when a book is opened; chapter documents are read and converted
+to text one at a time, on demand, so images, fonts and other chapters are
+never loaded into memory.
+"""
+
+import codecs
+import posixpath
+import zipfile
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List, Optional, Union
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+# Path of the container file that points to the package document
+CONTAINER_PATH = "META-INF/container.xml"
+
+# Media types of the documents that hold chapter text
+XHTML_MEDIA_TYPES = {"application/xhtml+xml", "text/html"}
+
+# Media type of an EPUB 2 navigation control file
+NCX_MEDIA_TYPE = "application/x-dtbncx+xml"
+
+# Number of characters fed to the HTML parser at a time
+_CHUNK_SIZE = 64 * 1024
+
+
+# Tags whose contents are never read aloud
+_SKIPPED_TAGS = {"head", "script", "style", "title", "svg", "math"}
+
+# Tags that start a new line of text when converted to plain text
+_BLOCK_TAGS = set(
+    "address article aside blockquote br dd div dl dt figcaption footer "
+    "h1 h2 h3 h4 h5 h6 header hr li ol p pre section table td th tr ul".split()
+)
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the readable text of an XHTML document, one block per line."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self.parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+def html_to_text(html: Union[str, bytes]) -> str:
+    """
+    Convert an XHTML chapter document to plain text.
+
+    Args:
+        html: The document content.
+
+    Returns:
+        The readable text with one paragraph per line.
+    """
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+def _local_name(tag: str) -> str:
+    """Strip the XML namespace from a tag or attribute name."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(element, name: str) -> List:
+    """Return the direct children of an element with a local name."""
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _text_content(element) -> str:
+    """Return the whitespace-normalized text of an element and its children."""
+    return " ".join("".join(element.itertext()).split())
+
+
+class EpubReader:
+    """A reader that loads the parts of an EPUB file only when they are used."""
+
+    def __init__(self, epub_path: str):
+        """
+        Open an EPUB file and parse its package and navigation documents.
+
+        Args:
+            epub_path: Path to the EPUB file.
+
+        Raises:
+            FileNotFoundError: If the EPUB file does not exist.
+            ValueError: If the file is not a valid EPUB file.
+        """
+        self.path = epub_path
+        try:
+            self.archive = zipfile.ZipFile(epub_path)
+        except zipfile.BadZipFile:
+            raise ValueError(f"The file is not a valid EPUB file: {epub_path}")
+
+        try:
+            container = self._parse_xml(CONTAINER_PATH)
+            rootfile = next(
+                element
+                for element in container.iter()
+                if _local_name(element.tag) == "rootfile"
+            )
+            self.opf_path = unquote(rootfile.get("full-path"))
+            self._parse_package(self._parse_xml(self.opf_path))
+        except (KeyError, StopIteration, TypeError, ElementTree.ParseError):
+            self.archive.close()
+            raise ValueError(f"The file is not a valid EPUB file: {epub_path}")
+
+        self._toc = None
+
+    def close(self) -> None:
+        """Close the archive."""
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _parse_xml(self, name: str):
+        """Parse an XML document of the archive."""
+        with self.archive.open(name) as f:
+            return ElementTree.parse(f).getroot()
+
+    def _resolve(self, base: str, href: str) -> str:
+        """Resolve an href relative to a document into an archive path."""
+        path = href.split("#", 1)[0]
+        return posixpath.normpath(
+            posixpath.join(posixpath.dirname(base), unquote(path))
+        )
+
+    def _parse_package(self, package) -> None:
+        """Read the metadata, manifest and spine of the package document."""
+        self.title = None
+        for metadata in _children(package, "metadata"):
+            for element in _children(metadata, "title"):
+                self.title = _text_content(element) or None
+                break
+
+        # Manifest items keyed by id, with their paths inside the archive
+        self.items = {}
+        for manifest in _children(package, "manifest"):
+            for item in _children(manifest, "item"):
+                self.items[item.get("id")] = {
+                    "path": self._resolve(self.opf_path, item.get("href", "")),
+                    "media_type": item.get("media-type", ""),
+                    "properties": (item.get("properties") or "").split(),
+                }
+
+        self.spine = []
+        self.ncx_id = None
+        for spine in _children(package, "spine"):
+            self.ncx_id = spine.get("toc")
+            for itemref in _children(spine, "itemref"):
+                if itemref.get("idref") in self.items:
+                    self.spine.append(itemref.get("idref"))
+
+    def href(self, path: str) -> str:
+        """Express an archive path relative to the package document."""
+        return posixpath.relpath(path, posixpath.dirname(self.opf_path) or ".")
+
+    def toc(self) -> List[Dict[str, Union[str, List]]]:
+        """
+        Return the table of contents.
+
+        The NCX is used when the book has one, and the EPUB 3 navigation
+        document otherwise.
+
+        Returns:
+            A list of dictionaries with the 'title', 'href' (relative to the
+            package document, fragment included), 'level' and 'children' of
+            each entry.
+        """
+        if self._toc is None:
+            ncx = self._find_item(lambda item: item["media_type"] == NCX_MEDIA_TYPE)
+            nav = self._find_item(lambda item: "nav" in item["properties"])
+            if ncx is not None:
+                self._toc = self._parse_ncx(ncx["path"])
+            elif nav is not None:
+                self._toc = self._parse_nav(nav["path"])
+            else:
+                self._toc = []
+        return self._toc
+
+    def _find_item(self, predicate) -> Optional[Dict]:
+        """Return the spine's NCX or the first manifest item matching predicate."""
+        if self.ncx_id in self.items and predicate(self.items[self.ncx_id]):
+            return self.items[self.ncx_id]
+        return next((item for item in self.items.values() if predicate(item)), None)
+
+    def _entry(self, base: str, title: str, href: str, level: int) -> Dict:
+        """Build a TOC entry with an href relative to the package document."""
+        if href:
+            fragment = href.split("#", 1)[1] if "#" in href else ""
+            href = self.href(self._resolve(base, href))
+            if fragment:
+                href = f"{href}#{fragment}"
+        return {"title": title, "href": href, "level": level, "children": []}
+
+    def _parse_ncx(self, path: str) -> List[Dict]:
+        """Read the nav map of an NCX file."""
+
+        def nav_points(element, level: int) -> List[Dict]:
+            entries = []
+            for point in _children(element, "navPoint"):
+                labels = _children(point, "navLabel")
+                title = _text_content(labels[0]) if labels else ""
+                contents = _children(point, "content")
+                href = contents[0].get("src", "") if contents else ""
+                entry = self._entry(path, title, href, level)
+                entry["children"] = nav_points(point, level + 1)
+                entries.append(entry)
+            return entries
+
+        try:
+            root = self._parse_xml(path)
+        except (KeyError, ElementTree.ParseError):
+            return []
+        nav_maps = _children(root, "navMap")
+        return nav_points(nav_maps[0], 0) if nav_maps else []
+
+    def _parse_nav(self, path: str) -> List[Dict]:
+        """Read the table of contents of an EPUB 3 navigation document."""
+
+        def list_items(element, level: int) -> List[Dict]:
+            entries = []
+            for item in _children(element, "li"):
+                label = next(
+                    (
+                        child
+                        for child in item
+                        if _local_name(child.tag) in ("a", "span")
+                    ),
+                    None,
+                )
+                if label is None:
+                    continue
+                entry = self._entry(
+                    path, _text_content(label), label.get("href", ""), level
+                )
+                for sublist in _children(item, "ol"):
+                    entry["children"].extend(list_items(sublist, level + 1))
+                entries.append(entry)
+            return entries
+
+        try:
+            root = self._parse_xml(path)
+        except (KeyError, ElementTree.ParseError):
+            return []
+
+        for nav in root.iter():
+            if _local_name(nav.tag) != "nav":
+                continue
+            types = " ".join(
+                value for name, value in nav.items() if _local_name(name) == "type"
+            )
+            if "toc" in types.split():
+                lists = _children(nav, "ol")
+                return list_items(lists[0], 0) if lists else []
+        return []
+
+    def read_text(self, path: str) -> str:
+        """
+        Convert one document of the archive to plain text.
+
+        The document is decoded and fed to the HTML parser in chunks, so it
+        is never held in memory as a whole next to its text.
+
+        Args:
+            path: Path of the document inside the archive.
+
+        Returns:
+            The readable text with one paragraph per line.
+        """
+        extractor = _TextExtractor()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with self.archive.open(path) as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                extractor.feed(decoder.decode(chunk))
+        extractor.feed(decoder.decode(b"", final=True))
+        extractor.close()
+        return extractor.text()
+
+    def chapter_text(self, href: str) -> str:
+        """
+        Convert the document of one chapter to text.
+
+        Args:
+            href: The chapter's 'href', as yielded by iter_chapters.
+
+        Returns:
+            The readable text with one paragraph per line.
+
+        Raises:
+            KeyError: If the document isn't in the archive.
+        """
+        base = posixpath.dirname(self.opf_path)
+        return self.read_text(posixpath.normpath(posixpath.join(base, href)))
+
+    def iter_chapters(self) -> Iterator[Dict[str, Union[str, int]]]:
+        """
+        Yield the text of each chapter in reading order, one at a time.
+
+        Chapters follow the spine of the book. Titles and nesting levels are
+        taken from the first TOC entry that links to the chapter document,
+        falling back to the document name at the top level. The navigation
+        document and documents without readable text are skipped.
+
+        Returns:
+            An iterator over dictionaries with the 'title', 'href', 'text' and
+            'level' of each chapter.
+        """
+        entries = {}
+        stack = list(reversed(self.toc()))
+        while stack:
+            entry = stack.pop()
+            href = entry["href"].split("#", 1)[0]
+            if href and href not in entries:
+                entries[href] = entry
+            stack.extend(reversed(entry["children"]))
+
+        for idref in self.spine:
+            item = self.items[idref]
+            if (
+                item["media_type"] not in XHTML_MEDIA_TYPES
+                or "nav" in item["properties"]
+            ):
+                continue
+
+            try:
+                text = self.read_text(item["path"])
+            except KeyError:
+                # The manifest lists a document that isn't in the archive
+                continue
+            if not text:
+                continue
+
+            href = self.href(item["path"])
+            entry = entries.get(href)
+            yield {
+                "title": (
+                    entry["title"]
+                    if entry
+                    else posixpath.splitext(posixpath.basename(href))[0]
+                ),
+                "href": href,
+                "text": text,
+                "level": entry["level"] if entry else 0,
+            }
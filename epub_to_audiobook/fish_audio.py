@@ -4,26 +4,141 @@ Fish Audio Text-to-Speech module.
 This module provides functions to convert text to speech using Fish Audio's API.
 """
 
+import asyncio
+import io
 import os
-from typing import BinaryIO
+import random
+import sys
+import time
+import wave
+from collections import deque
+from typing import BinaryIO, Iterable, Iterator, Optional, Tuple
 
-from dotenv import load_dotenv, find_dotenv
+import numpy as np
 
-# Attempt to load environment variables from .env file
-load_dotenv(find_dotenv())
+from epub_to_audiobook.cache import SynthesisCache
+from epub_to_audiobook.progress import Progress
+from epub_to_audiobook.segmenter import engine_segments, split_sentences
+
+# Sample rate requested for raw PCM audio, so segments can be joined and wrapped
+PCM_SAMPLE_RATE = 44100
+
+# HTTP status codes of failures that are worth retrying
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Delay before the first retry in seconds, doubled on every further attempt
+BACKOFF_BASE = 1.0
+
+# Longest delay between two attempts in seconds
+BACKOFF_MAX = 30.0
+
+
+def audio_duration(size: int, audio_format: str, bitrate: int = 128) -> float:
+    """
+    Estimate the duration of audio returned by the API from its size.
+
+    Raw PCM and WAV audio are assumed to be 16-bit mono at PCM_SAMPLE_RATE,
+    and MP3 audio to be encoded at a constant bitrate.
+
+    Args:
+        size: Size of the audio in bytes.
+        audio_format: Format of the audio ("mp3", "wav", or "pcm").
+        bitrate: MP3 bitrate in kbit/s.
+
+    Returns:
+        The estimated duration in seconds.
+    """
+    if audio_format == "mp3":
+        return size * 8 / (bitrate * 1000)
+    if audio_format == "wav":
+        size = max(0, size - 44)
+    return size / 2 / PCM_SAMPLE_RATE
+
+
+def stream_sentences(text: str) -> Iterator[str]:
+    """
+    Feed text to a streaming session one sentence at a time.
+
+    The server concatenates the text it receives, so every piece ends with
+    whitespace to keep words from running together.
+
+    Args:
+        text: The text to split.
+
+    Returns:
+        An iterator over the sentences of the text.
+    """
+    for sentence in split_sentences(text):
+        yield sentence + " "
+
+
+class _RateLimiter:
+    """Space out requests so that no more than a given number start per second."""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Wait until the next request is allowed to start."""
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 
 class FishAudioTTS:
     """A class to handle text-to-speech conversion using Fish Audio's API."""
 
-    def __init__(self, api_key: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        cache: Optional[SynthesisCache] = None,
+        concurrency: int = 4,
+        requests_per_second: Optional[float] = None,
+        max_retries: int = 5,
+        base_url: Optional[str] = None,
+    ):
         """
         Initialize the FishAudioTTS class.
 
         Args:
             api_key: The Fish Audio API key. If not provided, it will be loaded from the
                      FISH_AUDIO_API_KEY environment variable.
+            cache: Optional cache of synthesized audio. When given, requests that
+                   were made before with the same parameters are answered from
+                   the cache instead of the API.
+            concurrency: Maximum number of requests in flight at once in
+                         text_to_speech_async, shared by all concurrent calls.
+            requests_per_second: Optional limit on how many requests start per
+                                 second in text_to_speech_async.
+            max_retries: Number of times text_to_speech_async retries a request
+                         that failed with a transient error.
+            base_url: Optional URL of the API, for example a local server that
+                      stands in for it. Defaults to the Fish Audio API.
         """
+        self.cache = cache
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+
+        # Connection pool state shared by concurrent text_to_speech_async calls
+        self._active_calls = 0
+        self._semaphore = None
+        self._rate_limiter = None
+
+        # WebSocket session of text_to_speech_stream, created on first use
+        self.base_url = base_url
+        self._websocket_session = None
+
+        if not api_key:
+            # Attempt to load environment variables from .env file
+            from dotenv import find_dotenv, load_dotenv
+
+            load_dotenv(find_dotenv())
         self.api_key = api_key or os.getenv("FISH_AUDIO_API_KEY")
         if not self.api_key:
             raise ValueError(
@@ -35,7 +150,10 @@ class FishAudioTTS:
         try:
             from fish_audio_sdk import Session
 
-            self.session = Session(self.api_key)
+            if base_url:
+                self.session = Session(self.api_key, base_url=base_url)
+            else:
+                self.session = Session(self.api_key)
         except ImportError:
             raise ImportError(
                 "The fish_audio_sdk package is required. "
@@ -52,6 +170,7 @@ class FishAudioTTS:
         chunk_length: int = 200,
         normalize: bool = True,
         latency: str = "normal",
+        progress: Optional[Progress] = None,
     ) -> None:
         """
         Convert text to speech and write the audio to the specified file.
@@ -65,10 +184,117 @@ class FishAudioTTS:
             chunk_length: Length of each chunk in milliseconds (100-300).
             normalize: Whether to normalize the text (recommended for better stability).
             latency: Latency mode ("normal" or "balanced").
+            progress: Optional Progress the text is reported to as one
+                      segment, with the time of the request.
         """
         from fish_audio_sdk import TTSRequest
 
-        # Validate parameters
+        self._validate_options(audio_format, bitrate, chunk_length, latency)
+
+        # Create the TTS request
+        request = TTSRequest(
+            text=text,
+            reference_id=reference_id,
+            format=audio_format,
+            mp3_bitrate=bitrate,
+            chunk_length=chunk_length,
+            normalize=normalize,
+            latency=latency,
+        )
+
+        if progress is None:
+            progress = Progress()
+        start = time.perf_counter()
+
+        key = None
+        if self.cache is not None:
+            key = SynthesisCache.make_key(
+                text,
+                "fish",
+                reference_id=reference_id,
+                format=audio_format,
+                mp3_bitrate=bitrate,
+                chunk_length=chunk_length,
+                normalize=normalize,
+                latency=latency,
+            )
+            cached = self.cache.get(key)
+            if cached is not None:
+                output_file.write(cached)
+                progress.segment(
+                    characters=len(text),
+                    audio_seconds=audio_duration(len(cached), audio_format, bitrate),
+                    stages={"write": time.perf_counter() - start},
+                )
+                return
+
+        # Process the request and write the audio to the output file
+        chunks = []
+        size = 0
+        for chunk in self.session.tts(request):
+            output_file.write(chunk)
+            size += len(chunk)
+            if key is not None:
+                chunks.append(chunk)
+
+        if key is not None:
+            self.cache.put(key, b"".join(chunks))
+
+        # Audio is written as it streams in, so writing counts as request time
+        progress.segment(
+            characters=len(text),
+            audio_seconds=audio_duration(size, audio_format, bitrate),
+            stages={"request": time.perf_counter() - start},
+        )
+
+    def synthesize_segments(
+        self,
+        segments: Iterable[str],
+        reference_id: str = "b545c585f631496c914815291da4e893",
+        chunk_length: int = 200,
+        normalize: bool = True,
+        latency: str = "normal",
+        progress: Optional[Progress] = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Synthesize segments of text that are already split, one at a time.
+
+        Each segment is requested as raw PCM when the caller asks for it, so
+        the caller can decide what to synthesize next.
+
+        Args:
+            segments: The segments of text to synthesize.
+            reference_id: ID of a voice model to use.
+            chunk_length: Length of each chunk in milliseconds (100-300).
+            normalize: Whether to normalize the text (recommended for better stability).
+            latency: Latency mode ("normal" or "balanced").
+            progress: Optional Progress every segment is reported to.
+
+        Yields:
+            Mono float32 audio arrays sampled at PCM_SAMPLE_RATE, one per
+            segment and in the same order.
+        """
+        for segment in segments:
+            output = io.BytesIO()
+            self.text_to_speech(
+                segment,
+                output,
+                reference_id=reference_id,
+                audio_format="pcm",
+                chunk_length=chunk_length,
+                normalize=normalize,
+                latency=latency,
+                progress=progress,
+            )
+            data = output.getvalue()
+            pcm = np.frombuffer(data[: len(data) // 2 * 2], dtype="<i2")
+            yield pcm.astype(np.float32) / 32768
+
+    @staticmethod
+    def _validate_options(
+        audio_format: str, bitrate: int, chunk_length: int, latency: str
+    ) -> None:
+        """Check the request parameters before anything is sent to the API."""
         if audio_format not in ["mp3", "wav", "pcm"]:
             raise ValueError("Audio format must be one of 'mp3', 'wav', or 'pcm'")
 
@@ -81,25 +307,311 @@ class FishAudioTTS:
         if latency not in ["normal", "balanced"]:
             raise ValueError("Latency must be one of 'normal' or 'balanced'")
 
-        # Create the TTS request
+    async def _open(self) -> None:
+        """Open the shared connection pool for a text_to_speech_async call."""
+        if self._active_calls == 0:
+            await self.session.__aenter__()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            if self.requests_per_second:
+                self._rate_limiter = _RateLimiter(self.requests_per_second)
+        self._active_calls += 1
+
+    async def _close(self) -> None:
+        """Close the connection pool once the last call is finished with it."""
+        self._active_calls -= 1
+        if self._active_calls == 0:
+            self._semaphore = None
+            self._rate_limiter = None
+            await self.session.__aexit__(None, None, None)
+
+    async def _request(self, request) -> Tuple[bytes, float]:
+        """
+        Send one request, retrying transient failures with exponential backoff.
+
+        Rate-limited (429), server-side (5xx) and connection errors are
+        retried up to max_retries times. Other errors are raised right away.
+
+        Returns:
+            The audio, and the seconds spent on attempts, not counting the
+            time spent waiting for a free slot or backing off.
+        """
+        import httpx
+        from fish_audio_sdk import HttpCodeErr
+
+        attempt = 0
+        seconds = 0.0
+        while True:
+            async with self._semaphore:
+                if self._rate_limiter is not None:
+                    await self._rate_limiter.wait()
+                start = time.perf_counter()
+                try:
+                    chunks = [
+                        chunk async for chunk in self.session.tts.awaitable(request)
+                    ]
+                    return b"".join(chunks), seconds + time.perf_counter() - start
+                except HttpCodeErr as e:
+                    if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        raise
+                    error = e
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    error = e
+                seconds += time.perf_counter() - start
+
+            # Back off outside the semaphore so other requests can go ahead
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+            delay *= random.uniform(0.5, 1.0)
+            attempt += 1
+            print(
+                f"Fish Audio request failed ({error}), retrying in {delay:.1f}s "
+                f"({attempt}/{self.max_retries})",
+                file=sys.stderr,
+            )
+            await asyncio.sleep(delay)
+
+    async def _synthesize_segment(
+        self, request, key: Optional[str]
+    ) -> Tuple[bytes, float]:
+        """
+        Synthesize one segment, going through the cache when there is one.
+
+        Returns the audio and the seconds spent on requests for it.
+        """
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, 0.0
+
+        audio, seconds = await self._request(request)
+        if key is not None:
+            self.cache.put(key, audio)
+        return audio, seconds
+
+    async def text_to_speech_async(
+        self,
+        text: str,
+        output_file: BinaryIO,
+        reference_id: str = "b545c585f631496c914815291da4e893",
+        audio_format: str = "wav",
+        bitrate: int = 128,
+        chunk_length: int = 200,
+        normalize: bool = True,
+        latency: str = "normal",
+        segment_length: Optional[int] = None,
+        progress: Optional[Progress] = None,
+    ) -> None:
+        """
+        Convert text to speech concurrently and write the audio to the file.
+
+        The text is split into request-sized segments, which are sent
+        concurrently over one connection pool, with at most `concurrency`
+        requests in flight (across all concurrent calls on this instance) and
+        at most `requests_per_second` starting per second. At most twice
+        `concurrency` segments are started ahead of the audio being written,
+        which bounds the audio held in memory. Transient failures
+        are retried with exponential backoff, and the audio is written in the
+        order of the text as soon as the segments before it are done.
+
+        WAV output is requested as raw PCM and wrapped in a single WAV header,
+        since WAV files can't simply be joined.
+
+        Args:
+            text: The text to convert to speech.
+            output_file: A file-like object (opened in binary write mode) to write the audio to.
+            reference_id: ID of a voice model to use.
+            audio_format: Output audio format ("mp3", "wav", or "pcm").
+            bitrate: MP3 bitrate (64, 128, or 192).
+            chunk_length: Length of each chunk in milliseconds (100-300).
+            normalize: Whether to normalize the text (recommended for better stability).
+            latency: Latency mode ("normal" or "balanced").
+            segment_length: Target length in characters of the text of each
+                            request. Defaults to SEGMENT_LENGTHS["fish"].
+            progress: Optional Progress that every segment is reported to as
+                      it is written, with the time of its requests.
+
+        Raises:
+            ValueError: If a parameter is invalid or there is no text.
+            fish_audio_sdk.HttpCodeErr: If a request fails for good.
+        """
+        from fish_audio_sdk import TTSRequest
+
+        self._validate_options(audio_format, bitrate, chunk_length, latency)
+
+        segments = engine_segments(text, "fish", segment_length)
+        if not segments:
+            raise ValueError("No text to convert")
+
+        request_format = "mp3" if audio_format == "mp3" else "pcm"
+        sample_rate = PCM_SAMPLE_RATE if request_format == "pcm" else None
+        requests = []
+        for segment in segments:
+            request = TTSRequest(
+                text=segment,
+                reference_id=reference_id,
+                format=request_format,
+                sample_rate=sample_rate,
+                mp3_bitrate=bitrate,
+                chunk_length=chunk_length,
+                normalize=normalize,
+                latency=latency,
+            )
+            key = None
+            if self.cache is not None:
+                key = SynthesisCache.make_key(
+                    segment,
+                    "fish",
+                    reference_id=reference_id,
+                    format=request_format,
+                    sample_rate=sample_rate,
+                    mp3_bitrate=bitrate,
+                    chunk_length=chunk_length,
+                    normalize=normalize,
+                    latency=latency,
+                )
+            requests.append((request, key))
+
+        wav_file = None
+        if audio_format == "wav":
+            wav_file = wave.open(output_file, "wb")
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(PCM_SAMPLE_RATE)
+
+        await self._open()
+        if progress is None:
+            progress = Progress()
+
+        # Only a window of segments ahead of the one being written is started,
+        # so the audio finished behind a slow segment can't pile up unbounded
+        window = max(self.concurrency, 1) * 2
+        pending = iter(zip(segments, requests))
+        tasks = deque()
+
+        def start_tasks() -> None:
+            while len(tasks) < window:
+                entry = next(pending, None)
+                if entry is None:
+                    return
+                segment, (request, key) = entry
+                task = asyncio.ensure_future(self._synthesize_segment(request, key))
+                tasks.append((segment, task))
+
+        try:
+            start_tasks()
+            while tasks:
+                segment, task = tasks[0]
+                audio, seconds = await task
+                tasks.popleft()
+                start_tasks()
+                start = time.perf_counter()
+                if wav_file is not None:
+                    wav_file.writeframesraw(audio)
+                else:
+                    output_file.write(audio)
+                progress.segment(
+                    characters=len(segment),
+                    audio_seconds=audio_duration(len(audio), request_format, bitrate),
+                    stages={"request": seconds, "write": time.perf_counter() - start},
+                )
+        finally:
+            for _, task in tasks:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+            await self._close()
+            if wav_file is not None:
+                wav_file.close()
+
+    def text_to_speech_stream(
+        self,
+        text_stream: Iterable[str],
+        output_file: BinaryIO,
+        reference_id: str = "b545c585f631496c914815291da4e893",
+        audio_format: str = "wav",
+        bitrate: int = 128,
+        chunk_length: int = 200,
+        normalize: bool = True,
+        latency: str = "normal",
+    ) -> None:
+        """
+        Convert streamed text to speech over a WebSocket connection.
+
+        The text is sent piece by piece over one connection while audio chunks
+        are written (and flushed) to the file as soon as they arrive, so the
+        first audio is on disk long before the whole text is synthesized.
+
+        WAV output is requested as raw PCM and wrapped in a WAV header whose
+        length is filled in once the stream ends.
+
+        Args:
+            text_stream: The text to convert, as an iterable of pieces that
+                         each end with whitespace (see stream_sentences), or a
+                         plain string, which is split into sentences.
+            output_file: A file-like object (opened in binary write mode) to write the audio to.
+            reference_id: ID of a voice model to use.
+            audio_format: Output audio format ("mp3", "wav", or "pcm").
+            bitrate: MP3 bitrate (64, 128, or 192).
+            chunk_length: Length of each chunk in milliseconds (100-300).
+            normalize: Whether to normalize the text (recommended for better stability).
+            latency: Latency mode ("normal" or "balanced").
+
+        Raises:
+            fish_audio_sdk.exceptions.WebSocketErr: If the server ends the
+                                                    stream with an error.
+        """
+        from fish_audio_sdk import TTSRequest, WebSocketSession
+
+        self._validate_options(audio_format, bitrate, chunk_length, latency)
+
+        if isinstance(text_stream, str):
+            text_stream = stream_sentences(text_stream)
+
+        if self._websocket_session is None:
+            # One sender thread per concurrent stream
+            options = {"max_workers": max(self.concurrency, 1)}
+            if self.base_url:
+                options["base_url"] = self.base_url
+            self._websocket_session = WebSocketSession(self.api_key, **options)
+
+        request_format = "mp3" if audio_format == "mp3" else "pcm"
         request = TTSRequest(
-            text=text,
+            text="",
             reference_id=reference_id,
-            format=audio_format,
+            format=request_format,
+            sample_rate=PCM_SAMPLE_RATE if request_format == "pcm" else None,
             mp3_bitrate=bitrate,
             chunk_length=chunk_length,
             normalize=normalize,
             latency=latency,
         )
 
-        # Process the request and write the audio to the output file
-        for chunk in self.session.tts(request):
-            output_file.write(chunk)
+        wav_file = None
+        if audio_format == "wav":
+            wav_file = wave.open(output_file, "wb")
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(PCM_SAMPLE_RATE)
+
+        try:
+            for chunk in self._websocket_session.tts(request, text_stream):
+                if wav_file is not None:
+                    wav_file.writeframesraw(chunk)
+                else:
+                    output_file.write(chunk)
+                output_file.flush()
+        finally:
+            if wav_file is not None:
+                wav_file.close()
 
     def apply_phoneme_control(self, text: str, phonemes: dict) -> str:
         """
         Apply phoneme control to specific words in the text.
 
+        Only whole words are replaced, in a single pass over the text. To
+        apply the same dictionary to many texts, compile it once with
+        lexicon.Lexicon instead.
+
         Args:
             text: The original text.
             phonemes: A dictionary mapping words to their phonetic representation.
@@ -107,7 +619,6 @@ class FishAudioTTS:
         Returns:
             The text with phoneme control tags applied.
         """
-        for word, phoneme in phonemes.items():
-            replacement = f"<|phoneme_start|>{phoneme}<|phoneme_end|>"
-            text = text.replace(word, replacement)
-        return text
+        from epub_to_audiobook.lexicon import Lexicon
+
+        return Lexicon(phonemes).apply(text, "fish")
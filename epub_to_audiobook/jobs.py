@@ -0,0 +1,453 @@
+"""
+Resumable job module.
+
+This module keeps the state of long-running conversions in a job directory:
+the settings of the job and a checkpoint journal recording which segments
+or chapters are finished, so that an interrupted run can be resumed without
+synthesizing the finished parts again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from epub_to_audiobook.progress import Progress
+from epub_to_audiobook.segmenter import engine_segments
+
+# Name of the file holding the settings of a job
+JOB_FILE = "job.json"
+
+# Name of the checkpoint journal of a job
+JOURNAL_FILE = "journal.jsonl"
+
+# Name of the copy of the input text kept in a text job directory
+INPUT_FILE = "input.txt"
+
+# Number of frames copied at a time when assembling segments
+_BLOCK_FRAMES = 65536
+
+
+def file_checksum(path: Path) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_checksum(text: str) -> str:
+    """
+    Compute the SHA-256 checksum of a text.
+
+    Args:
+        text: The text to hash.
+
+    Returns:
+        The hex digest of the UTF-8 encoded text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Journal:
+    """An append-only journal of the finished parts of a job."""
+
+    def __init__(self, path: Path):
+        """
+        Initialize the Journal class.
+
+        Args:
+            path: Path to the journal file. It is created on the first record.
+        """
+        self.path = Path(path)
+        self.entries = {}
+
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    self.entries[entry["name"]] = entry
+
+    def is_complete(self, name: str, path: Path, text: str) -> bool:
+        """
+        Check whether a part of the job is finished and still valid.
+
+        Args:
+            name: Name of the part, such as a segment or chapter file name.
+            path: Path to the audio file of the part.
+            text: The text the part was synthesized from.
+
+        Returns:
+            True if the part was recorded for the same text and its audio file
+            still matches the recorded checksum.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry["text_sha256"] != text_checksum(text):
+            return False
+
+        try:
+            return file_checksum(path) == entry["sha256"]
+        except FileNotFoundError:
+            return False
+
+    def record(self, name: str, path: Path, text: str) -> None:
+        """
+        Record a finished part of the job.
+
+        Args:
+            name: Name of the part, such as a segment or chapter file name.
+            path: Path to the finished audio file of the part.
+            text: The text the part was synthesized from.
+        """
+        entry = {
+            "name": name,
+            "sha256": file_checksum(path),
+            "text_sha256": text_checksum(text),
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[name] = entry
+
+
+def save_job(directory: Path, command: str, arguments: Dict) -> None:
+    """
+    Save the settings of a job so that it can be resumed later.
+
+    Args:
+        directory: The job directory.
+        command: The kind of job, "text" or "book".
+        arguments: The keyword arguments the job is run with.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / JOB_FILE, "w", encoding="utf-8") as f:
+        json.dump({"command": command, "arguments": arguments}, f, indent=2)
+
+
+def load_job(directory: Path) -> Dict:
+    """
+    Load the settings of a job.
+
+    Args:
+        directory: The job directory.
+
+    Returns:
+        A dictionary with the 'command' and 'arguments' of the job.
+
+    Raises:
+        FileNotFoundError: If the directory is not a job directory.
+    """
+    job_file = directory / JOB_FILE
+    if not job_file.exists():
+        raise FileNotFoundError(f"Not a job directory: {directory}")
+
+    with open(job_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def split_segments(
+    text: str,
+    engine: str,
+    split_pattern: Optional[str] = None,
+    segment_length: Optional[int] = None,
+) -> List[str]:
+    """
+    Split text into the segments that are checkpointed one by one.
+
+    Sentences are packed into segments of about the engine's target length
+    (see segmenter.engine_segments), or the text is split on the split
+    pattern when one is given.
+
+    Args:
+        text: The text to split.
+        engine: TTS engine the segments are for ("kokoro" or "fish").
+        split_pattern: Optional regex pattern to split text into chunks.
+        segment_length: Target segment length in characters.
+
+    Returns:
+        The non-empty segments of the text in order.
+    """
+    return engine_segments(text, engine, segment_length, split_pattern)
+
+
+def concatenate_audio(
+    paths: List[Path],
+    output_file: BinaryIO,
+    audio_format: str,
+    segment_format: str,
+) -> None:
+    """
+    Concatenate segment audio files into one output file.
+
+    MP3 and raw PCM segments that are already in the output format are
+    copied byte for byte. Other segments are decoded and re-encoded block by
+    block, so memory use doesn't grow with the length of the output.
+
+    Args:
+        paths: The segment audio files in order.
+        output_file: A file-like object (opened in binary write mode) to write
+                     the audio to.
+        audio_format: Output audio format ("pcm" or one of the encoder formats).
+        segment_format: Audio format of the segment files.
+    """
+    if audio_format == segment_format and audio_format in ["mp3", "pcm"]:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, output_file)
+        return
+
+    import soundfile as sf
+
+    from epub_to_audiobook.encoders import open_encoder
+
+    samplerate = sf.info(str(paths[0])).samplerate
+    with open_encoder(output_file, audio_format, samplerate) as encoder:
+        for path in paths:
+            for block in sf.blocks(str(path), blocksize=_BLOCK_FRAMES, dtype="float32"):
+                encoder.write(block)
+
+
+def create_kokoro(lang_code: str, cache=None, onnx_options: Optional[Dict] = None):
+    """
+    Load Kokoro with the PyTorch or the ONNX Runtime backend.
+
+    Args:
+        lang_code: Language code for Kokoro TTS.
+        cache: Optional synthesis cache passed to the engine.
+        onnx_options: Keyword arguments of kokoro_onnx.KokoroOnnxTTS, to run
+                      inference on ONNX Runtime, or None to use PyTorch.
+
+    Returns:
+        The KokoroTTS engine.
+    """
+    if onnx_options is not None:
+        from epub_to_audiobook.kokoro_onnx import KokoroOnnxTTS
+
+        return KokoroOnnxTTS(lang_code=lang_code, cache=cache, **onnx_options)
+
+    from epub_to_audiobook.kokoro_tts import KokoroTTS
+
+    return KokoroTTS(lang_code=lang_code, cache=cache)
+
+
+def _create_engine(
+    engine: str,
+    lang_code: str,
+    cache,
+    use_daemon: bool = False,
+    onnx_options: Optional[Dict] = None,
+):
+    """Create the TTS engine a job runs with."""
+    if engine == "fish":
+        from epub_to_audiobook.fish_audio import FishAudioTTS
+
+        return FishAudioTTS(cache=cache)
+
+    # The daemon runs the PyTorch backend
+    if use_daemon and onnx_options is None:
+        from epub_to_audiobook.daemon import connect_daemon
+
+        tts = connect_daemon(lang_code=lang_code, cache=cache)
+        if tts is not None:
+            return tts
+
+    return create_kokoro(lang_code, cache, onnx_options)
+
+
+def run_text_job(
+    directory: Path,
+    output: str,
+    engine: str = "kokoro",
+    audio_format: str = "wav",
+    lang_code: str = "a",
+    engine_options: Optional[Dict] = None,
+    cache=None,
+    use_daemon: bool = True,
+    progress: Optional[Progress] = None,
+    onnx_options: Optional[Dict] = None,
+) -> Path:
+    """
+    Convert the text of a job directory to speech, segment by segment.
+
+    Each finished segment is written to the 'segments' folder of the job and
+    recorded in the journal. Segments that are already recorded are skipped,
+    so running the job again after a crash only synthesizes what is missing.
+    The segments are then assembled into the output file.
+
+    Args:
+        directory: The job directory, holding the input text.
+        output: Path to save the output audio file.
+        engine: TTS engine to use ("kokoro" or "fish").
+        audio_format: Output audio format ("pcm" or one of the encoder formats).
+        lang_code: Language code for Kokoro TTS.
+        engine_options: Extra keyword arguments passed to the engine's
+                        text_to_speech method.
+        cache: Optional synthesis cache passed to the engine.
+        use_daemon: Whether to run Kokoro in the daemon when one is running.
+        progress: Optional Progress that every synthesized segment and the
+                  assembly are reported to, and that is finished with the
+                  totals of the run at the end.
+        onnx_options: Optional settings of the ONNX Runtime backend of
+                      Kokoro (see create_kokoro).
+
+    Returns:
+        The path of the output audio file.
+    """
+    if progress is None:
+        progress = Progress()
+
+    engine_options = dict(engine_options or {})
+    with open(directory / INPUT_FILE, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    segments = split_segments(
+        text,
+        engine,
+        engine_options.get("split_pattern"),
+        engine_options.get("segment_length"),
+    )
+    if not segments:
+        raise ValueError("No text to convert")
+
+    if engine == "fish":
+        # Each segment is already sized for one request
+        engine_options.pop("segment_length", None)
+
+    # Kokoro segments are kept lossless and only encoded on assembly
+    segment_format = audio_format if engine == "fish" else "wav"
+    segments_dir = directory / "segments"
+    segments_dir.mkdir(exist_ok=True)
+
+    journal = Journal(directory / JOURNAL_FILE)
+    names = [f"{index:05d}.{segment_format}" for index in range(1, len(segments) + 1)]
+    paths = [segments_dir / name for name in names]
+    pending = [
+        (name, path, segment)
+        for name, path, segment in zip(names, paths, segments)
+        if not journal.is_complete(name, path, segment)
+    ]
+    progress.start(sum(len(segment) for _, _, segment in pending))
+
+    # Segment files are joined as they are, so each one ends with the gap
+    # between segments, and only the last one with the chapter gap
+    postprocess = engine_options.pop("postprocess", None)
+    if postprocess:
+        from epub_to_audiobook.postprocess import DEFAULT_GAP
+
+        between = postprocess.get("gap")
+        if between is None:
+            between = DEFAULT_GAP if postprocess.get("trim_silence") else 0.0
+
+    # Only load the engine once there is something left to synthesize
+    if pending:
+        tts = _create_engine(engine, lang_code, cache, use_daemon, onnx_options)
+    if pending and engine == "fish":
+        for name, path, segment in pending:
+            temp_path = path.with_suffix(".part")
+            with open(temp_path, "wb") as output_file:
+                tts.text_to_speech(
+                    text=segment,
+                    output_file=output_file,
+                    audio_format=segment_format,
+                    progress=progress,
+                    **engine_options,
+                )
+            os.replace(temp_path, path)
+            journal.record(name, path, segment)
+    elif pending:
+        import numpy as np
+
+        from epub_to_audiobook.encoders import open_encoder
+        from epub_to_audiobook.kokoro_tts import SAMPLE_RATE
+
+        # All the segments go through one pipeline, so that they overlap, and
+        # one processor, so that the running loudness carries over. The
+        # gaps are added to the segment files here instead.
+        options = {
+            key: value
+            for key, value in engine_options.items()
+            if key not in ["split_pattern", "segment_length"]
+        }
+        if postprocess:
+            options["postprocess"] = dict(postprocess, gap=0.0, chapter_gap=0.0)
+        audios = tts.synthesize_segments(
+            (segment for _, _, segment in pending), progress=progress, **options
+        )
+        for audio, (name, path, segment) in zip(audios, pending):
+            if not len(audio):
+                raise ValueError(f"No audio was generated for segment {name}")
+            if postprocess:
+                silence = (
+                    postprocess.get("chapter_gap", 0.0)
+                    if path == paths[-1]
+                    else between
+                )
+                audio = np.concatenate(
+                    [audio, np.zeros(int(SAMPLE_RATE * silence), dtype=np.float32)]
+                )
+
+            temp_path = path.with_suffix(".part")
+            with open(temp_path, "wb") as output_file:
+                with open_encoder(output_file, segment_format, SAMPLE_RATE) as encoder:
+                    encoder.write(audio)
+            os.replace(temp_path, path)
+            journal.record(name, path, segment)
+
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with progress.stage("assemble"), open(output_path, "wb") as output_file:
+        concatenate_audio(paths, output_file, audio_format, segment_format)
+
+    progress.finish()
+    return output_path
+
+
+def resume_job(
+    directory: Path,
+    cache=None,
+    use_daemon: bool = True,
+    progress: Optional[Progress] = None,
+) -> Dict:
+    """
+    Resume an interrupted job from its job directory.
+
+    Args:
+        directory: The job directory.
+        cache: Optional synthesis cache passed to the engine.
+        use_daemon: Whether to run Kokoro text jobs in the daemon when one is
+                    running.
+        progress: Optional Progress the resumed run is reported to.
+
+    Returns:
+        The settings of the resumed job.
+    """
+    job = load_job(directory)
+    if job["command"] == "book":
+        from epub_to_audiobook.book import synthesize_book
+
+        synthesize_book(**job["arguments"], progress=progress)
+    else:
+        run_text_job(
+            directory,
+            cache=cache,
+            use_daemon=use_daemon,
+            progress=progress,
+            **job["arguments"],
+        )
+    return job
@@ -0,0 +1,233 @@
+"""
+Batched Kokoro inference module.
+
+This module runs the Kokoro model on several phonemized segments at once.
+Segments are padded to the length of the longest segment in the batch and
+the audio of each segment is trimmed back to its own length afterwards.
+"""
+
+from typing import List
+
+import numpy as np
+
+# Number of audio samples produced per predicted duration frame at 24000 Hz
+SAMPLES_PER_FRAME = 600
+
+
+def phonemes_to_ids(model, phonemes: str) -> List[int]:
+    """
+    Map a phoneme string to the model's input ids.
+
+    Args:
+        model: The KModel instance.
+        phonemes: The phoneme string of one segment.
+
+    Returns:
+        The input ids, including the boundary tokens at both ends.
+    """
+    ids = [model.vocab[p] for p in phonemes if p in model.vocab]
+    return [0, *ids, 0]
+
+
+def _run_packed_lstm(lstm, x, lengths):
+    """Run an LSTM over a padded batch without letting padding leak in."""
+    from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+    packed = pack_padded_sequence(
+        x, lengths.cpu(), batch_first=True, enforce_sorted=False
+    )
+    lstm.flatten_parameters()
+    output, _ = lstm(packed)
+    output, _ = pad_packed_sequence(output, batch_first=True, total_length=x.shape[1])
+    return output
+
+
+def _padding_mask(x, fractions):
+    """
+    Build a (batch, 1, time) mask of the valid part of each item.
+
+    The valid part of each item is the same fraction of the time axis at
+    every resolution of the model, so it can be derived from the shape.
+    """
+    import torch
+
+    lengths = (fractions.to(x.device) * x.shape[-1]).round().clamp(min=1)
+    positions = torch.arange(x.shape[-1], device=x.device)
+    return (positions.unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(1).to(x.dtype)
+
+
+class _MaskedAdaIN:
+    """
+    Adaptive instance normalization that ignores the padding of each item.
+
+    Kokoro normalizes its feature maps per item over time, so padding a short
+    segment would otherwise shift its statistics. The output is zeroed past
+    the end of each item, so the convolutions that follow see the same zero
+    padding as they would for the item on its own.
+    """
+
+    def __init__(self, adain, fractions):
+        self.adain = adain
+        self.fractions = fractions
+
+    def __call__(self, x, s):
+        import torch
+
+        norm = self.adain.norm
+        mask = _padding_mask(x, self.fractions)
+        count = mask.sum(axis=-1, keepdim=True)
+
+        mean = (x * mask).sum(axis=-1, keepdim=True) / count
+        var = (((x - mean) * mask) ** 2).sum(axis=-1, keepdim=True) / count
+        x = (x - mean) / torch.sqrt(var + norm.eps)
+        if norm.affine:
+            x = x * norm.weight.view(1, -1, 1) + norm.bias.view(1, -1, 1)
+
+        h = self.adain.fc(s)
+        h = h.view(h.size(0), h.size(1), 1)
+        gamma, beta = torch.chunk(h, chunks=2, dim=1)
+        return ((1 + gamma) * x + beta) * mask
+
+
+class _MaskedOutput:
+    """Zero the output of a layer past the end of each item."""
+
+    def __init__(self, forward, fractions):
+        self.forward = forward
+        self.fractions = fractions
+
+    def __call__(self, x):
+        x = self.forward(x)
+        return x * _padding_mask(x, self.fractions)
+
+
+def _mask_padding(model, fractions) -> List:
+    """
+    Make the frame-level layers of the model ignore padding.
+
+    AdaIN layers get masked statistics, and the output of transposed
+    convolutions (whose bias would otherwise fill the padding) is zeroed past
+    the end of each item. Returns the patched layers.
+    """
+    import torch
+
+    patched = []
+    for module in model.modules():
+        if type(module).__name__ == "AdaIN1d":
+            module.forward = _MaskedAdaIN(module, fractions)
+            patched.append(module)
+        elif isinstance(module, torch.nn.ConvTranspose1d):
+            module.forward = _MaskedOutput(module.forward, fractions)
+            patched.append(module)
+    return patched
+
+
+def _unmask_padding(patched: List) -> None:
+    """Undo _mask_padding."""
+    for module in patched:
+        del module.forward
+
+
+def synthesize_batch(
+    model, phonemes: List[str], ref_s, speed: float = 1.0
+) -> List[np.ndarray]:
+    """
+    Synthesize several phonemized segments in one forward pass.
+
+    This mirrors KModel.forward_with_tokens with a batch dimension: token
+    sequences are padded and masked, recurrent layers are run on packed
+    sequences, and every segment gets its own duration alignment.
+
+    Args:
+        model: The KModel instance.
+        phonemes: The phoneme strings of the segments (at most 510 each).
+        ref_s: The style vectors of the segments, shaped (batch, 256).
+        speed: Speech speed multiplier (1.0 is normal speed).
+
+    Returns:
+        Mono float32 audio arrays, one per segment, in the input order.
+    """
+    import torch
+
+    device = model.device
+    batch = [phonemes_to_ids(model, ps) for ps in phonemes]
+    lengths = torch.tensor([len(ids) for ids in batch], dtype=torch.long)
+    max_length = int(lengths.max())
+
+    input_ids = torch.zeros((len(batch), max_length), dtype=torch.long)
+    for i, ids in enumerate(batch):
+        input_ids[i, : len(ids)] = torch.tensor(ids, dtype=torch.long)
+    input_ids = input_ids.to(device)
+    ref_s = ref_s.to(device)
+
+    with torch.no_grad():
+        # True for the padding positions of each sequence
+        text_mask = torch.arange(max_length).unsqueeze(0) >= lengths.unsqueeze(1)
+        text_mask = text_mask.to(device)
+
+        bert_dur = model.bert(input_ids, attention_mask=(~text_mask).int())
+        d_en = model.bert_encoder(bert_dur).transpose(-1, -2)
+        s = ref_s[:, 128:]
+        d = model.predictor.text_encoder(d_en, s, lengths, text_mask)
+        x = _run_packed_lstm(model.predictor.lstm, d, lengths)
+        duration = model.predictor.duration_proj(x)
+        duration = torch.sigmoid(duration).sum(axis=-1) / speed
+        pred_dur = torch.round(duration).clamp(min=1).long()
+        pred_dur = pred_dur.masked_fill(text_mask, 0)
+
+        # Build one alignment per segment, padded to the longest segment
+        frames = pred_dur.sum(axis=-1)
+        max_frames = int(frames.max())
+        alignment = torch.zeros((len(batch), max_length, max_frames), device=device)
+        for i in range(len(batch)):
+            indices = torch.repeat_interleave(
+                torch.arange(max_length, device=device), pred_dur[i]
+            )
+            alignment[i, indices, torch.arange(indices.shape[0], device=device)] = 1
+
+        en = d.transpose(-1, -2) @ alignment
+        shared = _run_packed_lstm(model.predictor.shared, en.transpose(-1, -2), frames)
+        t_en = model.text_encoder(input_ids, lengths, text_mask)
+        asr = t_en @ alignment
+
+        # Everything from here on works on frames, normalized per item
+        fractions = frames.float() / max_frames
+        patched = _mask_padding(model, fractions)
+        try:
+            F0 = shared.transpose(-1, -2)
+            for block in model.predictor.F0:
+                F0 = block(F0, s)
+            F0_pred = model.predictor.F0_proj(F0).squeeze(1)
+            N = shared.transpose(-1, -2)
+            for block in model.predictor.N:
+                N = block(N, s)
+            N_pred = model.predictor.N_proj(N).squeeze(1)
+            F0_pred = F0_pred * _padding_mask(F0_pred.unsqueeze(1), fractions)[:, 0]
+            N_pred = N_pred * _padding_mask(N_pred.unsqueeze(1), fractions)[:, 0]
+
+            audio = model.decoder(asr, F0_pred, N_pred, ref_s[:, :128])
+        finally:
+            _unmask_padding(patched)
+
+    audio = audio.reshape(len(batch), -1).cpu().numpy().astype(np.float32)
+    return [
+        audio[i, : int(frames[i]) * SAMPLES_PER_FRAME].copy() for i in range(len(batch))
+    ]
+
+
+def length_sorted_batches(lengths: List[int], batch_size: int) -> List[List[int]]:
+    """
+    Group segments of similar length into batches.
+
+    Sorting by length keeps the padding within each batch small, which keeps
+    both the wasted compute and the effect of padding on the output low.
+
+    Args:
+        lengths: The phoneme length of each segment.
+        batch_size: Maximum number of segments per batch.
+
+    Returns:
+        Batches of segment indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
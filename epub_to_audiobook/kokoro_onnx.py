@@ -0,0 +1,195 @@
+"""
+Kokoro ONNX Runtime module.
+
+This module runs Kokoro inference on ONNX Runtime instead of PyTorch, for
+machines without a GPU: an exported Kokoro graph, full precision or
+quantized to int8, replaces the PyTorch model, while text segmentation, G2P,
+voices, caching and encoding stay those of KokoroTTS.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from epub_to_audiobook.cache import SynthesisCache
+from epub_to_audiobook.kokoro_tts import KokoroTTS, _concatenate
+
+# Hugging Face repository of the Kokoro weights, voices and vocabulary
+KOKORO_REPO_ID = "hexgrad/Kokoro-82M"
+
+# Hugging Face repository of the exported Kokoro graphs
+ONNX_REPO_ID = "onnx-community/Kokoro-82M-v1.0-ONNX"
+
+# File of the full precision and of the int8-quantized graph in ONNX_REPO_ID
+ONNX_MODEL_FILES = {False: "onnx/model.onnx", True: "onnx/model_quantized.onnx"}
+
+# NumPy types of the ONNX tensor types the inputs of a graph can have
+_INPUT_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(double)": np.float64,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+}
+
+
+def download_model(quantized: bool = False) -> Path:
+    """
+    Download an exported Kokoro graph, or find it in the Hugging Face cache.
+
+    Args:
+        quantized: Whether to get the int8-quantized graph.
+
+    Returns:
+        The path of the graph.
+    """
+    from huggingface_hub import hf_hub_download
+
+    return Path(
+        hf_hub_download(repo_id=ONNX_REPO_ID, filename=ONNX_MODEL_FILES[quantized])
+    )
+
+
+def load_vocab() -> Dict[str, int]:
+    """Load the mapping of phonemes to token ids of the Kokoro model."""
+    from huggingface_hub import hf_hub_download
+
+    path = hf_hub_download(repo_id=KOKORO_REPO_ID, filename="config.json")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["vocab"]
+
+
+class KokoroOnnxTTS(KokoroTTS):
+    """A KokoroTTS that runs inference on ONNX Runtime."""
+
+    def __init__(
+        self,
+        lang_code: str = "a",
+        cache: Optional[SynthesisCache] = None,
+        model_path: Optional[Union[str, Path]] = None,
+        quantized: bool = False,
+        threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+    ):
+        """
+        Initialize the KokoroOnnxTTS class.
+
+        Args:
+            lang_code: Language code for the TTS model (see KokoroTTS).
+            cache: Optional cache of synthesized segments. Audio from the
+                   ONNX graph is cached apart from PyTorch audio.
+            model_path: Optional path of an exported Kokoro graph. Defaults
+                        to the graph of ONNX_REPO_ID, downloaded on first use.
+            quantized: Whether to use the int8-quantized graph when no
+                       model_path is given.
+            threads: Number of threads each operator runs on. Defaults to
+                     ONNX Runtime's choice, one per physical core.
+            inter_op_threads: Number of operators run in parallel. Defaults to
+                              1, since the graph is mostly sequential.
+
+        Raises:
+            ImportError: If onnxruntime or kokoro is not installed.
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError(
+                "The onnxruntime package is required for the ONNX backend. "
+                "Install it with: poetry install --extras onnx "
+                "(or pip install 'onnxruntime>=1.17,<2')"
+            )
+
+        super().__init__(lang_code=lang_code, cache=cache)
+
+        self.model_path = (
+            Path(model_path) if model_path is not None else download_model(quantized)
+        )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads or 0
+        options.inter_op_num_threads = inter_op_threads or 1
+        self.session = ort.InferenceSession(
+            str(self.model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = self._find_inputs()
+        self.vocab = load_vocab()
+        self._voices: Dict[str, np.ndarray] = {}
+
+        # Keep audio of different graphs and of PyTorch apart in the cache
+        self.cache_params = {
+            "backend": "onnx",
+            "model": f"{self.model_path.name}:{self.model_path.stat().st_size}",
+        }
+
+    def _create_pipeline(self, lang_code: str):
+        from kokoro import KPipeline
+
+        # G2P and voices only: the model is the ONNX graph
+        return KPipeline(lang_code=lang_code, model=False)
+
+    def _find_inputs(self) -> Dict[str, Tuple[str, type]]:
+        """
+        Find the token, style and speed inputs of the graph.
+
+        Exports name the inputs differently ('input_ids' or 'tokens'), so the
+        token input is the integer one, and the others are found by name.
+        """
+        inputs = {}
+        for graph_input in self.session.get_inputs():
+            dtype = _INPUT_TYPES.get(graph_input.type)
+            name = graph_input.name.lower()
+            if "style" in name:
+                inputs["style"] = (graph_input.name, dtype)
+            elif "speed" in name:
+                inputs["speed"] = (graph_input.name, dtype)
+            elif dtype in (np.int32, np.int64):
+                inputs["tokens"] = (graph_input.name, dtype)
+
+        missing = {"tokens", "style", "speed"} - set(inputs)
+        if missing:
+            raise ValueError(
+                f"Unsupported Kokoro graph {self.model_path}: no "
+                f"{', '.join(sorted(missing))} input"
+            )
+        return inputs
+
+    def _voice(self, voice: str) -> np.ndarray:
+        """Load the style vectors of a voice, indexed by phoneme length."""
+        if voice not in self._voices:
+            pack = self.pipeline.load_voice(voice)
+            self._voices[voice] = pack.numpy().astype(np.float32)
+        return self._voices[voice]
+
+    def _run(self, phonemes: str, pack: np.ndarray, speed: float) -> np.ndarray:
+        """Run the graph on the phonemes of one chunk."""
+        ids = [self.vocab[p] for p in phonemes if p in self.vocab]
+        tokens_name, tokens_type = self._inputs["tokens"]
+        style_name, style_type = self._inputs["style"]
+        speed_name, speed_type = self._inputs["speed"]
+        audio, *_ = self.session.run(
+            None,
+            {
+                tokens_name: np.array([[0, *ids, 0]], dtype=tokens_type),
+                # The style vector of a voice depends on the phoneme length
+                style_name: pack[len(phonemes) - 1].astype(style_type),
+                speed_name: np.array([speed], dtype=speed_type),
+            },
+        )
+        return np.asarray(audio, dtype=np.float32).reshape(-1)
+
+    def _infer(
+        self,
+        segments: List[str],
+        chunks: List[Tuple[int, str]],
+        voice: str,
+        speed: float,
+        batch_size: int,
+    ) -> List[np.ndarray]:
+        # Exported graphs take one sequence at a time, so batch_size is unused
+        pack = self._voice(voice)
+        per_segment = [[] for _ in segments]
+        for index, phonemes in chunks:
+            per_segment[index].append(self._run(phonemes, pack, speed))
+        return [_concatenate(audio) for audio in per_segment]
@@ -4,21 +4,50 @@ Kokoro TTS module.
 This module provides functions to convert text to speech using the Kokoro TTS model.
 """
 
-import os
-from typing import BinaryIO, List
-import soundfile as sf
+import itertools
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import numpy as np
 
-from dotenv import load_dotenv, find_dotenv
+from epub_to_audiobook.cache import SynthesisCache
+from epub_to_audiobook.encoders import ENCODER_FORMATS, open_encoder
+from epub_to_audiobook.phonemes import PhonemeCache
+from epub_to_audiobook.pipeline import StagedPipeline
+from epub_to_audiobook.postprocess import SegmentProcessor
+from epub_to_audiobook.progress import Progress
+from epub_to_audiobook.segmenter import engine_segments, segment_text
 
-# Attempt to load environment variables from .env file
-load_dotenv(find_dotenv())
+# Sample rate for Kokoro TTS is 24000 Hz
+SAMPLE_RATE = 24000
+
+# Maximum number of phonemes the model accepts in one segment
+MAX_PHONEMES = 510
+
+# Target length of the chunks non-English text is phonemized in, matching KPipeline
+NON_ENGLISH_CHUNK_CHARS = 400
+
+# Number of batches of segments grouped by length at a time in batched mode
+BATCH_WINDOW = 4
+
+# Number of windows of segments queued between the G2P, inference and encoding
+# stages, so that each stage can work ahead of the one after it
+PIPELINE_DEPTH = 2
+
+
+def _concatenate(chunks: List[np.ndarray]) -> np.ndarray:
+    """Concatenate audio chunks, returning an empty array if there are none."""
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
 
 
 class KokoroTTS:
     """A class to handle text-to-speech conversion using the Kokoro TTS model."""
 
-    def __init__(self, lang_code: str = "a"):
+    # Extra parameters of the cache keys of segments, set by other backends
+    cache_params: Dict = {}
+
+    def __init__(self, lang_code: str = "a", cache: Optional[SynthesisCache] = None):
         """
         Initialize the KokoroTTS class.
 
@@ -33,90 +62,461 @@ class KokoroTTS:
                        'h' - Hindi
                        'i' - Italian
                        'p' - Brazilian Portuguese
+            cache: Optional cache of synthesized segments. When given, segments
+                   that were synthesized before with the same voice and speed
+                   are read from the cache instead of the model, and the
+                   phonemes of words and phrases are stored in its directory
+                   for later runs.
         """
+        self.cache = cache
+
+        # Attempt to load environment variables from .env file
+        from dotenv import find_dotenv, load_dotenv
+
+        load_dotenv(find_dotenv())
+
         # Import dependencies here to avoid import errors if packages aren't installed
         try:
-            from kokoro import KPipeline
-
             self.lang_code = lang_code
-            self.pipeline = KPipeline(lang_code=lang_code)
+            self.pipeline = self._create_pipeline(lang_code)
         except ImportError:
             raise ImportError(
                 "The kokoro package is required. "
                 "Install it with: pip install kokoro>=0.8.2 soundfile"
             )
 
+        # Memoize G2P, so recurring words and phrases are phonemized only once
+        self.phonemes = PhonemeCache(
+            lang_code, directory=cache.directory if cache is not None else None
+        )
+        self.phonemes.install(self.pipeline)
+
+    def use_cache(self, cache: Optional[SynthesisCache]) -> None:
+        """
+        Attach a synthesis cache, keeping the phonemes in its directory too.
+
+        Used by worker processes forked from a process that loaded the model
+        without a cache, which open their own connections to the caches.
+        """
+        self.cache = cache
+        if cache is not None:
+            self.phonemes.open_store(cache.directory)
+
+    def _create_pipeline(self, lang_code: str):
+        """Load the Kokoro pipeline, which does G2P and holds the model."""
+        from kokoro import KPipeline
+
+        return KPipeline(lang_code=lang_code)
+
     def text_to_speech(
         self,
-        text: str,
+        text: Union[str, Iterable[str]],
         output_file: BinaryIO,
         voice: str = "af_heart",
         speed: float = 1.0,
-        split_pattern: str = r"\n+",
+        split_pattern: Optional[str] = None,
         audio_format: str = "wav",
+        batch_size: int = 1,
+        segment_length: Optional[int] = None,
+        progress: Optional[Progress] = None,
+        postprocess: Optional[Dict] = None,
+        pipeline_depth: int = PIPELINE_DEPTH,
     ) -> None:
         """
         Convert text to speech and write the audio to the specified file.
 
         Args:
-            text: The text to convert to speech.
+            text: The text to convert to speech, or its segments, which are
+                  then read as they are synthesized, such as those of
+                  segmenter.stream_segments.
             output_file: A file-like object (opened in binary write mode) to write the audio to.
             voice: Voice ID to use (e.g., 'af_heart').
             speed: Speech speed multiplier (1.0 is normal speed).
-            split_pattern: Regex pattern to split text into chunks.
-            audio_format: Output audio format ("wav" or "mp3").
+            split_pattern: Optional regex pattern to split text into chunks,
+                           instead of packing sentences into segments.
+            audio_format: Output audio format ("wav", "mp3", "opus", "aac",
+                          "m4b" or "pcm").
+            batch_size: Number of segments run through the model together.
+                        Values above 1 enable batched inference, which groups
+                        segments of similar length into padded batches.
+            segment_length: Target segment length in characters. Defaults to
+                            SEGMENT_LENGTHS["kokoro"].
+            progress: Optional Progress that every synthesized segment is
+                      reported to, with its G2P, inference and encoding time.
+            postprocess: Optional keyword arguments of
+                         postprocess.SegmentProcessor, which then trims,
+                         spaces and normalizes every segment before it is
+                         encoded.
+            pipeline_depth: Number of windows of segments queued between the
+                            G2P, inference and encoding stages, which then
+                            run concurrently on separate threads. With 0,
+                            every segment goes through all stages before the
+                            next one starts.
+
+        Audio is streamed to the output file segment by segment, so a partial
+        file is left behind if generation fails part way through.
         """
         # Validate parameters
-        if audio_format not in ["wav", "mp3"]:
-            raise ValueError("Audio format must be one of 'wav' or 'mp3'")
+        if audio_format not in ENCODER_FORMATS:
+            raise ValueError(
+                f"Audio format must be one of {', '.join(ENCODER_FORMATS)}"
+            )
 
-        # Sample rate for Kokoro TTS is 24000 Hz
-        sample_rate = 24000
+        if progress is None:
+            progress = Progress()
+        processor = SegmentProcessor.from_options(SAMPLE_RATE, postprocess)
 
-        # Generate audio from the text
+        # Generate audio from the text, writing each segment to the output as
+        # soon as the pipeline yields it so memory stays bounded by a few
+        # windows of segments
         try:
-            # Collect all audio chunks
-            audio_chunks = []
-            for _, _, audio in self.pipeline(
-                text, voice=voice, speed=speed, split_pattern=split_pattern
-            ):
-                audio_chunks.append(audio)
-
-            # Combine all audio chunks
-            if not audio_chunks:
-                raise ValueError("No audio was generated")
+            frames_written = 0
+            windows = self._windows(text, split_pattern, batch_size, segment_length)
+            with open_encoder(output_file, audio_format, SAMPLE_RATE) as encoder:
+                for audio in self._synthesize_windows(
+                    windows,
+                    voice,
+                    speed,
+                    batch_size,
+                    pipeline_depth,
+                    progress,
+                    processor,
+                ):
+                    if len(audio):
+                        encoder.write(audio)
+                        # Flush so the header is up to date and a partial
+                        # file remains playable if the run dies part way
+                        encoder.flush()
+                        frames_written += len(audio)
 
-            combined_audio = np.concatenate(audio_chunks)
-
-            # Write the audio to the output file
-            if audio_format == "wav":
-                sf.write(output_file, combined_audio, sample_rate)
-            elif audio_format == "mp3":
-                try:
-                    from pydub import AudioSegment
-                    import tempfile
-
-                    # First save as WAV to a temporary file
-                    with tempfile.NamedTemporaryFile(
-                        suffix=".wav", delete=False
-                    ) as temp_wav:
-                        temp_wav_path = temp_wav.name
-                        sf.write(temp_wav_path, combined_audio, sample_rate)
-
-                    # Convert WAV to MP3
-                    audio_segment = AudioSegment.from_wav(temp_wav_path)
-                    audio_segment.export(output_file, format="mp3")
-
-                    # Clean up temporary file
-                    os.unlink(temp_wav_path)
-
-                except ImportError:
-                    raise ImportError(
-                        "The pydub package is required for MP3 conversion. "
-                        "Install it with: pip install pydub"
-                    )
+                if processor is not None and frames_written:
+                    encoder.write(processor.finish())
+
+            if not frames_written:
+                raise ValueError("No audio was generated")
         except Exception as e:
             raise RuntimeError(f"Error generating audio with Kokoro TTS: {str(e)}")
+        finally:
+            # Keep the phonemes of this run for later runs, even if it failed
+            self.phonemes.flush()
+
+    def synthesize_segments(
+        self,
+        segments: Iterable[str],
+        voice: str = "af_heart",
+        speed: float = 1.0,
+        pipeline_depth: int = PIPELINE_DEPTH,
+        batch_size: int = 1,
+        progress: Optional[Progress] = None,
+        postprocess: Optional[Dict] = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Synthesize segments of text that are already split, one at a time.
+
+        Segments are taken from the iterable only when the pipeline is ready
+        for them, so the caller can decide what to synthesize next while
+        earlier segments are still being synthesized. All the segments go
+        through one pipeline, and one processor whose running loudness
+        carries over from segment to segment.
+
+        Args:
+            segments: The segments of text to synthesize.
+            voice: Voice ID to use (e.g., 'af_heart').
+            speed: Speech speed multiplier (1.0 is normal speed).
+            pipeline_depth: Number of windows of segments G2P and inference
+                            may work ahead of the consumer. 0 runs them in
+                            turn on the calling thread.
+            batch_size: Number of segments run through the model together.
+                        Values above 1 enable batched inference.
+            progress: Optional Progress that every segment is reported to,
+                      with the time until the next segment is requested as
+                      its encoding time.
+            postprocess: Optional keyword arguments of
+                         postprocess.SegmentProcessor, which then trims,
+                         spaces and normalizes every segment. The silence
+                         after the last segment isn't added.
+
+        Yields:
+            Mono float32 audio arrays sampled at SAMPLE_RATE, one per segment
+            and in the same order, empty for segments without speech.
+        """
+        windows = self._windows(segments, None, batch_size, None)
+        processor = SegmentProcessor.from_options(SAMPLE_RATE, postprocess)
+        try:
+            yield from self._synthesize_windows(
+                windows,
+                voice,
+                speed,
+                batch_size,
+                pipeline_depth,
+                progress if progress is not None else Progress(),
+                processor,
+            )
+        finally:
+            self.phonemes.flush()
+
+    def _synthesize_windows(
+        self,
+        windows: Iterable[List[str]],
+        voice: str,
+        speed: float,
+        batch_size: int,
+        pipeline_depth: int,
+        progress: Progress,
+        processor: Optional[SegmentProcessor],
+    ) -> Iterator[np.ndarray]:
+        """Run windows of segments through the pipeline and the processor."""
+        pipeline = self._pipeline(voice, speed, batch_size, pipeline_depth)
+        for window, timings in pipeline.run(windows):
+            characters = sum(len(segment) for segment, _ in window)
+            for segment, audio in window:
+                # Stages work on whole windows, which are shared out among
+                # their segments by length
+                share = len(segment) / characters if characters else 0.0
+                stages = {name: seconds * share for name, seconds in timings.items()}
+                start = time.perf_counter()
+                if processor is not None:
+                    audio = processor.process(audio)
+                    stages["postprocess"] = time.perf_counter() - start
+                processed = time.perf_counter()
+
+                # The consumer encodes the audio before asking for the next
+                yield audio
+
+                progress.segment(
+                    characters=len(segment),
+                    audio_seconds=len(audio) / SAMPLE_RATE,
+                    stages=dict(stages, encode=time.perf_counter() - processed),
+                    queues=pipeline.depths(),
+                )
+        if pipeline_depth > 0:
+            progress.emit("pipeline", stages=pipeline.stats())
+
+    def _windows(
+        self,
+        text: Union[str, Iterable[str]],
+        split_pattern: Optional[str],
+        batch_size: int,
+        segment_length: Optional[int],
+    ) -> Iterator[List[str]]:
+        """
+        Split the text into segments, grouped into windows of work.
+
+        Text that is already split into segments is grouped as it is read.
+        """
+        if isinstance(text, str):
+            segments = iter(
+                engine_segments(text, "kokoro", segment_length, split_pattern)
+            )
+        else:
+            segments = iter(text)
+
+        # Batching works through a window of segments at a time, which gives it
+        # segments of similar length to group while keeping memory bounded
+        window = batch_size * BATCH_WINDOW if batch_size > 1 else 1
+        while True:
+            segments_window = list(itertools.islice(segments, window))
+            if not segments_window:
+                return
+            yield segments_window
+
+    def _pipeline(
+        self, voice: str, speed: float, batch_size: int, depth: int
+    ) -> StagedPipeline:
+        """Build the G2P and inference stages of a window of segments."""
+        return StagedPipeline(
+            [
+                ("g2p", lambda segments: self._prepare_window(segments, voice, speed)),
+                (
+                    "inference",
+                    lambda window: self._infer_window(window, voice, speed, batch_size),
+                ),
+            ],
+            depth=depth,
+            consumer="encode",
+        )
+
+    def _prepare_window(self, segments: List[str], voice: str, speed: float) -> Dict:
+        """Look a window of segments up in the cache and phonemize the rest."""
+        keys = [None] * len(segments)
+        audios = [None] * len(segments)
+        if self.cache is not None:
+            for i, segment in enumerate(segments):
+                keys[i] = SynthesisCache.make_key(
+                    segment,
+                    "kokoro",
+                    lang_code=self.lang_code,
+                    voice=voice,
+                    speed=speed,
+                    sample_rate=SAMPLE_RATE,
+                    **self.cache_params,
+                )
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    audios[i] = np.frombuffer(cached, dtype=np.float32)
+
+        missing = [i for i, audio in enumerate(audios) if audio is None]
+        return {
+            "segments": segments,
+            "keys": keys,
+            "audios": audios,
+            "missing": missing,
+            "phonemes": self._g2p([segments[i] for i in missing]),
+        }
+
+    def _infer_window(
+        self, window: Dict, voice: str, speed: float, batch_size: int
+    ) -> List[Tuple[str, np.ndarray]]:
+        """Synthesize the segments of a window that weren't in the cache."""
+        segments = window["segments"]
+        audios = window["audios"]
+        missing = window["missing"]
+        synthesized = self._infer(
+            [segments[i] for i in missing],
+            window["phonemes"],
+            voice,
+            speed,
+            batch_size,
+        )
+        for i, audio in zip(missing, synthesized):
+            audios[i] = audio
+            if self.cache is not None and len(audio):
+                self.cache.put(window["keys"][i], audio.tobytes())
+
+        return list(zip(segments, audios))
+
+    def _g2p(self, segments: List[str]) -> List[Tuple[int, str]]:
+        """Phonemize segments, tagging each chunk with the segment it is from."""
+        return [
+            (index, phonemes)
+            for index, segment in enumerate(segments)
+            for phonemes in self._phonemize(segment)
+        ]
+
+    def _infer(
+        self,
+        segments: List[str],
+        chunks: List[Tuple[int, str]],
+        voice: str,
+        speed: float,
+        batch_size: int,
+    ) -> List[np.ndarray]:
+        """
+        Synthesize segments from their phonemes, keeping their order.
+
+        Args:
+            segments: The segments to synthesize.
+            chunks: The phonemes of the segments, as returned by _g2p.
+            voice: Voice ID to use.
+            speed: Speech speed multiplier.
+            batch_size: Number of chunks run through the model together.
+
+        Returns:
+            The audio of each segment.
+        """
+        if batch_size > 1:
+            return self._infer_batched(chunks, len(segments), voice, speed, batch_size)
+
+        from kokoro import KPipeline
+
+        model = self.pipeline.model
+        pack = self.pipeline.load_voice(voice).to(model.device)
+        per_segment = [[] for _ in segments]
+        for index, phonemes in chunks:
+            output = KPipeline.infer(model, phonemes, pack, speed)
+            per_segment[index].append(np.asarray(output.audio.cpu(), dtype=np.float32))
+        return [_concatenate(audio) for audio in per_segment]
+
+    def synthesize_chunks(
+        self, text: str, voice: str, speed: float, split_pattern: Optional[str]
+    ) -> Iterator[np.ndarray]:
+        """
+        Run Kokoro's own pipeline on a text, as the daemon does for clients.
+
+        Args:
+            text: The text to convert to speech.
+            voice: Voice ID to use.
+            speed: Speech speed multiplier.
+            split_pattern: Optional regex pattern to split the text on.
+
+        Yields:
+            The audio of each chunk the pipeline splits the text into.
+        """
+        for _, _, audio in self.pipeline(
+            text, voice=voice, speed=speed, split_pattern=split_pattern
+        ):
+            if audio is None:
+                continue
+            yield np.asarray(audio, dtype=np.float32)
+
+    def _phonemize(self, segment: str) -> Iterator[str]:
+        """Convert a segment to phoneme strings short enough for the model."""
+        if self.lang_code in "ab":
+            _, tokens = self.pipeline.g2p(segment)
+            for _, phonemes, _ in self.pipeline.en_tokenize(tokens):
+                if phonemes:
+                    yield phonemes[:MAX_PHONEMES]
+            return
+
+        for chunk in segment_text(
+            segment, NON_ENGLISH_CHUNK_CHARS, NON_ENGLISH_CHUNK_CHARS
+        ):
+            phonemes, _ = self.pipeline.g2p(chunk)
+            if phonemes:
+                yield phonemes[:MAX_PHONEMES]
+
+    def synthesize_batch(
+        self, segments: List[str], voice: str, speed: float, batch_size: int
+    ) -> List[np.ndarray]:
+        """
+        Synthesize segments with batched inference, as the daemon does.
+
+        Args:
+            segments: The segments to synthesize.
+            voice: Voice ID to use.
+            speed: Speech speed multiplier.
+            batch_size: Number of chunks run through the model together.
+
+        Returns:
+            The audio of each segment, in the order of the segments.
+        """
+        return self._infer_batched(
+            self._g2p(segments), len(segments), voice, speed, batch_size
+        )
+
+    def _infer_batched(
+        self,
+        chunks: List[Tuple[int, str]],
+        count: int,
+        voice: str,
+        speed: float,
+        batch_size: int,
+    ) -> List[np.ndarray]:
+        """Run phonemized chunks of segments through the model in batches."""
+        import torch
+
+        from epub_to_audiobook.kokoro_batch import (
+            length_sorted_batches,
+            synthesize_batch,
+        )
+
+        pack = self.pipeline.load_voice(voice)
+        chunk_audio = [None] * len(chunks)
+        for batch in length_sorted_batches(
+            [len(phonemes) for _, phonemes in chunks], batch_size
+        ):
+            # The style vector of a voice depends on the phoneme length
+            ref_s = torch.cat([pack[len(chunks[i][1]) - 1] for i in batch])
+            outputs = synthesize_batch(
+                self.pipeline.model, [chunks[i][1] for i in batch], ref_s, speed
+            )
+            for i, audio in zip(batch, outputs):
+                chunk_audio[i] = audio
+
+        per_segment = [[] for _ in range(count)]
+        for (index, _), audio in zip(chunks, chunk_audio):
+            per_segment[index].append(audio)
+        return [_concatenate(audio) for audio in per_segment]
 
     def list_available_voices(self) -> List[str]:
         """
@@ -0,0 +1,171 @@
+"""
+Pronunciation lexicon module.
+
+This module applies a dictionary of word pronunciations to text, marking each
+listed word or phrase up with its phonemes in the syntax of the TTS engine:
+phoneme tags for Fish Audio and inline phoneme links for Kokoro. The entries
+are compiled into one regular expression shaped like a prefix tree, so the
+whole text is matched in a single pass no matter how large the lexicon is,
+only whole words match, and inserted markup is never matched again.
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Union
+
+# Markup of a pronounced word for each engine. Kokoro's inline phoneme links
+# are read by misaki's English G2P.
+MARKUP = {
+    "fish": "<|phoneme_start|>{phonemes}<|phoneme_end|>",
+    "kokoro": "[{word}](/{phonemes}/)",
+}
+
+
+def _trie_pattern(words) -> str:
+    """Build a regular expression matching any of the words, as a prefix tree."""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        branches = []
+        chars = []
+        for char, child in sorted(node.items()):
+            if not char:
+                continue
+            if list(child) == [""]:
+                chars.append(char)
+            else:
+                branches.append(re.escape(char) + build(child))
+        if len(chars) == 1:
+            branches.append(re.escape(chars[0]))
+        elif chars:
+            escaped = "".join(re.escape(char) for char in chars)
+            branches.append(f"[{escaped}]")
+
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if "" in node:
+            # The prefix is a word on its own, so the rest is optional
+            pattern = f"(?:{pattern})?"
+        return pattern
+
+    return build(trie)
+
+
+class Lexicon:
+    """A dictionary of pronunciations compiled into a single-pass matcher."""
+
+    def __init__(self, entries: Dict[str, str], case_sensitive: bool = True):
+        """
+        Initialize the Lexicon class.
+
+        Args:
+            entries: A dictionary mapping words or phrases to their phonemes.
+            case_sensitive: Whether words only match with the same case.
+        """
+        self.case_sensitive = case_sensitive
+        self.entries = {
+            self._key(word): phonemes
+            for word, phonemes in entries.items()
+            if word.strip()
+        }
+
+        if self.entries:
+            flags = 0 if case_sensitive else re.IGNORECASE
+            self.pattern = re.compile(
+                rf"(?<!\w){_trie_pattern(self.entries)}(?!\w)", flags
+            )
+        else:
+            self.pattern = None
+
+    def _key(self, word: str) -> str:
+        """Return the dictionary key a word is looked up by."""
+        return word if self.case_sensitive else word.lower()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def apply(self, text: str, engine: str) -> str:
+        """
+        Mark up the words of the lexicon in a text.
+
+        Args:
+            text: The text to mark up.
+            engine: TTS engine the markup is for ("fish" or "kokoro").
+
+        Returns:
+            The text with every listed word replaced by its markup.
+
+        Raises:
+            ValueError: If the engine is not supported.
+        """
+        if engine not in MARKUP:
+            raise ValueError(f"Engine must be one of {', '.join(MARKUP)}")
+        if self.pattern is None:
+            return text
+
+        template = MARKUP[engine]
+        return self.pattern.sub(
+            lambda match: template.format(
+                word=match.group(),
+                phonemes=self.entries[self._key(match.group())],
+            ),
+            text,
+        )
+
+
+def load_lexicon(path: Union[str, Path], case_sensitive: bool = True) -> Lexicon:
+    """
+    Load a lexicon from a file.
+
+    JSON files hold an object mapping words to phonemes. Other files hold one
+    entry per line, with the word and its phonemes separated by a tab; empty
+    lines and lines starting with '#' are ignored.
+
+    Args:
+        path: Path to the lexicon file.
+        case_sensitive: Whether words only match with the same case.
+
+    Returns:
+        The loaded lexicon.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        ValueError: If the file is not a valid lexicon.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Lexicon file not found: {path}")
+
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix.lower() == ".json":
+            try:
+                entries = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid lexicon file {path}: {e}")
+            if not isinstance(entries, dict) or not all(
+                isinstance(value, str) for value in entries.values()
+            ):
+                raise ValueError(
+                    f"Invalid lexicon file {path}: expected an object mapping "
+                    "words to phonemes"
+                )
+            return Lexicon(entries, case_sensitive)
+
+        entries = {}
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, tab, phonemes = line.partition("\t")
+            if not tab or not phonemes.strip():
+                raise ValueError(
+                    f"Invalid lexicon file {path}, line {number}: expected a word "
+                    "and its phonemes separated by a tab"
+                )
+            entries[word.strip()] = phonemes.strip()
+    return Lexicon(entries, case_sensitive)
@@ -0,0 +1,212 @@
+"""
+Phoneme cache module.
+
+Kokoro converts text to phonemes (G2P) with misaki and espeak-ng before every
+model run, so recurring words and phrases such as character names, chapter
+headings and dialogue tags are phonemized again in every segment of every
+run. This module memoizes the G2P step of a Kokoro pipeline: the espeak-ng
+fallback for English words missing from misaki's lexicon, and the G2P of
+whole chunks for the other languages. Results are kept in an in-process LRU
+and, optionally, in a per-language SQLite store shared between runs.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+# Number of phonemizations kept in memory
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Number of new entries written to the store before they are committed
+_COMMIT_EVERY = 256
+
+
+class PhonemeCache:
+    """A memo of G2P results with an in-process LRU and an on-disk store."""
+
+    def __init__(
+        self,
+        lang_code: str,
+        directory: Optional[Union[str, Path]] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        Initialize the PhonemeCache class.
+
+        Args:
+            lang_code: Language code of the pipeline whose G2P is cached.
+            directory: Optional directory of the persistent store. Entries are
+                       kept in a 'phonemes-<lang_code>.sqlite' file there, which
+                       can be shared between processes.
+            max_entries: Number of entries kept in memory.
+        """
+        self.lang_code = lang_code
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._memory: "OrderedDict[str, Tuple[list, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self._db = None
+        if directory is not None:
+            self.open_store(directory)
+
+    def open_store(self, directory: Union[str, Path]) -> None:
+        """
+        Open the persistent store in a directory, closing any open one.
+
+        A process forked from the one that created the cache must open its
+        own store, since SQLite connections can't be shared across a fork.
+
+        Args:
+            directory: Directory of the 'phonemes-<lang_code>.sqlite' file.
+        """
+        import sqlite3
+
+        self.close()
+        path = Path(directory) / f"phonemes-{self.lang_code}.sqlite"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS phonemes "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, seconds REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _get(self, key: str) -> Optional[Tuple[list, float]]:
+        """Look up an entry in memory, then in the store."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, seconds FROM phonemes WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = (json.loads(row[0]), row[1])
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: Tuple[list, float]) -> None:
+        """Keep an entry in memory, evicting the least recently used."""
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _put(self, key: str, value: list, seconds: float) -> None:
+        """Store a new entry in memory and in the store."""
+        self._remember(key, (value, seconds))
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO phonemes VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), seconds),
+            )
+            self._pending += 1
+            if self._pending >= _COMMIT_EVERY:
+                self._db.commit()
+                self._pending = 0
+
+    def lookup(self, key: str, compute: Callable[[], list]) -> list:
+        """
+        Return the cached G2P result for a key, computing it on a miss.
+
+        Args:
+            key: The text that is phonemized, prefixed with its kind.
+            compute: Function that runs the G2P step, returning a
+                     JSON-serializable list.
+
+        Returns:
+            The G2P result.
+        """
+        entry = self._get(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+                self.seconds_saved += entry[1]
+            return entry[0]
+
+        start = time.perf_counter()
+        value = compute()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+        self._put(key, value, seconds)
+        return value
+
+    def install(self, pipeline) -> None:
+        """
+        Memoize the G2P step of a Kokoro pipeline.
+
+        English pipelines memoize the espeak-ng fallback per word, since the
+        rest of misaki's G2P depends on the context of the word. Other
+        pipelines memoize the G2P of whole chunks, of which Kokoro only uses
+        the phonemes.
+
+        Args:
+            pipeline: A kokoro.KPipeline instance.
+        """
+        if self.lang_code in "ab":
+            fallback = getattr(pipeline.g2p, "fallback", None)
+            if fallback is None:
+                return
+
+            def cached_fallback(token):
+                return tuple(
+                    self.lookup(f"word:{token.text}", lambda: list(fallback(token)))
+                )
+
+            pipeline.g2p.fallback = cached_fallback
+            return
+
+        g2p = pipeline.g2p
+
+        def cached_g2p(text):
+            (phonemes,) = self.lookup(f"text:{text}", lambda: [g2p(text)[0]])
+            return phonemes, None
+
+        pipeline.g2p = cached_g2p
+
+    def flush(self) -> None:
+        """Commit the entries not yet written to the store."""
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        """Commit pending entries and close the store."""
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return the hit and miss counts of this cache instance.
+
+        Returns:
+            A dictionary with the 'hits', 'misses', 'hit_rate' and the
+            'seconds_saved' by skipping G2P, estimated from the time each hit
+            entry originally took to compute.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+        }
@@ -0,0 +1,273 @@
+"""
+Staged pipeline module.
+
+This module runs a chain of processing stages concurrently, each stage on
+its own thread, connected by bounded queues: while one stage works on an
+item, the stage before it already works on the next one. Items come out in
+the order they went in. Every stage records how long it was busy, how long
+it waited for input (starved) and how long it waited for room in its output
+queue (blocked), and the depth of each queue can be read at any time, which
+shows which stage is the bottleneck: the stages after it are starved and its
+input queue is full. The consumer of the pipeline's output, such as an
+encoder on the calling thread, is recorded as a stage of its own.
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Seconds between checks for a stopped pipeline while waiting on a queue
+_POLL_SECONDS = 0.1
+
+# Marks the end of the items in a queue
+_END = object()
+
+
+class _Failure:
+    """Carries an exception raised by a stage down the pipeline."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Stopped(Exception):
+    """Raised in a stage thread when the pipeline is stopped."""
+
+
+class StagedPipeline:
+    """Runs items through a chain of stages, each on its own thread."""
+
+    def __init__(
+        self,
+        stages: List[Tuple[str, Callable]],
+        depth: int = 2,
+        consumer: str = "consumer",
+    ):
+        """
+        Initialize the StagedPipeline class.
+
+        Args:
+            stages: The name and function of each stage, in order. Each
+                    function takes the output of the stage before it (or an
+                    input item) and returns its own output.
+            depth: Number of items each queue between two stages holds. With
+                   0, the stages run one after the other on the calling
+                   thread, without any overlap.
+            consumer: Name the consumer of the output is recorded under, as
+                      the last stage.
+        """
+        self.stages = stages
+        self.depth = depth
+        self.names = [name for name, _ in stages]
+        self.consumer = consumer
+        self._queues: List[queue.Queue] = []
+        self._stats = {
+            name: {
+                "items": 0,
+                "busy": 0.0,
+                "starved": 0.0,
+                "blocked": 0.0,
+                "max_depth": 0,
+                "depth_total": 0,
+            }
+            for name in self.names + [consumer]
+        }
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    def run(self, items: Iterable) -> Iterator[Tuple[object, Dict[str, float]]]:
+        """
+        Run items through the stages.
+
+        Args:
+            items: The input items of the first stage.
+
+        Yields:
+            The output of the last stage for each item, in input order, with
+            the seconds each stage spent on it.
+
+        Raises:
+            Exception: Whatever a stage raised, once the items before the
+                       failed one have been yielded.
+        """
+        if self.depth <= 0:
+            yield from self._run_sequential(items)
+            return
+
+        stop = threading.Event()
+        self._queues = [queue.Queue(self.depth) for _ in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(index, items, stop),
+                name=f"pipeline-{name}",
+                daemon=True,
+            )
+            for index, name in enumerate(self.names)
+        ]
+        for thread in threads:
+            thread.start()
+
+        finished = False
+        try:
+            while True:
+                waited = time.perf_counter()
+                item = self._queues[-1].get()
+                self._add(self.consumer, starved=time.perf_counter() - waited)
+                self._sample()
+                if item is _END:
+                    finished = True
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                start = time.perf_counter()
+                yield item
+                self._add(self.consumer, items=1, busy=time.perf_counter() - start)
+        finally:
+            # Unblocks the stages if the consumer stopped early or failed. The
+            # first stage may be blocked reading its input, such as stdin, so
+            # it is left to exit on its own unless all items went through.
+            stop.set()
+            for thread in threads if finished else threads[1:]:
+                thread.join()
+
+    def _run_sequential(
+        self, items: Iterable
+    ) -> Iterator[Tuple[object, Dict[str, float]]]:
+        """Run each item through all stages before the next one."""
+        for item in items:
+            timings = {}
+            for name, function in self.stages:
+                start = time.perf_counter()
+                item = function(item)
+                timings[name] = time.perf_counter() - start
+                self._add(name, items=1, busy=timings[name])
+            start = time.perf_counter()
+            yield item, timings
+            self._add(self.consumer, items=1, busy=time.perf_counter() - start)
+
+    def _work(self, index: int, items: Iterable, stop: threading.Event) -> None:
+        """Run one stage until its input ends, the pipeline stops or it fails."""
+        name, function = self.stages[index]
+        output = self._queues[index]
+        inputs = (
+            ((item, {}) for item in items)
+            if index == 0
+            else self._take(self._queues[index - 1], name, stop)
+        )
+        try:
+            while True:
+                waited = time.perf_counter()
+                entry = next(inputs, _END)
+                if index == 0:
+                    self._add(name, starved=time.perf_counter() - waited)
+                if entry is _END or isinstance(entry, _Failure):
+                    self._put(output, entry, name, stop)
+                    return
+
+                item, timings = entry
+                start = time.perf_counter()
+                try:
+                    result = function(item)
+                except Exception as e:
+                    self._put(output, _Failure(e), name, stop)
+                    return
+                seconds = time.perf_counter() - start
+                self._add(name, items=1, busy=seconds)
+                self._put(
+                    output, (result, dict(timings, **{name: seconds})), name, stop
+                )
+        except _Stopped:
+            return
+        except Exception as e:
+            # A failure while reading the input items
+            try:
+                self._put(output, _Failure(e), name, stop)
+            except _Stopped:
+                pass
+
+    def _take(
+        self, source: queue.Queue, name: str, stop: threading.Event
+    ) -> Iterator[object]:
+        """Yield the entries of a queue, recording the time spent waiting."""
+        while True:
+            start = time.perf_counter()
+            while True:
+                if stop.is_set():
+                    raise _Stopped()
+                try:
+                    entry = source.get(timeout=_POLL_SECONDS)
+                    break
+                except queue.Empty:
+                    continue
+            self._add(name, starved=time.perf_counter() - start)
+            yield entry
+
+    def _put(
+        self, target: queue.Queue, entry: object, name: str, stop: threading.Event
+    ) -> None:
+        """Put an entry in a queue, recording the time spent blocked."""
+        start = time.perf_counter()
+        while True:
+            if stop.is_set():
+                raise _Stopped()
+            try:
+                target.put(entry, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        self._add(name, blocked=time.perf_counter() - start)
+        self._sample()
+
+    def _add(self, name: str, **amounts) -> None:
+        """Add to the statistics of a stage."""
+        with self._lock:
+            stats = self._stats[name]
+            for key, amount in amounts.items():
+                stats[key] += amount
+
+    def _sample(self) -> None:
+        """Record the current depth of every queue."""
+        depths = self.depths()
+        with self._lock:
+            self._samples += 1
+            for name, depth in depths.items():
+                stats = self._stats[name]
+                stats["max_depth"] = max(stats["max_depth"], depth)
+                stats["depth_total"] += depth
+
+    def depths(self) -> Dict[str, int]:
+        """
+        Return the number of items waiting in the output queue of each stage.
+
+        A full queue means the stage after it can't keep up; an empty one
+        means the stage itself, or one before it, is the slower one.
+        """
+        if not self._queues:
+            return {name: 0 for name in self.names}
+        return {name: output.qsize() for name, output in zip(self.names, self._queues)}
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Return the statistics of each stage.
+
+        Returns:
+            For each stage and the consumer, the number of items processed,
+            the seconds spent busy, starved of input and blocked on a full
+            output queue, and the largest and mean depth of the output queue.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "items": stats["items"],
+                    "busy": stats["busy"],
+                    "starved": stats["starved"],
+                    "blocked": stats["blocked"],
+                    "max_depth": stats["max_depth"],
+                    "mean_depth": (
+                        stats["depth_total"] / self._samples if self._samples else 0.0
+                    ),
+                }
+                for name, stats in self._stats.items()
+            }
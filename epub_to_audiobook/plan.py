@@ -0,0 +1,275 @@
+"""
+Book planning module.
+
+This module builds a planning index of an EPUB file: for every chapter its
+spine document, its character, word and sentence counts, a hash of its text,
+and estimates of its audio duration and of the time each engine takes to
+synthesize it. The index is saved next to the EPUB file and reused as long
+as the file is unchanged, so planning a book doesn't extract its text
+again. The estimates order the chapters for scheduling: handing the longest
+chapters to the workers first keeps one worker from finishing a long
+chapter alone at the end while the others sit idle.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from epub_to_audiobook.jobs import file_checksum, text_checksum
+from epub_to_audiobook.segmenter import split_sentences
+
+# Version of the index format, bumped when the estimates change
+INDEX_VERSION = 1
+
+# Suffix of the index file saved next to an EPUB file
+INDEX_SUFFIX = ".plan.json"
+
+# Characters of English text narrated per second of audio at speed 1.0,
+# about 160 words per minute
+CHARACTERS_PER_SECOND = 15.0
+
+# Rough seconds each engine takes to synthesize a second of audio on one
+# worker. The RTF reported at the end of a conversion gives the real figure
+# of a machine, which plan_book accepts instead.
+ENGINE_RTF = {
+    "kokoro": 0.5,
+    "fish": 0.25,
+}
+
+
+def index_path(epub_path: str) -> Path:
+    """Return the path of the planning index of an EPUB file."""
+    return Path(str(epub_path) + INDEX_SUFFIX)
+
+
+def file_stamp(epub_path: str) -> Dict[str, int]:
+    """Return the size and modification time of a file, to spot changes cheaply."""
+    stat = os.stat(epub_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def chapter_entry(index: int, chapter: Dict[str, str]) -> Dict:
+    """
+    Build the index entry of one chapter.
+
+    Args:
+        index: Number of the chapter in reading order, starting at 1.
+        chapter: The chapter, as returned by extract_chapters.
+
+    Returns:
+        The title, spine href, level, text statistics, text hash, estimated
+        audio seconds and estimated synthesis seconds of each engine.
+    """
+    text = chapter["text"]
+    audio_seconds = len(text) / CHARACTERS_PER_SECOND
+    return {
+        "index": index,
+        "title": chapter["title"],
+        "href": chapter["href"],
+        "level": chapter["level"],
+        "characters": len(text),
+        "words": len(text.split()),
+        "sentences": len(split_sentences(text)),
+        "text_hash": text_checksum(text),
+        "audio_seconds": audio_seconds,
+        "synthesis_seconds": {
+            engine: audio_seconds * rtf for engine, rtf in ENGINE_RTF.items()
+        },
+    }
+
+
+def build_index(epub_path: str, chapters: Optional[Iterable[Dict]] = None) -> Dict:
+    """
+    Build the planning index of an EPUB file.
+
+    Chapters are extracted and indexed one at a time, so only the index of
+    the book is held in memory, not its text.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        chapters: Optional chapters already extracted from the file, to avoid
+                  extracting them again.
+
+    Returns:
+        The index: the format version, the checksum, size and modification
+        time of the file and the entry of each chapter.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file.
+    """
+    if chapters is None:
+        from epub_to_audiobook.epub_handler import iter_chapters
+
+        chapters = iter_chapters(epub_path)
+
+    return {
+        "version": INDEX_VERSION,
+        "checksum": file_checksum(Path(epub_path)),
+        "stamp": file_stamp(epub_path),
+        "chapters": [
+            chapter_entry(index, chapter)
+            for index, chapter in enumerate(chapters, start=1)
+        ],
+    }
+
+
+def load_index(epub_path: str, chapters: Optional[Iterable[Dict]] = None) -> Dict:
+    """
+    Load the planning index of an EPUB file, building it if needed.
+
+    The saved index is used if the file has the same size and modification
+    time as when it was indexed. Only if those differ is the file hashed, and
+    the index still used if its checksum is the same; otherwise the index is
+    built and saved next to the file. A directory that can't be written to
+    only means the index isn't saved.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        chapters: Optional chapters already extracted from the file, used if
+                  the index has to be built.
+
+    Returns:
+        The index, as returned by build_index.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the file is not a valid EPUB file.
+    """
+    if not os.path.exists(epub_path):
+        raise FileNotFoundError(f"EPUB file not found: {epub_path}")
+
+    path = index_path(epub_path)
+    stamp = file_stamp(epub_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION:
+            if index.get("stamp") == stamp:
+                return index
+            # Copied or touched, but possibly with the same content
+            if index.get("checksum") == file_checksum(Path(epub_path)):
+                index["stamp"] = stamp
+                save_index(path, index)
+                return index
+    except (OSError, ValueError):
+        pass
+
+    index = build_index(epub_path, chapters)
+    save_index(path, index)
+    return index
+
+
+def save_index(path: Path, index: Dict) -> None:
+    """
+    Save a planning index atomically, if its directory can be written to.
+
+    Args:
+        path: Path of the index file.
+        index: The index, as returned by build_index.
+    """
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temp_path, path)
+    except BaseException as e:
+        # Never leave a partial temporary file next to the book
+        os.unlink(temp_path)
+        if not isinstance(e, OSError):
+            raise
+
+
+def longest_first(jobs: List[Dict]) -> List[Dict]:
+    """
+    Order chapter jobs by their estimated synthesis time, longest first.
+
+    Args:
+        jobs: Chapter jobs with an 'estimate' in seconds, or failing that
+              their number of 'characters'.
+
+    Returns:
+        The jobs, longest first; jobs of equal length stay in reading order.
+    """
+    return sorted(jobs, key=lambda job: -job.get("estimate", job["characters"]))
+
+
+def makespan(durations: List[float], workers: int) -> float:
+    """
+    Simulate handing chapters in order to whichever worker is free first.
+
+    Args:
+        durations: The duration of each chapter, in the order handed out.
+        workers: Number of workers.
+
+    Returns:
+        The time at which the last worker finishes.
+    """
+    finish = [0.0] * max(1, workers)
+    for duration in durations:
+        free = finish.index(min(finish))
+        finish[free] += duration
+    return max(finish)
+
+
+def plan_book(
+    epub_path: str,
+    engine: str = "kokoro",
+    workers: int = 1,
+    rtf: Optional[float] = None,
+) -> Dict:
+    """
+    Plan the conversion of an EPUB file.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        engine: TTS engine the book is planned for ("kokoro" or "fish").
+        workers: Number of workers, or concurrent requests, the chapters
+                 are shared between.
+        rtf: Optional seconds of synthesis per second of audio measured on
+             this machine, instead of the engine's rough default.
+
+    Returns:
+        The index of the book, with the estimated synthesis seconds of each
+        chapter for the engine, the totals, and the estimated wall time of
+        the conversion with the chapters handed out in reading order and
+        longest first.
+
+    Raises:
+        FileNotFoundError: If the EPUB file does not exist.
+        ValueError: If the engine is unknown, or the file is not a valid EPUB
+                    file or has no text.
+    """
+    if engine not in ENGINE_RTF:
+        raise ValueError("Engine must be one of 'kokoro' or 'fish'")
+
+    index = load_index(epub_path)
+    chapters = index["chapters"]
+    if not chapters:
+        raise ValueError(f"No chapter text found in EPUB file: {epub_path}")
+
+    for chapter in chapters:
+        chapter["estimate"] = (
+            chapter["audio_seconds"] * rtf
+            if rtf is not None
+            else chapter["synthesis_seconds"][engine]
+        )
+
+    durations = [chapter["estimate"] for chapter in chapters]
+    return dict(
+        index,
+        engine=engine,
+        workers=workers,
+        characters=sum(chapter["characters"] for chapter in chapters),
+        words=sum(chapter["words"] for chapter in chapters),
+        audio_seconds=sum(chapter["audio_seconds"] for chapter in chapters),
+        synthesis_seconds=sum(durations),
+        reading_order_seconds=makespan(durations, workers),
+        longest_first_seconds=makespan(sorted(durations, reverse=True), workers),
+    )
@@ -0,0 +1,204 @@
+"""
+Audio post-processing module.
+
+This module cleans up synthesized audio segment by segment while it streams
+to the encoder, so no second pass over the whole file is needed: silence at
+the start and end of each segment is trimmed, gaps of a set length are put
+between segments and after the last one, and the level of each segment is
+normalized towards a target loudness with a running estimate, so that
+segments and chapters sound equally loud. Every step works on whole NumPy
+arrays, in frames of 10 ms.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+
+# Length of the frames levels are measured in, in seconds
+FRAME_SECONDS = 0.01
+
+# Silence kept around speech when trimming, so onsets and decays aren't cut
+TRIM_PADDING = 0.02
+
+# Gap between segments when silence is trimmed and no gap is set, in seconds
+DEFAULT_GAP = 0.3
+
+# Length of the gain ramp between the gains of two segments, in seconds
+RAMP_SECONDS = 0.05
+
+# Highest sample value after normalization, just below full scale
+PEAK_LIMIT = 0.98
+
+
+def frame_levels(audio: np.ndarray, frame: int) -> np.ndarray:
+    """
+    Measure the RMS level of each frame of the audio.
+
+    Args:
+        audio: Mono float audio.
+        frame: Length of a frame in samples. The last frame is zero-padded.
+
+    Returns:
+        The level of each frame in dBFS.
+    """
+    padded = np.zeros(-(-len(audio) // frame) * frame, dtype=np.float32)
+    padded[: len(audio)] = audio
+    power = np.mean(padded.reshape(-1, frame) ** 2, axis=1)
+    return 10 * np.log10(np.maximum(power, 1e-12))
+
+
+def trim_silence(
+    audio: np.ndarray, sample_rate: int, threshold_db: float = -50.0
+) -> np.ndarray:
+    """
+    Remove the silence at the start and end of the audio.
+
+    Args:
+        audio: Mono float audio.
+        sample_rate: Sample rate of the audio.
+        threshold_db: Level in dBFS below which a frame counts as silence.
+
+    Returns:
+        The audio from the first to the last frame above the threshold, with
+        TRIM_PADDING of silence kept on each side, or an empty array if the
+        whole audio is silent.
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    loud = np.flatnonzero(frame_levels(audio, frame) > threshold_db)
+    if not len(loud):
+        return audio[:0]
+
+    padding = int(sample_rate * TRIM_PADDING)
+    start = max(0, loud[0] * frame - padding)
+    end = min(len(audio), (loud[-1] + 1) * frame + padding)
+    return audio[start:end]
+
+
+class SegmentProcessor:
+    """Trims, spaces and normalizes the audio of consecutive segments."""
+
+    def __init__(
+        self,
+        sample_rate: int,
+        trim_silence: bool = False,
+        threshold_db: float = -50.0,
+        gap: Optional[float] = None,
+        chapter_gap: float = 0.0,
+        loudness: Optional[float] = None,
+        max_gain_db: float = 12.0,
+        smoothing: float = 0.3,
+    ):
+        """
+        Initialize the SegmentProcessor class.
+
+        Args:
+            sample_rate: Sample rate of the audio.
+            trim_silence: Whether to trim the silence at the start and end of
+                          every segment.
+            threshold_db: Level in dBFS below which audio counts as silence,
+                          for trimming and for measuring loudness.
+            gap: Seconds of silence put between two segments. Defaults to
+                 DEFAULT_GAP when trimming silence, and to none otherwise.
+            chapter_gap: Seconds of silence put after the last segment, so
+                         that consecutive chapter files are spaced apart.
+            loudness: Optional target level of speech in dBFS (RMS of the
+                      frames above the silence threshold), such as -20.
+            max_gain_db: Largest boost or cut applied to reach the target.
+            smoothing: Weight of each new segment in the running loudness
+                       estimate, between 0 (never changes) and 1 (each
+                       segment on its own).
+        """
+        self.sample_rate = sample_rate
+        self.trim_silence = trim_silence
+        self.threshold_db = threshold_db
+        if gap is None:
+            gap = DEFAULT_GAP if trim_silence else 0.0
+        self.gap = np.zeros(int(sample_rate * gap), dtype=np.float32)
+        self.chapter_gap = np.zeros(int(sample_rate * chapter_gap), dtype=np.float32)
+        self.loudness = loudness
+        self.max_gain_db = max_gain_db
+        self.smoothing = smoothing
+
+        self._frame = max(1, int(sample_rate * FRAME_SECONDS))
+        self._level: Optional[float] = None
+        self._gain = None
+        self._first = True
+
+    @classmethod
+    def from_options(cls, sample_rate: int, options: Optional[Dict]):
+        """
+        Create a processor from a dictionary of options, if any are set.
+
+        Args:
+            sample_rate: Sample rate of the audio.
+            options: Keyword arguments of SegmentProcessor, or None.
+
+        Returns:
+            The processor, or None if no options are given.
+        """
+        if not options:
+            return None
+        return cls(sample_rate, **options)
+
+    def _speech_level(self, audio: np.ndarray) -> Optional[float]:
+        """Measure the level of the frames above the silence threshold."""
+        levels = frame_levels(audio, self._frame)
+        speech = levels[levels > self.threshold_db]
+        if not len(speech):
+            return None
+        return float(10 * np.log10(np.mean(10 ** (speech / 10))))
+
+    def _normalize(self, audio: np.ndarray) -> np.ndarray:
+        """Apply the gain that moves the running loudness to the target."""
+        level = self._speech_level(audio)
+        if level is not None:
+            if self._level is None:
+                self._level = level
+            else:
+                self._level += self.smoothing * (level - self._level)
+        if self._level is None:
+            return audio
+
+        gain_db = np.clip(
+            self.loudness - self._level, -self.max_gain_db, self.max_gain_db
+        )
+        gain = 10 ** (gain_db / 20)
+        # Never push the peak of the segment past the limit
+        peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+        if peak * gain > PEAK_LIMIT:
+            gain = PEAK_LIMIT / peak
+
+        # Ramp from the gain of the previous segment to avoid a step in level
+        previous = gain if self._gain is None else self._gain
+        self._gain = gain
+        gains = np.full(len(audio), gain, dtype=np.float32)
+        ramp = min(len(audio), int(self.sample_rate * RAMP_SECONDS))
+        gains[:ramp] = np.linspace(previous, gain, ramp, dtype=np.float32)
+        return audio * gains
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        """
+        Process the audio of the next segment.
+
+        Args:
+            audio: Mono float32 audio of the segment.
+
+        Returns:
+            The processed audio, preceded by the gap after the previous
+            segment. Empty if the segment is silent and trimmed away.
+        """
+        if self.trim_silence:
+            audio = trim_silence(audio, self.sample_rate, self.threshold_db)
+        if not len(audio):
+            return audio
+        if self.loudness is not None:
+            audio = self._normalize(audio)
+
+        if self._first:
+            self._first = False
+            return audio.astype(np.float32, copy=False)
+        return np.concatenate([self.gap, audio]).astype(np.float32, copy=False)
+
+    def finish(self) -> np.ndarray:
+        """Return the silence put after the last segment."""
+        return self.chapter_gap
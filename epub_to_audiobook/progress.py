@@ -0,0 +1,350 @@
+"""
+Progress instrumentation module.
+
+This module collects timing events of a conversion. Every synthesized
+segment reports its length, the duration of its audio and the time spent in
+each stage (G2P, inference, requests, encoding, writing), chapters report
+their totals, concurrent pipelines report how long each of their stages was
+busy or waiting, and one-off stages such as EPUB extraction report their
+duration. Events are passed as dictionaries to listeners: a live progress
+line with an ETA based on the observed real-time factor and an end-of-run
+summary, a JSON-lines log for finding hot spots after the run, or any other
+callable.
+"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Union
+
+# A listener receives every event of a run as a dictionary
+Listener = Callable[[Dict], None]
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration such as '1h02m03s', '4m05s' or '12.3s'."""
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def describe_pipeline(stages: Dict[str, Dict]) -> str:
+    """
+    Describe how busy each stage of a pipeline was, naming the bottleneck.
+
+    Args:
+        stages: The busy, starved and blocked seconds of each stage.
+
+    Returns:
+        A line such as 'g2p busy 20%, inference busy 97% (bottleneck)'.
+    """
+    shares = {}
+    for stage, stats in stages.items():
+        total = stats["busy"] + stats["starved"] + stats["blocked"]
+        shares[stage] = stats["busy"] / total if total else 0.0
+    bottleneck = max(shares, key=shares.get)
+    return ", ".join(
+        f"{stage} busy {share:.0%}" + (" (bottleneck)" if stage == bottleneck else "")
+        for stage, share in shares.items()
+    )
+
+
+class Progress:
+    """Collects the timing events of a conversion and passes them to listeners."""
+
+    def __init__(self, listeners: Optional[List[Listener]] = None, **fields):
+        """
+        Initialize the Progress class.
+
+        Args:
+            listeners: Callables that receive every event as a dictionary.
+            fields: Fields added to every event, such as the index of the
+                    chapter the events are about.
+        """
+        self.listeners = list(listeners or [])
+        self.fields = fields
+        self.created = time.time()
+        self.started = self.created
+        self.total_characters = 0
+        self.characters = 0
+        self.segments = 0
+        self.audio_seconds = 0.0
+        self.stages: Dict[str, float] = {}
+        self.pipeline: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def start(self, total_characters: int, **fields) -> None:
+        """
+        Start the synthesis part of the run, which the ETA is measured on.
+
+        Args:
+            total_characters: Number of characters of text left to synthesize.
+            fields: Extra fields of the 'start' event.
+        """
+        self.started = time.time()
+        self.total_characters = total_characters
+        self.emit("start", total_characters=total_characters, **fields)
+
+    def extend(self, characters: int) -> None:
+        """Add text found after the start of the run to the text to synthesize."""
+        with self._lock:
+            self.total_characters += characters
+
+    @contextmanager
+    def stage(self, name: str, **fields) -> Iterator[None]:
+        """Time a block of work and report it as a 'stage' event."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit(
+                "stage", stage=name, seconds=time.perf_counter() - start, **fields
+            )
+
+    def segment(
+        self, characters: int, audio_seconds: float, stages: Dict[str, float], **fields
+    ) -> None:
+        """
+        Report a synthesized segment as a 'segment' event.
+
+        Args:
+            characters: Length of the text of the segment.
+            audio_seconds: Duration of the audio of the segment.
+            stages: Seconds spent on the segment in each stage.
+            fields: Extra fields of the event.
+        """
+        self.emit(
+            "segment",
+            characters=characters,
+            audio_seconds=audio_seconds,
+            seconds=sum(stages.values()),
+            stages=stages,
+            **fields,
+        )
+
+    def emit(self, event: str, **fields) -> None:
+        """Build an event with the current time and record it."""
+        self.record({"event": event, "time": time.time(), **self.fields, **fields})
+
+    def record(self, event: Dict) -> None:
+        """
+        Add an event to the totals of the run and pass it to the listeners.
+
+        Events emitted by another Progress, such as the one of a chapter or
+        of a worker process, can be forwarded here as they are.
+        """
+        with self._lock:
+            if event["event"] == "segment":
+                self.segments += 1
+                self.characters += event["characters"]
+                self.audio_seconds += event["audio_seconds"]
+                for stage, seconds in event["stages"].items():
+                    self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+                if self.total_characters:
+                    event = dict(
+                        event,
+                        done=min(1.0, self.characters / self.total_characters),
+                        elapsed=self.elapsed(),
+                        rtf=self.rtf(),
+                        eta=self.eta(),
+                    )
+            elif event["event"] == "stage":
+                stage = event["stage"]
+                self.stages[stage] = self.stages.get(stage, 0.0) + event["seconds"]
+            elif event["event"] == "pipeline":
+                for stage, stats in event["stages"].items():
+                    totals = self.pipeline.setdefault(
+                        stage,
+                        {"busy": 0.0, "starved": 0.0, "blocked": 0.0, "max_depth": 0},
+                    )
+                    for key in ("busy", "starved", "blocked"):
+                        totals[key] += stats[key]
+                    totals["max_depth"] = max(totals["max_depth"], stats["max_depth"])
+
+            for listener in self.listeners:
+                listener(event)
+
+    def elapsed(self) -> float:
+        """Seconds since the synthesis part of the run started."""
+        return time.time() - self.started
+
+    def rtf(self) -> Optional[float]:
+        """Observed real-time factor: seconds of work per second of audio."""
+        if not self.audio_seconds:
+            return None
+        return self.elapsed() / self.audio_seconds
+
+    def eta(self) -> Optional[float]:
+        """
+        Estimated seconds until the run is finished.
+
+        The text left is assumed to take as long per character as the text
+        synthesized so far, which is the observed real-time factor applied to
+        the audio the rest of the text is expected to make.
+        """
+        if not self.characters or not self.total_characters:
+            return None
+        remaining = max(0, self.total_characters - self.characters)
+        return remaining * self.elapsed() / self.characters
+
+    def summary(self) -> Dict:
+        """
+        Return the totals of the run.
+
+        Stage times are summed over all segments, so with concurrent workers
+        or pipeline stages they can add up to more than the wall-clock time
+        of the run.
+        """
+        with self._lock:
+            summary = {
+                "seconds": time.time() - self.created,
+                "segments": self.segments,
+                "characters": self.characters,
+                "audio_seconds": self.audio_seconds,
+                "rtf": self.rtf(),
+                "stages": dict(self.stages),
+            }
+            if self.pipeline:
+                summary["pipeline"] = {
+                    stage: dict(stats) for stage, stats in self.pipeline.items()
+                }
+            return summary
+
+    def finish(self, **fields) -> Dict:
+        """Report the totals of the run as an 'end' event and return them."""
+        summary = self.summary()
+        self.emit("end", **summary, **fields)
+        return summary
+
+
+class ProgressPrinter:
+    """A listener printing chapters, a live progress line and a run summary."""
+
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        live: bool = True,
+        interval: Optional[float] = None,
+    ):
+        """
+        Initialize the ProgressPrinter class.
+
+        Args:
+            stream: Stream to print to. Defaults to stderr.
+            live: Whether to print a progress line with the ETA while
+                  segments are synthesized.
+            interval: Minimum seconds between two progress lines. Defaults to
+                      half a second on a terminal, where the line is redrawn
+                      in place, and ten seconds otherwise.
+        """
+        self.stream = stream or sys.stderr
+        self.live = live
+        self.terminal = self.stream.isatty()
+        self.interval = (
+            interval if interval is not None else (0.5 if self.terminal else 10.0)
+        )
+        self._last = 0.0
+        self._partial_line = False
+
+    def __call__(self, event: Dict) -> None:
+        if event["event"] == "segment" and self.live and "eta" in event:
+            now = time.monotonic()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._print_progress(event)
+        elif event["event"] == "chapter":
+            book = f"{event['book']}: " if "book" in event else ""
+            rtf = f", RTF {event['rtf']:.2f}" if event.get("rtf") else ""
+            self._print(
+                f"Finished chapter: {book}{event['title']} "
+                f"({format_duration(event['seconds'])}{rtf})"
+            )
+        elif event["event"] == "end":
+            self._print_summary(event)
+
+    def _print(self, line: str) -> None:
+        """Print a line, ending the progress line drawn before it."""
+        if self._partial_line:
+            self.stream.write("\r\033[K")
+            self._partial_line = False
+        print(line, file=self.stream)
+
+    def _print_progress(self, event: Dict) -> None:
+        """Print the progress line of a segment event."""
+        line = f"{event['done']:6.1%} | {format_duration(event['elapsed'])} elapsed"
+        if event["rtf"] is not None:
+            line += f" | RTF {event['rtf']:.2f}"
+        if event["eta"] is not None:
+            line += f" | ETA {format_duration(event['eta'])}"
+
+        if self.terminal:
+            self.stream.write("\r\033[K" + line)
+            self.stream.flush()
+            self._partial_line = True
+        else:
+            print(line, file=self.stream)
+
+    def _print_summary(self, event: Dict) -> None:
+        """Print the totals of an 'end' event."""
+        if not event["segments"] and not event["stages"]:
+            return
+        line = f"Finished in {format_duration(event['seconds'])}"
+        if event["audio_seconds"]:
+            line += (
+                f": {event['characters']:,} characters, "
+                f"{format_duration(event['audio_seconds'])} of audio"
+            )
+            if event["rtf"] is not None:
+                line += f", RTF {event['rtf']:.2f}"
+        self._print(line)
+
+        total = sum(event["stages"].values())
+        if total:
+            stages = sorted(event["stages"].items(), key=lambda item: -item[1])
+            self._print(
+                "Time by stage: "
+                + ", ".join(
+                    f"{stage} {format_duration(seconds)} ({seconds / total:.0%})"
+                    for stage, seconds in stages
+                )
+            )
+
+        if event.get("pipeline"):
+            self._print(f"Pipeline: {describe_pipeline(event['pipeline'])}")
+
+
+class EventLog:
+    """A listener appending every event to a JSON-lines file."""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Initialize the EventLog class.
+
+        Args:
+            path: Path of the log file. Events are appended, so the log of a
+                  resumed run follows the log of the run it resumes.
+        """
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, event: Dict) -> None:
+        if self.file.closed:
+            return
+        self.file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if event["event"] == "end":
+            self.close()
+
+    def close(self) -> None:
+        """Close the log file."""
+        if not self.file.closed:
+            self.file.close()
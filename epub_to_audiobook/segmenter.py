@@ -0,0 +1,300 @@
+"""
+Text segmentation module.
+
+This module splits text into the segments that are synthesized one at a
+time. Text is split into sentences, which are then packed into segments of
+about a target length, so that neither a text without paragraph breaks nor a
+dialogue made of many short lines ends up as segments of the wrong size for
+the engine. Segments only break inside a sentence when the sentence alone is
+longer than the maximum length.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Optional
+
+# Target segment length in characters for each engine. Kokoro runs at most
+# 510 phonemes per forward pass, and English averages a little under one
+# phoneme per character; Fish Audio requests carry more text at once.
+SEGMENT_LENGTHS = {
+    "kokoro": 250,
+    "fish": 1200,
+}
+
+# Sentence-ending punctuation, with any closing quotes or brackets, followed
+# by whitespace, or CJK sentence-ending punctuation
+_BOUNDARY = re.compile(r"[.!?…]+[\"'”’»)\]]*(?=\s)|[。！？]+[」』”’)]*")
+
+# Sentence-ending punctuation at the end of a line
+_LINE_END = re.compile(r"(?:[.!?…]+[\"'”’»)\]]*|[。！？]+[」』”’)]*)$")
+
+# Words whose trailing period doesn't end a sentence
+_ABBREVIATIONS = {
+    "mr",
+    "mrs",
+    "ms",
+    "dr",
+    "st",
+    "prof",
+    "rev",
+    "gen",
+    "col",
+    "capt",
+    "lt",
+    "sgt",
+    "jr",
+    "sr",
+    "vs",
+    "no",
+    "e.g",
+    "i.e",
+    "cf",
+    "fig",
+    "vol",
+    "ch",
+    "p",
+    "pp",
+}
+
+# Characters after which CJK text continues without a space
+_CJK_ENDINGS = "。！？」』"
+
+# Places a sentence that is too long can be broken, best first
+_CLAUSE_BREAK = re.compile(r"(?<=[,;:—–])\s+")
+_WORD_BREAK = re.compile(r"\s+")
+
+
+def _is_abbreviation(text: str) -> bool:
+    """Tell whether the word at the end of text is an abbreviation or initial."""
+    words = text.split()
+    if not words:
+        return False
+    word = words[-1].lstrip("\"'“‘([")
+    return word.lower() in _ABBREVIATIONS or (len(word) == 1 and word.isupper())
+
+
+def _paragraphs(lines: Iterable[str], eager: bool = False) -> Iterator[str]:
+    """
+    Yield the paragraphs of a sequence of lines.
+
+    A line break is a paragraph break, unless the next line starts with a
+    lowercase letter, which marks a sentence hard-wrapped across lines. When
+    eager, a paragraph is also yielded as soon as a line ends a sentence,
+    instead of once the next line shows where the paragraph ends.
+    """
+    paragraph = ""
+    for line in lines:
+        line = " ".join(line.split())
+        if not line:
+            if paragraph:
+                yield paragraph
+            paragraph = ""
+        elif paragraph and line[0].islower():
+            paragraph = f"{paragraph} {line}"
+        else:
+            if paragraph:
+                yield paragraph
+            paragraph = line
+        if eager and paragraph:
+            ending = _LINE_END.search(paragraph)
+            if ending and not (
+                ending.group().startswith(".")
+                and _is_abbreviation(paragraph[: ending.start()])
+            ):
+                yield paragraph
+                paragraph = ""
+    if paragraph:
+        yield paragraph
+
+
+def _lines(text: str) -> Iterator[str]:
+    """Yield the paragraphs of a text."""
+    return _paragraphs(text.splitlines())
+
+
+def _sentences(paragraph: str) -> Iterator[str]:
+    """Yield the sentences of a paragraph."""
+    start = 0
+    for match in _BOUNDARY.finditer(paragraph):
+        # A quotation followed by a lowercase word ("Why?" she asked) goes on
+        if paragraph[match.end() :].lstrip()[:1].islower():
+            continue
+        if match.group().startswith(".") and _is_abbreviation(
+            paragraph[start : match.start()]
+        ):
+            continue
+        sentence = paragraph[start : match.end()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    sentence = paragraph[start:].strip()
+    if sentence:
+        yield sentence
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences.
+
+    Paragraph breaks always end a sentence. Periods after common
+    abbreviations ("Mr.", "e.g.") and initials don't.
+
+    Args:
+        text: The text to split.
+
+    Returns:
+        The sentences of the text in order, with whitespace normalized.
+    """
+    return [sentence for line in _lines(text) for sentence in _sentences(line)]
+
+
+def _split_long(sentence: str, max_length: int) -> List[str]:
+    """Break a sentence longer than max_length at clauses, then at words."""
+    if len(sentence) <= max_length:
+        return [sentence]
+
+    pieces = []
+    for clauses in _pack(_CLAUSE_BREAK.split(sentence), max_length, max_length):
+        if len(clauses) <= max_length:
+            pieces.append(clauses)
+            continue
+        for words in _pack(_WORD_BREAK.split(clauses), max_length, max_length):
+            # A single word longer than the limit is cut where the limit falls
+            pieces.extend(
+                words[i : i + max_length] for i in range(0, len(words), max_length)
+            )
+    return pieces
+
+
+def _pack(
+    parts: List[str],
+    target_length: int,
+    max_length: int,
+    breaks: Optional[List[bool]] = None,
+) -> List[str]:
+    """
+    Greedily pack parts into segments.
+
+    A segment is closed when the next part would take it past max_length,
+    or past target_length once it is at least half the target. When
+    breaks marks the parts that start a paragraph, a segment that is at
+    least half the target is also closed before a paragraph.
+    """
+    segments = []
+    current = ""
+    for index, part in enumerate(parts):
+        paragraph = breaks[index] if breaks else False
+        if current:
+            length = len(current) + 1 + len(part)
+            half_full = len(current) >= target_length // 2
+            if (
+                length > max_length
+                or (half_full and length > target_length)
+                or (half_full and paragraph)
+            ):
+                segments.append(current)
+                current = ""
+        if current:
+            if paragraph:
+                separator = "\n"
+            elif current[-1] in _CJK_ENDINGS:
+                separator = ""
+            else:
+                separator = " "
+            current = f"{current}{separator}{part}"
+        else:
+            current = part
+    if current:
+        segments.append(current)
+    return segments
+
+
+def segment_text(
+    text: str, target_length: int, max_length: Optional[int] = None
+) -> List[str]:
+    """
+    Split text into segments of about a target length.
+
+    Sentences are packed together until a segment reaches the target length,
+    preferring to end segments at paragraph breaks, which are kept as line
+    breaks inside a segment. A sentence is only split when it is longer than
+    the maximum length, at clause punctuation if possible.
+
+    Args:
+        text: The text to split.
+        target_length: Target segment length in characters.
+        max_length: Maximum segment length in characters. Defaults to one and
+                    a half times the target length.
+
+    Returns:
+        The non-empty segments of the text in order.
+
+    Raises:
+        ValueError: If a length is not positive.
+    """
+    if target_length < 1:
+        raise ValueError("Segment length must be at least 1")
+    max_length = max(max_length or target_length * 3 // 2, target_length)
+
+    parts: List[str] = []
+    breaks: List[bool] = []
+    for paragraph in _lines(text):
+        for i, sentence in enumerate(_sentences(paragraph)):
+            for j, piece in enumerate(_split_long(sentence, max_length)):
+                parts.append(piece)
+                breaks.append(i == 0 and j == 0)
+    return _pack(parts, target_length, max_length, breaks)
+
+
+def engine_segments(
+    text: str,
+    engine: str,
+    segment_length: Optional[int] = None,
+    split_pattern: Optional[str] = None,
+) -> List[str]:
+    """
+    Split text into the segments an engine synthesizes one at a time.
+
+    Args:
+        text: The text to split.
+        engine: TTS engine the segments are for ("kokoro" or "fish").
+        segment_length: Target segment length in characters. Defaults to the
+                        engine's entry in SEGMENT_LENGTHS.
+        split_pattern: Optional regex pattern. When given, the text is split
+                       on it instead, without packing.
+
+    Returns:
+        The non-empty segments of the text in order.
+    """
+    if split_pattern:
+        parts = (part.strip() for part in re.split(split_pattern, text))
+        return [part for part in parts if part]
+    return segment_text(text, segment_length or SEGMENT_LENGTHS[engine])
+
+
+def stream_segments(
+    lines: Iterable[str],
+    engine: str,
+    segment_length: Optional[int] = None,
+    split_pattern: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Split text read line by line into the segments an engine synthesizes.
+
+    Lines are consumed lazily, and the segments of each paragraph are yielded
+    as soon as it is complete, so text arriving through a pipe is synthesized
+    while more is still being read, and memory stays bounded by the longest
+    paragraph.
+
+    Args:
+        lines: The lines of the text, such as a file or stdin.
+        engine: TTS engine the segments are for ("kokoro" or "fish").
+        segment_length: Target segment length in characters. Defaults to the
+                        engine's entry in SEGMENT_LENGTHS.
+        split_pattern: Optional regex pattern. When given, each paragraph is
+                       split on it instead, without packing.
+
+    Yields:
+        The non-empty segments of the text in order.
+    """
+    for paragraph in _paragraphs(lines, eager=True):
+        yield from engine_segments(paragraph, engine, segment_length, split_pattern)
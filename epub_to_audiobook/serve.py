@@ -0,0 +1,519 @@
+"""
+Audiobook streaming module.
+
+This module serves an audiobook over HTTP as HLS playlists while it is being
+synthesized, so that listening starts seconds after the conversion does
+instead of when it ends. Synthesized audio is encoded into short segments
+that are appended to an EVENT playlist of each chapter and of the whole
+book as soon as they are ready. The chapter the listener is on, known from
+the playlists and segments the player asks for, is synthesized first, so
+skipping ahead doesn't leave the listener waiting behind the chapters in
+between. Chapters are read while the first ones are synthesized, so
+synthesis starts as soon as the first chapter is read.
+"""
+
+import html
+import io
+import json
+import math
+import re
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from epub_to_audiobook.encoders import open_encoder
+from epub_to_audiobook.progress import Progress
+
+# Port the server listens on by default
+DEFAULT_PORT = 8000
+
+# Longest duration of a segment in seconds. Synthesized audio is cut at
+# segment boundaries where it can be, so most segments are shorter.
+SEGMENT_SECONDS = 30
+
+# Seconds a playlist request waits for the first segment of its playlist,
+# so that players don't give up on a playlist that is still empty
+PLAYLIST_WAIT = 20.0
+
+# Formats segments can be encoded in, with their content type. Both are
+# HLS packed audio: plain audio files, each starting with a timestamp tag.
+STREAM_FORMATS = {
+    "mp3": "audio/mpeg",
+    "aac": "audio/aac",
+}
+
+# Content type of HLS playlists
+PLAYLIST_TYPE = "application/vnd.apple.mpegurl"
+
+# Owner of the ID3 frame holding the timestamp of a packed audio segment
+_TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+
+# Clock rate of MPEG-2 timestamps in Hz
+_TIMESTAMP_RATE = 90000
+
+# Paths of the chapter playlists and segments
+_CHAPTER_PLAYLIST = re.compile(r"/chapters/(\d+)\.m3u8")
+_SEGMENT = re.compile(r"/chapters/(\d+)/(\d+)\.(\w+)")
+
+
+def _syncsafe(size: int) -> bytes:
+    """Encode a size as an ID3 syncsafe integer, 7 bits per byte."""
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def timestamp_tag(seconds: float) -> bytes:
+    """
+    Build the ID3 tag a packed audio segment starts with.
+
+    HLS players place packed audio (plain MP3 or AAC files) on the timeline
+    with the MPEG-2 timestamp of the first sample in this tag.
+
+    Args:
+        seconds: Time of the first sample of the segment.
+
+    Returns:
+        An ID3v2.4 tag with the timestamp in a PRIV frame.
+    """
+    timestamp = int(round(seconds * _TIMESTAMP_RATE)) & (2**33 - 1)
+    payload = _TIMESTAMP_OWNER + struct.pack(">Q", timestamp)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+def split_audio(audio: np.ndarray, max_frames: int) -> List[np.ndarray]:
+    """Split audio into the fewest pieces of equal length up to max_frames."""
+    pieces = max(1, math.ceil(len(audio) / max_frames))
+    return np.array_split(audio, pieces)
+
+
+class StreamedBook:
+    """The chapters of a book, synthesized into HLS segments as they are needed."""
+
+    def __init__(
+        self,
+        chapters: Iterable[Dict],
+        synthesize: Callable[[Iterable[str]], Iterator[np.ndarray]],
+        sample_rate: int,
+        directory: Path,
+        audio_format: str = "mp3",
+        segment_seconds: float = SEGMENT_SECONDS,
+        progress: Optional[Progress] = None,
+    ):
+        """
+        Initialize the StreamedBook class.
+
+        Args:
+            chapters: The chapters in reading order, each with its 'title'
+                      and the text 'segments' to synthesize. They are taken
+                      from the iterable on a background thread, and each is
+                      served and synthesized as soon as it is taken.
+            synthesize: Callable turning an iterable of text segments into
+                        an iterator of their audio, one array per segment
+                        and in the same order, such as
+                        KokoroTTS.synthesize_segments. It takes segments from
+                        the iterable only as it is ready for them.
+            sample_rate: Sample rate of the synthesized audio in Hz.
+            directory: Directory the encoded segments are written to.
+            audio_format: Format of the segments, one of STREAM_FORMATS.
+            segment_seconds: Longest duration of a segment.
+            progress: Optional Progress every synthesized segment is
+                      reported to.
+
+        Raises:
+            ValueError: If the format is not supported.
+        """
+        if audio_format not in STREAM_FORMATS:
+            raise ValueError(f"Audio format must be one of {', '.join(STREAM_FORMATS)}")
+
+        self.chapters: List[Dict] = []
+        self.loaded = False
+        self._source = chapters
+        self.synthesize = synthesize
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        self.audio_format = audio_format
+        self.segment_seconds = segment_seconds
+        self.progress = progress if progress is not None else Progress()
+        self.listener = 0
+        self.error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        self._taken = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._loader: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start reading the chapters and synthesizing on background threads."""
+        self._loader = threading.Thread(
+            target=self._load, name="streamed-book-loader", daemon=True
+        )
+        self._loader.start()
+        self._thread = threading.Thread(
+            target=self._run, name="streamed-book", daemon=True
+        )
+        self._thread.start()
+
+    def _load(self) -> None:
+        """Take the chapters from their iterable, adding each as it is taken."""
+        try:
+            for chapter in self._source:
+                texts = chapter["segments"]
+                self.progress.extend(sum(len(text) for text in texts))
+                with self._condition:
+                    self.chapters.append(
+                        {
+                            "title": chapter["title"],
+                            "texts": texts,
+                            "taken": 0,
+                            "synthesized": 0,
+                            "segments": [],
+                            "seconds": 0.0,
+                        }
+                    )
+                    self._condition.notify_all()
+        except Exception as e:
+            with self._condition:
+                self.error = e
+            print(f"Error reading the book: {e}", file=sys.stderr)
+        finally:
+            with self._condition:
+                self.loaded = True
+                self._condition.notify_all()
+
+    def has_chapter(self, number: int, timeout: float = PLAYLIST_WAIT) -> bool:
+        """
+        Tell whether the book has a chapter, waiting for it to be read.
+
+        Args:
+            number: Index of the chapter.
+            timeout: Longest time to wait in seconds.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: number < len(self.chapters) or self.loaded, timeout
+            )
+            return 0 <= number < len(self.chapters)
+
+    def complete(self, number: Optional[int] = None) -> bool:
+        """Tell whether a chapter, or the whole book, is synthesized."""
+        with self._condition:
+            return self._complete(number)
+
+    def _complete(self, number: Optional[int] = None) -> bool:
+        if number is None and not self.loaded:
+            return False
+        chapters = self.chapters if number is None else [self.chapters[number]]
+        return all(
+            chapter["synthesized"] == len(chapter["texts"]) for chapter in chapters
+        )
+
+    def listen(self, number: int) -> None:
+        """
+        Record the chapter the listener is on.
+
+        Synthesis moves on to this chapter once the segments already taken
+        are done, and to the chapters after it once it is finished.
+        """
+        with self._condition:
+            self.listener = number
+
+    def _next_chapter(self) -> Optional[int]:
+        """Find the chapter to synthesize next, starting at the listener."""
+        # The listener may be on a chapter that isn't read yet
+        count = len(self.chapters)
+        order = list(range(self.listener, count)) + list(
+            range(min(self.listener, count))
+        )
+        for number in order:
+            chapter = self.chapters[number]
+            if chapter["taken"] < len(chapter["texts"]):
+                return number
+        return None
+
+    def _texts(self) -> Iterator[str]:
+        """Yield the text segments to synthesize, in the order they are needed."""
+        while True:
+            with self._condition:
+                # Wait for more chapters while they are being read
+                self._condition.wait_for(
+                    lambda: self._next_chapter() is not None or self.loaded
+                )
+                number = self._next_chapter()
+                if number is None:
+                    return
+                chapter = self.chapters[number]
+                text = chapter["texts"][chapter["taken"]]
+                chapter["taken"] += 1
+                self._taken.append(number)
+            yield text
+
+    def _run(self) -> None:
+        """Synthesize and encode segments until every chapter is done."""
+        frames = int(self.segment_seconds * self.sample_rate)
+        try:
+            audios = self.synthesize(self._texts())
+            while True:
+                start = time.perf_counter()
+                audio = next(audios, None)
+                if audio is None:
+                    break
+                synthesized = time.perf_counter()
+
+                with self._condition:
+                    number = self._taken.popleft()
+                chapter = self.chapters[number]
+                text = chapter["texts"][chapter["synthesized"]]
+                pieces = [piece for piece in split_audio(audio, frames) if len(piece)]
+                first = len(chapter["segments"])
+                segments = [
+                    self._encode(number, first + offset, piece)
+                    for offset, piece in enumerate(pieces)
+                ]
+
+                with self._condition:
+                    chapter["segments"].extend(segments)
+                    chapter["synthesized"] += 1
+                    self._condition.notify_all()
+
+                self.progress.segment(
+                    characters=len(text),
+                    audio_seconds=len(audio) / self.sample_rate,
+                    stages={
+                        "synthesize": synthesized - start,
+                        "encode": time.perf_counter() - synthesized,
+                    },
+                    chapter=number + 1,
+                )
+            self.progress.finish()
+        except Exception as e:
+            with self._condition:
+                self.error = e
+                self._condition.notify_all()
+            print(f"Error synthesizing the book: {e}", file=sys.stderr)
+
+    def _encode(self, number: int, index: int, audio: np.ndarray) -> Dict:
+        """Encode one segment of a chapter and write it to the directory."""
+        chapter = self.chapters[number]
+        path = self.directory / str(number + 1) / f"{index}.{self.audio_format}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        output = io.BytesIO()
+        with open_encoder(output, self.audio_format, self.sample_rate) as encoder:
+            encoder.write(audio)
+        # Each chapter is a timeline of its own, starting at 0
+        path.write_bytes(timestamp_tag(chapter["seconds"]) + output.getvalue())
+
+        seconds = len(audio) / self.sample_rate
+        chapter["seconds"] += seconds
+        return {"index": index, "seconds": seconds}
+
+    def wait(self, number: Optional[int] = None, timeout: float = PLAYLIST_WAIT):
+        """
+        Wait until a playlist has a segment, is complete or synthesis failed.
+
+        Args:
+            number: Index of the chapter, or None for the whole book.
+            timeout: Longest time to wait in seconds.
+        """
+
+        def ready() -> bool:
+            if self.error is not None or self._complete(number):
+                return True
+            chapters = self.chapters if number is None else [self.chapters[number]]
+            return bool(chapters and chapters[0]["segments"])
+
+        with self._condition:
+            self._condition.wait_for(ready, timeout)
+
+    def playlist(self, number: Optional[int] = None) -> str:
+        """
+        Render the HLS playlist of a chapter or of the whole book.
+
+        The book playlist lists the chapters in reading order up to the first
+        one that isn't complete. Chapters are separate timelines, marked by
+        discontinuities.
+
+        Args:
+            number: Index of the chapter, or None for the whole book.
+
+        Returns:
+            The playlist, ending with EXT-X-ENDLIST once it is complete.
+        """
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(self.segment_seconds)}",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            "#EXT-X-START:TIME-OFFSET=0",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        with self._condition:
+            numbers = range(len(self.chapters)) if number is None else [number]
+            complete = number is not None or self.loaded
+            for position, current in enumerate(numbers):
+                chapter = self.chapters[current]
+                prefix = "" if number is not None else "chapters/"
+                if position and chapter["segments"]:
+                    lines.append("#EXT-X-DISCONTINUITY")
+                for segment in chapter["segments"]:
+                    lines.append(f"#EXTINF:{segment['seconds']:.3f},")
+                    lines.append(
+                        f"{prefix}{current + 1}/{segment['index']}.{self.audio_format}"
+                    )
+                if not self._complete(current):
+                    complete = False
+                    break
+        if complete:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def segment_path(self, number: int, index: int) -> Optional[Path]:
+        """Return the file of a segment, or None if it isn't synthesized yet."""
+        with self._condition:
+            if index >= len(self.chapters[number]["segments"]):
+                return None
+        return self.directory / str(number + 1) / f"{index}.{self.audio_format}"
+
+    def status(self) -> Dict:
+        """Return how far synthesis got in each chapter, and the listener."""
+        with self._condition:
+            return {
+                "listener": self.listener + 1,
+                "complete": self._complete(),
+                "error": str(self.error) if self.error is not None else None,
+                "chapters": [
+                    {
+                        "title": chapter["title"],
+                        "segments": len(chapter["texts"]),
+                        "synthesized": chapter["synthesized"],
+                        "audio_seconds": chapter["seconds"],
+                    }
+                    for chapter in self.chapters
+                ],
+            }
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    """Serve the page, playlists, segments and status of a streamed book."""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f"epub2audio serve: {format % args}", file=sys.stderr)
+
+    def _send(self, status: int, content_type: str, data: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        # Lets web players on other origins, such as hls.js demos, play it
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self) -> None:
+        self._send(404, "text/plain", f"Not found: {self.path}\n".encode("utf-8"))
+
+    def do_GET(self):
+        book = self.server.book
+        path = self.path.split("?", 1)[0]
+
+        if path == "/":
+            self._send(200, "text/html; charset=utf-8", self._page().encode("utf-8"))
+            return
+        if path == "/status":
+            self._send(200, "application/json", json.dumps(book.status()).encode())
+            return
+        if path == "/book.m3u8":
+            book.wait()
+            self._send(200, PLAYLIST_TYPE, book.playlist().encode("utf-8"))
+            return
+
+        match = _CHAPTER_PLAYLIST.fullmatch(path)
+        if match:
+            number = int(match.group(1)) - 1
+            if number < 0 or not book.has_chapter(number):
+                self._not_found()
+                return
+            book.listen(number)
+            book.wait(number)
+            self._send(200, PLAYLIST_TYPE, book.playlist(number).encode("utf-8"))
+            return
+
+        match = _SEGMENT.fullmatch(path)
+        if match and match.group(3) == book.audio_format:
+            number = int(match.group(1)) - 1
+            segment = (
+                book.segment_path(number, int(match.group(2)))
+                if 0 <= number < len(book.chapters)
+                else None
+            )
+            if segment is None:
+                self._not_found()
+                return
+            # The player fetches segments just ahead of what it plays
+            book.listen(number)
+            self._send(200, STREAM_FORMATS[book.audio_format], segment.read_bytes())
+            return
+
+        self._not_found()
+
+    def _page(self) -> str:
+        """Render a page playing the book, with links to the chapters."""
+        book = self.server.book
+        items = "".join(
+            f'<li><a href="chapters/{number + 1}.m3u8">'
+            f"{html.escape(chapter['title'])}</a></li>"
+            for number, chapter in enumerate(book.chapters)
+        )
+        return (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            f"<title>{html.escape(self.server.title)}</title></head><body>"
+            f"<h1>{html.escape(self.server.title)}</h1>"
+            '<audio controls autoplay src="book.m3u8"></audio>'
+            f"<ol>{items}</ol></body></html>"
+        )
+
+
+def serve_book(
+    book: StreamedBook,
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    title: str = "Audiobook",
+    verbose: bool = False,
+) -> None:
+    """
+    Synthesize a book while serving it over HTTP, until interrupted.
+
+    The server answers:
+        /                    A page playing the book (HLS plays natively in
+                             Safari; other players can open the playlists)
+        /book.m3u8           The playlist of the whole book
+        /chapters/N.m3u8     The playlist of chapter N, which the listener
+                             is then on
+        /status              How far synthesis got, as JSON
+
+    Args:
+        book: The book to synthesize and serve.
+        host: Address to listen on.
+        port: Port to listen on.
+        title: Title shown on the page.
+        verbose: Whether to log each request to stderr.
+
+    Raises:
+        OSError: If the port can't be listened on.
+    """
+    server = ThreadingHTTPServer((host, port), _StreamHandler)
+    server.book = book
+    server.title = title
+    server.verbose = verbose
+    book.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from epub_to_audiobook.batch import load_catalog
+
+
+def make_library(root: Path, names):
+    root.mkdir()
+    for name in names:
+        (root / name).write_bytes(b"")
+
+
+def test_directory_source_relative(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library(tmp_path / "lib", ["b.epub", "a.epub", "notes.txt"])
+
+    books = load_catalog(Path("lib"), Path("out"))
+
+    assert [book["epub"] for book in books] == [Path("lib/a.epub"), Path("lib/b.epub")]
+    assert all(book["epub"].exists() for book in books)
+    assert [book["output_dir"] for book in books] == [Path("out/a"), Path("out/b")]
+    assert [book["name"] for book in books] == ["a", "b"]
+
+
+def test_manifest_paths_are_relative_to_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library(tmp_path / "lib", ["a.epub", "b.epub"])
+    manifest = tmp_path / "lib" / "batch.json"
+    manifest.write_text(
+        json.dumps(["a.epub", {"epub": "b.epub", "name": "second", "priority": 2}])
+    )
+
+    books = load_catalog(Path("lib/batch.json"), Path("out"))
+
+    assert [book["epub"] for book in books] == [Path("lib/a.epub"), Path("lib/b.epub")]
+    assert books[1]["name"] == "second"
+    assert books[1]["priority"] == 2
+    assert books[1]["output_dir"] == Path("out/second")
+
+
+def test_duplicate_output_directories(tmp_path):
+    make_library(tmp_path / "lib", ["a.epub"])
+    manifest = tmp_path / "batch.json"
+    manifest.write_text(json.dumps(["lib/a.epub", {"epub": "lib/a.epub"}]))
+
+    with pytest.raises(ValueError):
+        load_catalog(manifest, tmp_path / "out")
+
+
+def test_empty_directory(tmp_path):
+    (tmp_path / "lib").mkdir()
+
+    with pytest.raises(ValueError):
+        load_catalog(tmp_path / "lib", tmp_path / "out")
@@ -0,0 +1,47 @@
+import os
+import time
+
+from epub_to_audiobook.cache import SynthesisCache
+
+
+def test_put_and_get(tmp_path):
+    cache = SynthesisCache(tmp_path, max_bytes=10_000)
+    key = SynthesisCache.make_key("Hello  world", "kokoro", voice="af_heart")
+
+    assert cache.get(key) is None
+    cache.put(key, b"audio")
+
+    assert cache.get(key) == b"audio"
+    assert SynthesisCache.make_key("Hello world", "kokoro", voice="af_heart") == key
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_overwrite_counts_entry_once(tmp_path):
+    cache = SynthesisCache(tmp_path, max_bytes=10_000)
+
+    for size in [1000, 1000, 400]:
+        cache.put("ab" * 32, b"x" * size)
+
+    assert cache.stats()["bytes"] == 400
+    assert SynthesisCache(tmp_path).stats()["bytes"] == 400
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = SynthesisCache(tmp_path, max_bytes=3500)
+    keys = [f"{i:02d}" * 32 for i in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, b"x" * 1000)
+        # Make the access times distinct and ordered
+        stamp = time.time() - 100 + age
+        os.utime(cache._path(key), (stamp, stamp))
+    cache.get(keys[0])
+
+    cache.put("99" * 32, b"x" * 1000)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == b"x" * 1000
+    assert cache.stats()["bytes"] <= 3500 * 0.9
+    assert cache.stats()["bytes"] == sum(
+        path.stat().st_size for path in tmp_path.glob("*/*.audio")
+    )
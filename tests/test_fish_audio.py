@@ -0,0 +1,35 @@
+import asyncio
+import io
+
+from epub_to_audiobook.fish_audio import FishAudioTTS
+
+
+def test_async_requests_are_windowed(monkeypatch):
+    tts = FishAudioTTS(api_key="test", concurrency=2)
+    started = []
+    written = []
+    ahead = []
+
+    async def synthesize_segment(request, key):
+        started.append(request.text)
+        ahead.append(len(started) - len(written))
+        # The first segment is slow, so the ones behind it finish first
+        await asyncio.sleep(0.05 if len(started) == 1 else 0)
+        return request.text.encode(), 0.0
+
+    monkeypatch.setattr(tts, "_synthesize_segment", synthesize_segment)
+
+    class Output(io.BytesIO):
+        def write(self, data):
+            written.append(data)
+            return super().write(data)
+
+    text = " ".join(f"Sentence {i} of the text." for i in range(40))
+    output = Output()
+    asyncio.run(
+        tts.text_to_speech_async(text, output, audio_format="pcm", segment_length=30)
+    )
+
+    assert len(started) == len(written) > 4
+    assert b"".join(written) == b"".join(text.encode() for text in started)
+    assert max(ahead) <= 4
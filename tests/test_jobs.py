@@ -0,0 +1,75 @@
+import numpy as np
+import soundfile as sf
+
+from epub_to_audiobook import jobs
+from epub_to_audiobook.jobs import INPUT_FILE, JOURNAL_FILE, Journal, run_text_job
+from epub_to_audiobook.kokoro_tts import SAMPLE_RATE
+
+
+class FakeKokoro:
+    """Synthesizes a tone whose length follows the length of the text."""
+
+    def __init__(self):
+        self.segments = []
+
+    def synthesize_segments(self, segments, progress=None, **options):
+        for segment in segments:
+            self.segments.append(segment)
+            yield np.full(len(segment) * 10, 0.1, dtype=np.float32)
+
+
+def test_journal_checks_text_and_audio(tmp_path):
+    path = tmp_path / "00001.wav"
+    path.write_bytes(b"audio")
+    journal = Journal(tmp_path / JOURNAL_FILE)
+    journal.record("00001.wav", path, "Some text.")
+
+    reloaded = Journal(tmp_path / JOURNAL_FILE)
+    assert reloaded.is_complete("00001.wav", path, "Some text.")
+    assert not reloaded.is_complete("00001.wav", path, "Other text.")
+    assert not reloaded.is_complete("00002.wav", path, "Some text.")
+
+    path.write_bytes(b"changed")
+    assert not reloaded.is_complete("00001.wav", path, "Some text.")
+
+
+def test_journal_skips_torn_last_line(tmp_path):
+    path = tmp_path / "00001.wav"
+    path.write_bytes(b"audio")
+    Journal(tmp_path / JOURNAL_FILE).record("00001.wav", path, "Text.")
+    with open(tmp_path / JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write('{"name": "00002.wav", "sha')
+
+    assert list(Journal(tmp_path / JOURNAL_FILE).entries) == ["00001.wav"]
+
+
+def test_text_job_resumes_missing_segments(tmp_path, monkeypatch):
+    engines = []
+
+    def create_engine(*args, **kwargs):
+        engines.append(FakeKokoro())
+        return engines[-1]
+
+    monkeypatch.setattr(jobs, "_create_engine", create_engine)
+    text = " ".join(f"This is sentence number {i}." for i in range(30))
+    (tmp_path / INPUT_FILE).write_text(text, encoding="utf-8")
+    output = tmp_path / "out.wav"
+    options = {"segment_length": 100}
+
+    run_text_job(tmp_path, str(output), engine_options=options)
+    first = sf.read(output)[0]
+    segments = sorted((tmp_path / "segments").iterdir())
+    assert len(segments) > 2
+    assert len(engines[0].segments) == len(segments)
+
+    # Nothing to do, so the engine isn't even loaded
+    run_text_job(tmp_path, str(output), engine_options=options)
+    assert len(engines) == 1
+
+    # A lost segment file is synthesized again, and nothing else
+    segments[1].unlink()
+    run_text_job(tmp_path, str(output), engine_options=options)
+    assert engines[1].segments == [engines[0].segments[1]]
+    assert np.array_equal(sf.read(output)[0], first)
+    assert len(first) == sum(len(segment) * 10 for segment in engines[0].segments)
+    assert sf.info(output).samplerate == SAMPLE_RATE
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from epub_to_audiobook.pipeline import StagedPipeline
+
+
+def test_items_come_out_in_order():
+    pipeline = StagedPipeline([("double", lambda x: x * 2), ("inc", lambda x: x + 1)])
+
+    outputs = [item for item, _ in pipeline.run(range(20))]
+
+    assert outputs == [x * 2 + 1 for x in range(20)]
+    assert pipeline.stats()["double"]["items"] == 20
+
+
+def test_stage_failure_is_raised_after_earlier_items():
+    def check(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+
+    outputs = []
+    with pytest.raises(ValueError):
+        for item, _ in StagedPipeline([("check", check)]).run(range(10)):
+            outputs.append(item)
+
+    assert outputs == [0, 1, 2]
+
+
+def test_consumer_error_does_not_wait_for_blocked_input():
+    release = threading.Event()
+
+    def items():
+        yield "first"
+        # Like stdin with no more input yet
+        release.wait()
+        yield "second"
+
+    pipeline = StagedPipeline([("upper", str.upper)])
+    start = time.perf_counter()
+    with pytest.raises(BrokenPipeError):
+        for item, _ in pipeline.run(items()):
+            raise BrokenPipeError()
+    elapsed = time.perf_counter() - start
+    release.set()
+
+    assert elapsed < 2.0
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from epub_to_audiobook import plan
+from epub_to_audiobook.plan import index_path, load_index
+
+CHAPTERS = [
+    {"title": "One", "href": "one.xhtml", "level": 0, "text": "A first chapter."},
+    {"title": "Two", "href": "two.xhtml", "level": 1, "text": "A second one. Longer."},
+]
+
+
+@pytest.fixture
+def epub(tmp_path):
+    path = tmp_path / "book.epub"
+    path.write_bytes(b"not really an epub")
+    return path
+
+
+@pytest.fixture
+def checksums(monkeypatch):
+    calls = []
+    checksum = plan.file_checksum
+
+    def counting_checksum(path):
+        calls.append(path)
+        return checksum(path)
+
+    monkeypatch.setattr(plan, "file_checksum", counting_checksum)
+    return calls
+
+
+def test_unchanged_file_is_not_hashed_again(epub, checksums):
+    index = load_index(str(epub), CHAPTERS)
+    assert [entry["characters"] for entry in index["chapters"]] == [16, 21]
+    assert len(checksums) == 1
+
+    assert load_index(str(epub)) == index
+    assert len(checksums) == 1
+
+
+def test_touched_file_with_same_content_keeps_index(epub, checksums):
+    index = load_index(str(epub), CHAPTERS)
+    stat = epub.stat()
+    os.utime(epub, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert load_index(str(epub))["chapters"] == index["chapters"]
+    assert len(checksums) == 2
+    # The new modification time is saved, so the next load doesn't hash
+    load_index(str(epub))
+    assert len(checksums) == 2
+
+
+def test_changed_file_is_indexed_again(epub):
+    load_index(str(epub), CHAPTERS)
+    epub.write_bytes(b"a different book")
+
+    index = load_index(str(epub), CHAPTERS[:1])
+
+    assert len(index["chapters"]) == 1
+
+
+def test_failed_save_leaves_no_temporary_file(epub, monkeypatch):
+    def failing_dump(*args, **kwargs):
+        raise TypeError("not serializable")
+
+    monkeypatch.setattr(plan.json, "dump", failing_dump)
+
+    with pytest.raises(TypeError):
+        load_index(str(epub), CHAPTERS)
+
+    assert sorted(path.name for path in epub.parent.iterdir()) == ["book.epub"]
+    assert not index_path(str(epub)).exists()
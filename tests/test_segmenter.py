@@ -0,0 +1,84 @@
+from epub_to_audiobook.segmenter import (
+    SEGMENT_LENGTHS,
+    engine_segments,
+    segment_text,
+    split_sentences,
+    stream_segments,
+)
+
+
+def words(texts):
+    return " ".join(texts).split()
+
+
+def test_sentences_are_packed_up_to_the_target():
+    text = " ".join(f"This is sentence number {i}." for i in range(100))
+
+    segments = segment_text(text, 100)
+
+    assert len(segments) > 1
+    assert all(len(segment) <= 150 for segment in segments)
+    assert all(segment.endswith(".") for segment in segments)
+    # Every segment but the last holds at least half the target
+    assert all(len(segment) >= 50 for segment in segments[:-1])
+    assert words(segments) == text.split()
+
+
+def test_segments_end_at_paragraphs():
+    first = "The first paragraph has a sentence. It has another one."
+    second = "The second paragraph starts here. And it goes on."
+
+    segments = segment_text(f"{first}\n\n{second}", 60)
+
+    assert segments == [first, second]
+
+
+def test_short_paragraphs_are_joined_with_line_breaks():
+    segments = segment_text("One.\n\nTwo.\n\nThree.", 100)
+
+    assert segments == ["One.\nTwo.\nThree."]
+
+
+def test_abbreviations_do_not_end_sentences():
+    assert split_sentences("Mr. Smith met Dr. Jones. They talked.") == [
+        "Mr. Smith met Dr. Jones.",
+        "They talked.",
+    ]
+
+
+def test_long_sentences_are_split_at_clauses_then_words():
+    clause = "a clause of several words that goes on"
+    sentence = ", ".join([clause] * 10) + "."
+
+    segments = segment_text(sentence, 60)
+
+    assert all(len(segment) <= 90 for segment in segments)
+    assert all(segment.endswith((",", ".")) for segment in segments)
+    assert words(segments) == sentence.split()
+
+    word = "x" * 200
+    assert segment_text(word, 60) == [word[:90], word[90:180], word[180:]]
+
+
+def test_engine_lengths_and_split_pattern():
+    text = " ".join(f"Sentence {i} is here." for i in range(400))
+
+    kokoro = engine_segments(text, "kokoro")
+    fish = engine_segments(text, "fish")
+
+    assert max(map(len, kokoro)) <= SEGMENT_LENGTHS["kokoro"] * 3 // 2
+    assert len(fish) < len(kokoro)
+    assert engine_segments("a|b||c", "kokoro", split_pattern=r"\|") == ["a", "b", "c"]
+
+
+def test_streamed_segments_match_whole_text():
+    text = "\n\n".join(
+        " ".join(f"Paragraph {p} sentence {i}." for i in range(30)) for p in range(5)
+    )
+
+    streamed = list(stream_segments(iter(text.splitlines(True)), "kokoro"))
+
+    assert words(streamed) == text.split()
+    assert all(
+        len(segment) <= SEGMENT_LENGTHS["kokoro"] * 3 // 2 for segment in streamed
+    )
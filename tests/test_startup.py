@@ -0,0 +1,21 @@
+import statistics
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import startup  # noqa: E402
+
+# Generous enough for a loaded CI machine; a heavy import such as torch or
+# numpy is caught by the import check rather than the time
+BUDGET_SECONDS = 1.5
+
+
+@pytest.mark.parametrize("name", list(startup.SCENARIOS))
+def test_help_and_validation_stay_light(name):
+    loaded, times = startup.run_scenario(startup.SCENARIOS[name], repeat=3)
+
+    assert loaded == []
+    assert statistics.median(times) < BUDGET_SECONDS